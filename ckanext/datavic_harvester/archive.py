@@ -0,0 +1,200 @@
+"""Compressed, indexed archive of harvested records.
+
+Records are stored as JSON Lines, compressed in blocks of BLOCK_SIZE records.
+Each block is a complete gzip member, so the archive as a whole is a regular
+gzip file (``zcat`` works), while a single block can be decompressed on its
+own. A JSON index next to the archive maps each record key to the offset of
+its block and its line in the block, which lets a few records be read back
+without decompressing the whole archive.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import zlib
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Optional
+
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".idx.json"
+INDEX_VERSION = 1
+BLOCK_SIZE = 100
+
+_READ_CHUNK_SIZE = 64 * 1024
+
+
+class ArchiveWriter:
+    """Write records one at a time into an archive and its index.
+
+    Records written before open() or after a write error are only counted.
+    Write errors are kept in `error` instead of being raised."""
+
+    def __init__(
+        self, key: Callable[[dict[str, Any]], str], block_size: int = BLOCK_SIZE
+    ):
+        self.count = 0
+        self.error: Optional[OSError] = None
+
+        self._key = key
+        self._block_size = block_size
+        self._file: Optional[BinaryIO] = None
+        self._index_path: Optional[str] = None
+        self._index: dict[str, tuple[int, int]] = {}
+        self._block: list[str] = []
+        self._block_keys: list[str] = []
+        self._offset = 0
+
+    def open(self, archive_path: str, index_path: str) -> None:
+        self._file = open(archive_path, "wb")
+        self._index_path = index_path
+
+    def write(self, record: dict[str, Any]) -> None:
+        self.count += 1
+
+        if not self._file:
+            return
+
+        self._block.append(
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        )
+        self._block_keys.append(self._key(record))
+
+        if len(self._block) >= self._block_size:
+            self._flush_block()
+
+    def close(self) -> None:
+        if not self._file:
+            return
+
+        self._flush_block()
+
+        if not self._file:
+            return
+
+        try:
+            self._file.close()
+
+            with open(self._index_path, "w", encoding="utf-8") as f:  # type: ignore
+                json.dump(
+                    {"version": INDEX_VERSION, "records": self._index},
+                    f,
+                    separators=(",", ":"),
+                )
+        except OSError as e:
+            self._fail(e)
+
+        self._file = None
+
+    def _flush_block(self) -> None:
+        if not self._block or not self._file:
+            return
+
+        data = gzip.compress("".join(self._block).encode("utf-8"))
+
+        try:
+            self._file.write(data)
+        except OSError as e:
+            self._fail(e)
+            return
+
+        for line, key in enumerate(self._block_keys):
+            self._index[key] = (self._offset, line)
+
+        self._offset += len(data)
+        self._block = []
+        self._block_keys = []
+
+    def _fail(self, error: OSError) -> None:
+        self.error = error
+        file, self._file = self._file, None
+
+        try:
+            file.close()  # type: ignore
+        except OSError:
+            pass
+
+
+def read_archive(
+    archive_path: str,
+    index_path: Optional[str] = None,
+    keys: Optional[Iterable[str]] = None,
+    key: Optional[Callable[[dict[str, Any]], str]] = None,
+) -> Iterator[dict[str, Any]]:
+    """Yield the records of an archive, or only the ones with the given keys.
+
+    Selected records are read through the index, decompressing only the
+    blocks that contain them. Without an index the whole archive is scanned
+    and `key` is used to select the records."""
+    if keys is None:
+        yield from _read_all(archive_path)
+        return
+
+    keys = set(keys)
+    index = _load_index(index_path) if index_path else None
+
+    if index is None:
+        if key is None:
+            raise ValueError("key is required to select records without an index")
+
+        for record in _read_all(archive_path):
+            if key(record) in keys:
+                yield record
+        return
+
+    blocks: dict[int, list[int]] = {}
+    for record_key in sorted(keys):
+        position = index.get(record_key)
+
+        if position is None:
+            log.warning("Record %s is not in the archive %s", record_key, archive_path)
+            continue
+
+        offset, line = position
+        blocks.setdefault(offset, []).append(line)
+
+    with open(archive_path, "rb") as f:
+        for offset in sorted(blocks):
+            lines = _read_block(f, offset)
+
+            for line in sorted(blocks[offset]):
+                yield json.loads(lines[line])
+
+
+def _read_all(archive_path: str) -> Iterator[dict[str, Any]]:
+    with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_block(f: BinaryIO, offset: int) -> list[str]:
+    """Decompress the single gzip member starting at offset"""
+    f.seek(offset)
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    chunks = []
+
+    while not decompressor.eof:
+        chunk = f.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(decompressor.decompress(chunk))
+
+    return b"".join(chunks).decode("utf-8").splitlines()
+
+
+def _load_index(index_path: str) -> Optional[dict[str, list[int]]]:
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning("Could not read the archive index %s: %s", index_path, e)
+        return None
+
+    if index.get("version") != INDEX_VERSION:
+        log.warning("Unsupported archive index version in %s", index_path)
+        return None
+
+    return index["records"]
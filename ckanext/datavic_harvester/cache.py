@@ -0,0 +1,247 @@
+"""Persistent cache for values derived from remote resources.
+
+Entries are keyed by URL and keep the HTTP validators (ETag, Last-Modified and
+Content-Length) of the response they were derived from, so the next harvest can
+revalidate them with a conditional request instead of downloading the resource
+again. Entries live in a local SQLite file shared by all harvester processes,
+expire after a TTL and are evicted least-recently-used first.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from os import path
+from typing import Any, NamedTuple, Optional
+
+import ckan.plugins.toolkit as tk
+from ckan.lib.uploader import get_storage_path
+
+
+log = logging.getLogger(__name__)
+
+CONFIG_CACHE_PATH = "ckanext.datavic_harvester.cache_path"
+
+# Expired and surplus entries are purged every N writes rather than on every one.
+_EVICT_EVERY = 256
+
+_caches: dict[str, Optional["ValidatorCache"]] = {}
+_caches_lock = threading.Lock()
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_length: Optional[str]
+    stored_at: float
+
+
+class ValidatorCache:
+    """URL-keyed cache of derived values and the validators they depend on"""
+
+    def __init__(self, db_path: str, namespace: str, ttl: int, max_entries: int):
+        self.db_path = db_path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS validator_cache (
+                namespace TEXT NOT NULL,
+                url TEXT NOT NULL,
+                value TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                content_length TEXT,
+                stored_at REAL NOT NULL,
+                used_at REAL NOT NULL,
+                PRIMARY KEY (namespace, url)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS validator_cache_used_at "
+            "ON validator_cache (namespace, used_at)"
+        )
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """Return the entry stored for url, unless it is missing or expired"""
+        try:
+            return self._get(url)
+        except sqlite3.Error as e:
+            log.warning("Could not read the %s cache: %s", self.namespace, e)
+            return None
+
+    def _get(self, url: str) -> Optional[CacheEntry]:
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, etag, last_modified, content_length, stored_at "
+                "FROM validator_cache WHERE namespace = ? AND url = ?",
+                (self.namespace, url),
+            ).fetchone()
+
+            if not row:
+                return None
+
+            if self.ttl and row[4] < now - self.ttl:
+                self._conn.execute(
+                    "DELETE FROM validator_cache WHERE namespace = ? AND url = ?",
+                    (self.namespace, url),
+                )
+                return None
+
+            self._conn.execute(
+                "UPDATE validator_cache SET used_at = ? "
+                "WHERE namespace = ? AND url = ?",
+                (now, self.namespace, url),
+            )
+
+        return CacheEntry(json.loads(row[0]), row[1], row[2], row[3], row[4])
+
+    def set(
+        self,
+        url: str,
+        value: Any,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        content_length: Optional[str] = None,
+    ) -> None:
+        try:
+            self._set(url, value, etag, last_modified, content_length)
+        except sqlite3.Error as e:
+            log.warning("Could not write the %s cache: %s", self.namespace, e)
+
+    def _set(
+        self,
+        url: str,
+        value: Any,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        content_length: Optional[str],
+    ) -> None:
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO validator_cache "
+                "(namespace, url, value, etag, last_modified, content_length, "
+                "stored_at, used_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.namespace,
+                    url,
+                    json.dumps(value),
+                    etag,
+                    last_modified,
+                    content_length,
+                    now,
+                    now,
+                ),
+            )
+
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict(now)
+
+    def record_hit(self) -> None:
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            (entries,) = self._conn.execute(
+                "SELECT COUNT(*) FROM validator_cache WHERE namespace = ?",
+                (self.namespace,),
+            ).fetchone()
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used ones above
+        max_entries. Must be called with the lock held."""
+        evicted = 0
+
+        if self.ttl:
+            evicted += self._conn.execute(
+                "DELETE FROM validator_cache WHERE namespace = ? AND stored_at < ?",
+                (self.namespace, now - self.ttl),
+            ).rowcount
+
+        if self.max_entries:
+            evicted += self._conn.execute(
+                "DELETE FROM validator_cache WHERE namespace = ? AND url IN ("
+                "SELECT url FROM validator_cache WHERE namespace = ? "
+                "ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.max_entries),
+            ).rowcount
+
+        if evicted:
+            self.evictions += evicted
+            log.debug("Evicted %d %s cache entries", evicted, self.namespace)
+
+
+def get_cache(namespace: str, ttl: int, max_entries: int) -> Optional[ValidatorCache]:
+    """Return the process-wide cache for a namespace, or None when the cache
+    file cannot be used"""
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = _open_cache(namespace, ttl, max_entries)
+
+        return _caches[namespace]
+
+
+def _open_cache(namespace: str, ttl: int, max_entries: int) -> Optional[ValidatorCache]:
+    db_path = _get_cache_path()
+
+    if not db_path:
+        log.warning(
+            "Neither %s nor ckan.storage_path is set, the %s cache is disabled",
+            CONFIG_CACHE_PATH,
+            namespace,
+        )
+        return None
+
+    try:
+        os.makedirs(path.dirname(db_path), exist_ok=True)
+        return ValidatorCache(db_path, namespace, ttl, max_entries)
+    except (OSError, sqlite3.Error) as e:
+        log.warning("Could not open the %s cache at %s: %s", namespace, db_path, e)
+        return None
+
+
+def _get_cache_path() -> Optional[str]:
+    db_path = tk.config.get(CONFIG_CACHE_PATH)
+
+    if db_path:
+        return db_path
+
+    storage_path = get_storage_path()
+    if not storage_path:
+        return None
+
+    return path.join(storage_path, "harvest", "datavic_harvester_cache.sqlite3")
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import logging
-from typing import Optional, Any
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Any
 from urllib.parse import urlparse
 
 import requests
@@ -14,6 +17,17 @@ from ckan.lib.helpers import json
 from ckanext.harvest.model import HarvestObject
 from ckanext.harvest.harvesters import HarvesterBase
 
+from ckanext.datavic_harvester.cache import CacheEntry, ValidatorCache, get_cache
+from ckanext.datavic_harvester.http_session import (
+    HarvesterSession,
+    SessionSettings,
+    get_download_proxies,
+    get_session,
+    get_session_settings,
+    validate_session_config,
+)
+from ckanext.datavic_harvester.indexing import validate_indexing_config
+
 
 log = logging.getLogger(__name__)
 
@@ -25,16 +39,75 @@ DOWNLOAD_TIMEOUT = 30
 CONFIG_FSC_EXCLUDED_DOMAINS = tk.aslist(
     tk.config.get("ckanext.datavic_harvester.filesize_excluded_domains", "")
 )
+FILESIZE_MAX_WORKERS = int(
+    tk.config.get("ckanext.datavic_harvester.filesize_max_workers") or 4
+)
+FILESIZE_MAX_PER_HOST = int(
+    tk.config.get("ckanext.datavic_harvester.filesize_max_per_host") or 2
+)
+FILESIZE_DEADLINE = int(
+    tk.config.get("ckanext.datavic_harvester.filesize_deadline") or 300
+)
+FILESIZE_CACHE_ENABLED = tk.asbool(
+    tk.config.get("ckanext.datavic_harvester.filesize_cache_enabled", False)
+)
+FILESIZE_CACHE_TTL = int(
+    tk.config.get("ckanext.datavic_harvester.filesize_cache_ttl") or 604800
+)
+FILESIZE_CACHE_MAX_ENTRIES = int(
+    tk.config.get("ckanext.datavic_harvester.filesize_cache_max_entries") or 100000
+)
+UPDATE_FREQUENCY_CACHE_ENABLED = tk.asbool(
+    tk.config.get("ckanext.datavic_harvester.update_frequency_cache_enabled", False)
+)
+UPDATE_FREQUENCY_CACHE_TTL = int(
+    tk.config.get("ckanext.datavic_harvester.update_frequency_cache_ttl") or 86400
+)
+UPDATE_FREQUENCY_CACHE_MAX_ENTRIES = int(
+    tk.config.get("ckanext.datavic_harvester.update_frequency_cache_max_entries")
+    or 10000
+)
+PROBE_HEAD = "head"
+PROBE_RANGE = "range"
+PROBE_STREAM = "stream"
+FILESIZE_PROBE_STRATEGIES = [
+    strategy
+    for strategy in tk.aslist(
+        tk.config.get(
+            "ckanext.datavic_harvester.filesize_probe_strategies", "head range stream"
+        )
+    )
+    if strategy in (PROBE_HEAD, PROBE_RANGE)
+] + [PROBE_STREAM]
+
+# A strategy that failed this many times in a row for a host is skipped for
+# that host until _PROBE_FAILURE_TTL seconds have passed since the last failure
+_PROBE_FAILURE_LIMIT = 3
+_PROBE_FAILURE_TTL = 3600
+
+_filesize_executor: Optional[ThreadPoolExecutor] = None
+# hosts with probes running or waiting, see _use_host_slot
+_host_slots: dict[Optional[str], "_HostSlot"] = {}
+_filesize_lock = threading.Lock()
+_host_probe_failures: dict[tuple[Optional[str], str], tuple[int, float]] = {}
 
 
 class DataVicBaseHarvester(HarvesterBase):
     def __init__(self, **kwargs):
         self.test = kwargs.get("test", False)
+        # (source config string, parsed config) of the last _set_config call
+        self._parsed_config: Optional[tuple[str, dict[str, Any]]] = None
         super().__init__(**kwargs)
 
     def _set_config(self, config_str: str) -> None:
         if config_str:
-            self.config = json.loads(config_str)
+            # Called for every harvest object of a job with the same string,
+            # so it is only parsed when it changes. The config is not modified
+            # by the harvesters.
+            if not self._parsed_config or self._parsed_config[0] != config_str:
+                self._parsed_config = (config_str, json.loads(config_str))
+
+            self.config = self._parsed_config[1]
 
             if "api_version" in self.config:
                 self.api_version = int(self.config["api_version"])
@@ -51,6 +124,8 @@ class DataVicBaseHarvester(HarvesterBase):
         self._validate_default_groups(config_obj)
         self._set_default_groups_data(config_obj)
         self._validate_default_license(config_obj)
+        validate_session_config(config_obj)
+        validate_indexing_config(config_obj)
 
         return json.dumps(config_obj, indent=4)
 
@@ -118,12 +193,18 @@ class DataVicBaseHarvester(HarvesterBase):
         return None
 
     def _make_request(
-        self, url: str, headers: Optional[dict[str, Any]] = None
+        self,
+        url: str,
+        headers: Optional[dict[str, Any]] = None,
+        session: Optional[HarvesterSession] = None,
     ) -> Optional[str]:
-        """Make a GET request to a URL"""
+        """Make a GET request to a URL, with the session of the source config
+        unless another session is given"""
 
         try:
-            resp: requests.Response = requests.get(url, headers=headers)
+            resp: requests.Response = (session or self._get_session()).get(
+                url, headers=headers
+            )
         except requests.HTTPError as e:
             log.error("HTTP error: %s %s", e.response.status_code, e.request.url)
         except requests.RequestException as e:
@@ -133,6 +214,14 @@ class DataVicBaseHarvester(HarvesterBase):
         else:
             return resp.text
 
+    def _get_session(self) -> HarvesterSession:
+        """Return the shared HTTP session for the source config"""
+        return get_session(self._get_session_settings())
+
+    def _get_session_settings(self) -> SessionSettings:
+        """Return the HTTP session settings of the source config"""
+        return get_session_settings(getattr(self, "config", None) or {})
+
     def fetch_stage(self, harvest_object: HarvestObject) -> bool:
         return True
 
@@ -157,11 +246,27 @@ class DataTooBigWarning(Exception):
     pass
 
 
-def get_resource_size(resource_url: str) -> int:
+class UnsupportedProbe(Exception):
+    """The server did not report the resource size for this probe"""
+
+
+class ProbeStopped(Exception):
+    """The deadline of the batch passed while the resource was measured"""
+
+
+def get_resource_size(
+    resource_url: str,
+    stop: Optional[threading.Event] = None,
+    session_settings: Optional[SessionSettings] = None,
+) -> int:
     """Return external resource size in bytes
 
     Args:
         resource_url (str): a URL for the resource’s source
+        stop (threading.Event): when set, the measuring is abandoned and the
+            size is 0
+        session_settings (SessionSettings): HTTP session settings of the
+            harvest source, the CKAN config defaults if not given
 
     Returns:
         int: resource size in bytes
@@ -177,10 +282,40 @@ def get_resource_size(resource_url: str) -> int:
     if hostname in CONFIG_FSC_EXCLUDED_DOMAINS:
         return length
 
+    cache = get_filesize_cache()
+    cached = cache.get(resource_url) if cache else None
+    response = None
+
     try:
-        headers = {}
+        headers = _get_conditional_headers(cached)
+
+        for strategy in _get_probe_strategies(hostname):
+            if stop is not None and stop.is_set():
+                raise ProbeStopped()
+
+            try:
+                response = _send_probe(
+                    strategy, resource_url, headers, session_settings
+                )
+            except UnsupportedProbe:
+                _record_probe_result(hostname, strategy, False)
+                continue
+
+            _record_probe_result(hostname, strategy, True)
+            break
+
+        if cache and cached and _is_unchanged(response, cached):
+            response.close()
+            cache.record_hit()
+            log.info(
+                f"Resource from url <{resource_url}> is unchanged, "
+                f"reusing its cached length of {cached.value} bytes."
+            )
+            return cached.value
+
+        if cache:
+            cache.record_miss()
 
-        response = _get_response(resource_url, headers)
         ct = response.headers.get("content-type")
         cl = response.headers.get("content-length")
         cl_enabled = tk.asbool(tk.config.get(
@@ -195,6 +330,20 @@ def get_resource_size(resource_url: str) -> int:
             log.warning(message)
             return length
 
+        if strategy != PROBE_STREAM:
+            response.close()
+            length = _get_total_length(response)
+
+            if length > MAX_CONTENT_LENGTH and MAX_CONTENT_LENGTH > 0:
+                raise DataTooBigWarning()
+
+            log.info(
+                f"Resource from url <{resource_url}> length is {length} bytes "
+                f"({strategy} request)."
+            )
+            _store_resource_size(cache, resource_url, response, length)
+            return length
+
         if cl:
             if int(cl) > MAX_CONTENT_LENGTH and MAX_CONTENT_LENGTH > 0:
                 response.close()
@@ -205,15 +354,21 @@ def get_resource_size(resource_url: str) -> int:
                 log.info(
                     f"Resource from url <{resource_url}> content-length is {int(cl)} bytes."
                 )
+                _store_resource_size(cache, resource_url, response, int(cl))
                 return int(cl)
 
         for chunk in response.iter_content(CHUNK_SIZE):
+            if stop is not None and stop.is_set():
+                response.close()
+                raise ProbeStopped()
+
             length += len(chunk)
             if length > MAX_CONTENT_LENGTH:
                 response.close()
                 raise DataTooBigWarning()
 
         response.close()
+        _store_resource_size(cache, resource_url, response, length)
 
     except DataTooBigWarning:
         message = (
@@ -222,8 +377,16 @@ def get_resource_size(resource_url: str) -> int:
         )
         log.warning(message)
         length = -1  # for the purpose of search possibility in the db
+        _store_resource_size(cache, resource_url, response, length)
         return length
 
+    except ProbeStopped:
+        log.warning(
+            f"Resource from url <{resource_url}> was not measured "
+            f"within {FILESIZE_DEADLINE}s. Stop its size calculation."
+        )
+        return 0
+
     except requests.exceptions.HTTPError as error:
         log.debug(f"HTTP error: {error}")
 
@@ -238,15 +401,394 @@ def get_resource_size(resource_url: str) -> int:
     return length
 
 
-def _get_response(url, headers):
+def get_filesize_cache() -> Optional[ValidatorCache]:
+    """Return the persistent resource size cache, or None if it is disabled"""
+    if not FILESIZE_CACHE_ENABLED:
+        return None
+
+    return get_cache("filesize", FILESIZE_CACHE_TTL, FILESIZE_CACHE_MAX_ENTRIES)
+
+
+def get_update_frequency_cache() -> Optional[ValidatorCache]:
+    """Return the persistent cache of update frequencies derived from full
+    metadata pages, or None if it is disabled"""
+    if not UPDATE_FREQUENCY_CACHE_ENABLED:
+        return None
+
+    return get_cache(
+        "update_frequency",
+        UPDATE_FREQUENCY_CACHE_TTL,
+        UPDATE_FREQUENCY_CACHE_MAX_ENTRIES,
+    )
+
+
+def fetch_derived_value(
+    url: str,
+    derive: Callable[[Iterator[str]], Any],
+    session: requests.Session,
+    cache: Optional[ValidatorCache] = None,
+) -> Any:
+    """Return the value derived from the page at url.
+
+    derive gets the decoded page in chunks as it is downloaded. The
+    connection is closed once it returns, so the rest of the page is not
+    downloaded. With a cache, the page is requested conditionally and the
+    value derived from the unchanged page is reused instead of deriving it
+    again. Request errors are raised."""
+    cached = cache.get(url) if cache else None
+    response = session.get(
+        url, headers=_get_conditional_headers(cached), stream=True
+    )
+
+    if cache and cached and _is_unchanged(response, cached):
+        response.close()
+        cache.record_hit()
+        return cached.value
+
+    try:
+        response.raise_for_status()
+        response.encoding = response.encoding or "utf-8"
+        value = derive(response.iter_content(CHUNK_SIZE, decode_unicode=True))
+    finally:
+        response.close()
+
+    if cache:
+        cache.record_miss()
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        cl = _get_total_length(response)
+
+        # without validators the entry could never be revalidated
+        if etag or last_modified:
+            cache.set(
+                url,
+                value,
+                etag=etag,
+                last_modified=last_modified,
+                content_length=None if cl is None else str(cl),
+            )
+
+    return value
+
+
+def _get_conditional_headers(cached: Optional[CacheEntry]) -> dict[str, str]:
+    headers = {}
+
+    if not cached:
+        return headers
+
+    if cached.etag:
+        headers["If-None-Match"] = cached.etag
+
+    if cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+
+    return headers
+
+
+def _is_unchanged(response: requests.Response, cached: CacheEntry) -> bool:
+    """Check if the resource behind the response is the one the cached size
+    was measured for.
+
+    Servers that ignore conditional requests answer with a full 200 response,
+    in that case we compare the validators ourselves."""
+    if response.status_code == 304:
+        return True
+
+    etag = response.headers.get("etag")
+    last_modified = response.headers.get("last-modified")
+    cl = _get_total_length(response)
+
+    if cl is not None and cached.content_length and str(cl) != cached.content_length:
+        return False
+
+    if etag and cached.etag:
+        return etag == cached.etag
+
+    if last_modified and cached.last_modified:
+        return last_modified == cached.last_modified
+
+    return False
+
+
+def _store_resource_size(
+    cache: Optional[ValidatorCache],
+    resource_url: str,
+    response: Optional[requests.Response],
+    length: int,
+) -> None:
+    if not cache or response is None:
+        return
+
+    etag = response.headers.get("etag")
+    last_modified = response.headers.get("last-modified")
+
+    # without validators the entry could never be revalidated
+    if not etag and not last_modified:
+        return
+
+    cl = _get_total_length(response)
+
+    cache.set(
+        resource_url,
+        length,
+        etag=etag,
+        last_modified=last_modified,
+        content_length=None if cl is None else str(cl),
+    )
+
+
+def _send_probe(
+    strategy: str,
+    resource_url: str,
+    headers: dict[str, str],
+    session_settings: Optional[SessionSettings] = None,
+) -> requests.Response:
+    """Request the resource with one of the probing strategies.
+
+    HEAD and range requests only need the response headers. They ask for an
+    uncompressed representation, so the reported length is the size of the
+    resource itself. Streaming GET is the last resort and always succeeds
+    unless the request fails."""
+    if strategy == PROBE_STREAM:
+        return _get_response(resource_url, headers, session_settings=session_settings)
+
+    headers = dict(headers, **{"Accept-Encoding": "identity"})
+
+    try:
+        if strategy == PROBE_HEAD:
+            response = _get_response(
+                resource_url, headers, method="head", session_settings=session_settings
+            )
+        else:
+            headers["Range"] = "bytes=0-0"
+            response = _get_response(
+                resource_url, headers, session_settings=session_settings
+            )
+    except requests.exceptions.HTTPError as error:
+        if error.response is not None and error.response.status_code in (404, 410):
+            raise
+
+        raise UnsupportedProbe() from error
+
+    if (
+        response.status_code == 304
+        or _is_html(response)
+        or _get_total_length(response) is not None
+    ):
+        return response
+
+    response.close()
+    raise UnsupportedProbe()
+
+
+def _get_total_length(response: requests.Response) -> Optional[int]:
+    """Return the resource size reported by the response headers"""
+    if response.status_code == 206:
+        _range, _sep, total = response.headers.get("content-range", "").rpartition("/")
+        return int(total) if total.isdigit() else None
+
+    if response.headers.get("content-encoding", "identity") != "identity":
+        return None
+
+    cl = response.headers.get("content-length")
+    return int(cl) if cl and cl.isdigit() else None
+
+
+def _is_html(response: requests.Response) -> bool:
+    ct = response.headers.get("content-type")
+    return bool(ct and "text/html" in ct)
+
+
+def _get_probe_strategies(hostname: Optional[str]) -> list[str]:
+    """Return the probing strategies to try for a host, without the ones
+    that keep failing for it"""
+    now = time.monotonic()
+
+    with _filesize_lock:
+        strategies = []
+
+        for strategy in FILESIZE_PROBE_STRATEGIES:
+            failures, failed_at = _host_probe_failures.get(
+                (hostname, strategy), (0, 0.0)
+            )
+
+            if (
+                strategy != PROBE_STREAM
+                and failures >= _PROBE_FAILURE_LIMIT
+                and now - failed_at < _PROBE_FAILURE_TTL
+            ):
+                continue
+
+            strategies.append(strategy)
+
+        return strategies
+
+
+def _record_probe_result(hostname: Optional[str], strategy: str, supported: bool):
+    if strategy == PROBE_STREAM:
+        return
+
+    key = (hostname, strategy)
+
+    with _filesize_lock:
+        if supported:
+            _host_probe_failures.pop(key, None)
+            return
+
+        failures = _host_probe_failures.get(key, (0, 0.0))[0] + 1
+        _host_probe_failures[key] = (failures, time.monotonic())
+
+    if failures == _PROBE_FAILURE_LIMIT:
+        log.info(
+            f"Host {hostname} does not report resource sizes for {strategy} "
+            f"requests. Skip them for {_PROBE_FAILURE_TTL}s."
+        )
+
+
+def get_resource_sizes(
+    resource_urls: list[str], session_settings: Optional[SessionSettings] = None
+) -> list[int]:
+    """Return external resource sizes in bytes, in the order of resource_urls
+
+    Each distinct URL is measured once with get_resource_size. The probes run
+    concurrently on a shared, bounded thread pool, with at most
+    FILESIZE_MAX_PER_HOST probes against the same host at a time. URLs that
+    are still being probed after FILESIZE_DEADLINE seconds get a size of 0,
+    the same value as a failed probe. Their probes are stopped, so they give
+    back their thread and host slot.
+
+    Args:
+        resource_urls (list[str]): URLs for the resources’ sources
+        session_settings (SessionSettings): HTTP session settings of the
+            harvest source, the CKAN config defaults if not given
+
+    Returns:
+        list[int]: resource sizes in bytes
+    """
+    unique_urls = list(dict.fromkeys(resource_urls))
+
+    if len(unique_urls) < 2 or FILESIZE_MAX_WORKERS < 2:
+        sizes = {
+            url: get_resource_size(url, session_settings=session_settings)
+            for url in unique_urls
+        }
+        return [sizes[url] for url in resource_urls]
+
+    deadline = time.monotonic() + FILESIZE_DEADLINE
+    stop = threading.Event()
+    executor = _get_filesize_executor()
+    futures: dict[str, Future[int]] = {
+        url: executor.submit(
+            _get_resource_size_before_deadline, url, deadline, stop, session_settings
+        )
+        for url in unique_urls
+    }
+
+    done, not_done = wait(futures.values(), timeout=FILESIZE_DEADLINE)
+
+    if not_done:
+        stop.set()
+
+    sizes: dict[str, int] = {}
+    for url, future in futures.items():
+        if future in done:
+            sizes[url] = future.result()
+            continue
+
+        future.cancel()
+        log.warning(
+            f"Resource from url <{url}> was not measured "
+            f"within {FILESIZE_DEADLINE}s. Skip its size calculation."
+        )
+        sizes[url] = 0
+
+    return [sizes[url] for url in resource_urls]
+
+
+def _get_filesize_executor() -> ThreadPoolExecutor:
+    global _filesize_executor
+
+    with _filesize_lock:
+        if _filesize_executor is None:
+            _filesize_executor = ThreadPoolExecutor(
+                max_workers=FILESIZE_MAX_WORKERS,
+                thread_name_prefix="datavic-filesize",
+            )
+
+        return _filesize_executor
+
+
+class _HostSlot:
+    """Limits the number of concurrent probes against a host"""
+
+    def __init__(self):
+        self.semaphore = threading.BoundedSemaphore(max(FILESIZE_MAX_PER_HOST, 1))
+        # probes holding or waiting for the semaphore
+        self.users = 0
+
+
+@contextmanager
+def _use_host_slot(hostname: Optional[str]) -> Iterator[threading.BoundedSemaphore]:
+    """Return the semaphore of a host. It is dropped once no probe holds or
+    waits for it, so the hosts of past resources do not pile up in a
+    long-running process."""
+    with _filesize_lock:
+        slot = _host_slots.get(hostname)
+
+        if slot is None:
+            slot = _host_slots[hostname] = _HostSlot()
+
+        slot.users += 1
+
+    try:
+        yield slot.semaphore
+    finally:
+        with _filesize_lock:
+            slot.users -= 1
+
+            if not slot.users:
+                del _host_slots[hostname]
+
+
+def _get_resource_size_before_deadline(
+    resource_url: str,
+    deadline: float,
+    stop: threading.Event,
+    session_settings: Optional[SessionSettings] = None,
+) -> int:
+    """Measure a resource once a slot for its host is free, unless the batch
+    deadline has passed while waiting for it. The measuring stops when the
+    stop event is set at the deadline, which frees the slot."""
+    with _use_host_slot(urlparse(resource_url).hostname) as slot:
+        if not slot.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            return 0
+
+        try:
+            if stop.is_set() or time.monotonic() >= deadline:
+                return 0
+
+            return get_resource_size(resource_url, stop, session_settings)
+        finally:
+            slot.release()
+
+
+def _get_response(url, headers, method="get", session_settings=None):
+    """Request a resource. With the session settings of a harvest source,
+    its timeout and retries apply, otherwise DOWNLOAD_TIMEOUT and the CKAN
+    config defaults."""
+
     def get_url():
-        kwargs = {"headers": headers, "timeout": 30, "stream": True}
+        kwargs = {"headers": headers, "stream": True}
+
+        if session_settings is None:
+            kwargs["timeout"] = DOWNLOAD_TIMEOUT
 
-        if "ckan.download_proxy" in tk.config:
-            proxy = tk.config.get("ckan.download_proxy")
-            kwargs["proxies"] = {"http": proxy, "https": proxy}
+        proxies = get_download_proxies()
+        if proxies:
+            kwargs["proxies"] = proxies
 
-        return requests.get(url, **kwargs)
+        return get_session(session_settings).request(method, url, **kwargs)
 
     response = get_url()
     if response.status_code == 202:
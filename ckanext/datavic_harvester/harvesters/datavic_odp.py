@@ -10,7 +10,6 @@ from __future__ import annotations
 import json
 import logging
 
-import requests
 from requests.exceptions import HTTPError, RequestException
 
 import ckan.plugins.toolkit as tk
@@ -20,6 +19,9 @@ from ckanext.harvest.harvesters.ckanharvester import ContentFetchError, SearchEr
 from ckanext.harvest.model import HarvestObject
 from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
 
+from ckanext.datavic_harvester.http_session import get_session, get_session_settings
+from ckanext.datavic_harvester.indexing import deferred_indexing
+
 log = logging.getLogger(__name__)
 
 _DELETE_MARKER = "status"
@@ -124,7 +126,11 @@ class DataVicODPHarvester(CKANHarvester, BasketBasicHarvester):
                             "user": self._get_user_name(),
                             "ignore_auth": True,
                         }
-                        tk.get_action("package_delete")(ctx, {"id": package_id})
+                        with deferred_indexing(
+                            harvest_object, self.config
+                        ) as deferred_import:
+                            tk.get_action("package_delete")(ctx, {"id": package_id})
+                            deferred_import.result = True
                         log.info(
                             "%s: moved package %s to trash (no longer in source)",
                             self.SRC_ID,
@@ -143,7 +149,11 @@ class DataVicODPHarvester(CKANHarvester, BasketBasicHarvester):
             self._set_config(harvest_object.source.config)
             self._transmute_content(package_dict)
             harvest_object.content = json.dumps(package_dict)
-            return super().import_stage(harvest_object)
+
+            with deferred_indexing(harvest_object, self.config) as deferred_import:
+                deferred_import.result = super().import_stage(harvest_object)
+
+            return deferred_import.result
         except Exception as e:
             log.error(f"{self.SRC_ID}: import stage failed: {e}")
             return False
@@ -178,7 +188,9 @@ class DataVicODPHarvester(CKANHarvester, BasketBasicHarvester):
             headers["X-CKAN-API-Key"] = api_key
 
         try:
-            http_request = requests.get(url, headers=headers)
+            http_request = get_session(get_session_settings(self.config or {})).get(
+                url, headers=headers
+            )
         except HTTPError as e:
             raise ContentFetchError(
                 "HTTP error: %s %s" % (e.response.status_code, e.request.url)
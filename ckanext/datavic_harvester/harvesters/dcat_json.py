@@ -3,24 +3,56 @@ from __future__ import annotations
 import json
 import logging
 from os import path
-from typing import Optional, Any
+from typing import Iterable, NamedTuple, Optional, Any
 
-from bs4 import BeautifulSoup
+import requests
 
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+
+from ckan import model
 from ckan.plugins import toolkit as tk
 
 from ckanext.dcat import converters
 from ckanext.dcat.harvesters._json import DCATJSONHarvester
-from ckanext.harvest.model import HarvestObject
+from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
 
 from ckanext.datavic_harvester import helpers
-from ckanext.datavic_harvester.harvesters.base import DataVicBaseHarvester, get_resource_size
+from ckanext.datavic_harvester.harvesters.base import (
+    DataVicBaseHarvester,
+    fetch_derived_value,
+    get_resource_sizes,
+    get_update_frequency_cache,
+)
+from ckanext.datavic_harvester.indexing import deferred_indexing
 
 
 log = logging.getLogger(__name__)
 
+# Keys of the values fetched in fetch_stage, stored in the harvest object content
+FETCHED_UPDATE_FREQUENCY = "_update_frequency"
+FETCHED_RESOURCE_SIZES = "_resource_sizes"
+
+DEFAULT_UPDATE_FREQUENCY = "unknown"
+
+# Number of guids per query when looking up existing datasets
+EXISTING_DATASETS_CHUNK_SIZE = 500
+
+
+class ExistingDataset(NamedTuple):
+    """The fields of an existing dataset import_stage compares"""
+
+    id: str
+    date_modified_data_asset: Optional[str]
+
 
 class DataVicDCATJSONHarvester(DCATJSONHarvester, DataVicBaseHarvester):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._current_job_id: Optional[str] = None
+        # full metadata URL -> update_frequency, fetched during the current job
+        self._update_frequencies: dict[str, str] = {}
+
     def info(self):
         return {
             "name": "datavic_dcat_json",
@@ -34,34 +66,219 @@ class DataVicDCATJSONHarvester(DCATJSONHarvester, DataVicBaseHarvester):
         self._validate_default_custodian_field(
             config_obj, "default_contact_point"
         )
+
+        if "force_all" in config_obj and not isinstance(
+            config_obj["force_all"], bool
+        ):
+            try:
+                config_obj["force_all"] = tk.asbool(config_obj["force_all"])
+            except ValueError as e:
+                raise ValueError("force_all must be a boolean") from e
+
         return json.dumps(config_obj, indent=4)
 
     def gather_stage(self, harvest_job):
+        """Create a harvest object for each new or modified dataset of the
+        catalogue and for each dataset removed from it.
+
+        The modified date of a dataset is compared with the one of the
+        dataset harvested from it before, read for the whole source with one
+        query, so unchanged datasets are not queued. With force_all, every
+        dataset is queued."""
+        log.debug("In DataVicDCATJSONHarvester gather_stage")
         self._set_config(harvest_job.source.config)
-        return super().gather_stage(harvest_job)
+
+        guid_to_package_id: dict[str, str] = dict(
+            model.Session.query(HarvestObject.guid, HarvestObject.package_id)
+            .filter(HarvestObject.current == True)  # noqa: E712
+            .filter(HarvestObject.harvest_source_id == harvest_job.source.id)
+        )
+        modified_dates = (
+            {} if self._force_all() else self._get_modified_dates(harvest_job.source.id)
+        )
+
+        ids: list[str] = []
+        guids_in_source: set[str] = set()
+        previous_guids: list[str] = []
+        unchanged_count = 0
+        page = 1
+
+        while True:
+            try:
+                content, _content_type = self._get_content_and_type(
+                    harvest_job.source.url, harvest_job, page
+                )
+            except requests.exceptions.HTTPError as error:
+                if error.response.status_code != 404:
+                    raise
+
+                if page > 1:
+                    log.debug("404 after first page, no more pages")
+                    break
+
+                self._save_gather_error(
+                    "Could not get content. Server responded with 404 Not Found",
+                    harvest_job,
+                )
+                return None
+
+            if not content:
+                return None
+
+            try:
+                batch_guids: list[str] = []
+
+                for guid, as_string in self._get_guids_and_datasets(content):
+                    batch_guids.append(guid)
+
+                    if guid in previous_guids:
+                        continue
+
+                    pkg_modified = modified_dates.get(guid)
+                    if pkg_modified and pkg_modified == self._get_modified_date(
+                        json.loads(as_string)
+                    ):
+                        unchanged_count += 1
+                        log.debug(f"Dataset with guid {guid} wasn't modified, skipping")
+                        continue
+
+                    status = "change" if guid in guid_to_package_id else "new"
+                    obj = HarvestObject(
+                        guid=guid,
+                        job=harvest_job,
+                        package_id=guid_to_package_id.get(guid),
+                        content=as_string,
+                        extras=[HarvestObjectExtra(key="status", value=status)],
+                    )
+                    obj.save()
+                    ids.append(obj.id)
+
+                if not batch_guids:
+                    log.debug("Empty document, no more records")
+                    break
+
+                guids_in_source.update(batch_guids)
+            except ValueError as e:
+                self._save_gather_error(f"Error parsing file: {e}", harvest_job)
+                return None
+
+            if sorted(previous_guids) == sorted(batch_guids):
+                log.debug("Same content, no more pages")
+                break
+
+            page += 1
+            previous_guids = batch_guids
+
+        for guid in set(guid_to_package_id) - guids_in_source:
+            obj = HarvestObject(
+                guid=guid,
+                job=harvest_job,
+                package_id=guid_to_package_id[guid],
+                extras=[HarvestObjectExtra(key="status", value="delete")],
+            )
+            model.Session.query(HarvestObject).filter_by(guid=guid).update(
+                {"current": False}, False
+            )
+            obj.save()
+            ids.append(obj.id)
+
+        log.info(
+            f"Gathered {len(ids)} datasets, skipped {unchanged_count} unchanged datasets"
+        )
+        return ids
+
+    def fetch_stage(self, harvest_object):
+        """Fetch the full metadata page and the resource sizes of the dataset
+        and store them in the harvest object content, so the import stage only
+        writes to the database"""
+        if not harvest_object.content:
+            return super().fetch_stage(harvest_object)
+
+        self._set_config(harvest_object.source.config)
+        self._start_job(harvest_object.harvest_job_id)
+
+        try:
+            dcat_dict: dict[str, Any] = json.loads(harvest_object.content)
+        except ValueError:
+            # reported by the import stage
+            return super().fetch_stage(harvest_object)
+
+        pkg_dict = converters.dcat_to_ckan(dcat_dict)
+        notes = helpers.sanitise_html(pkg_dict["notes"])
+        metadata_url = self._get_full_metadata_url(pkg_dict, notes.links)
+
+        if metadata_url:
+            dcat_dict[FETCHED_UPDATE_FREQUENCY] = self._fetch_update_frequency(
+                metadata_url
+            )
+
+        urls = [resource["url"] for resource in pkg_dict.get("resources", [])]
+        dcat_dict[FETCHED_RESOURCE_SIZES] = dict(
+            zip(urls, get_resource_sizes(urls, self._get_session_settings()))
+        )
+
+        harvest_object.content = json.dumps(dcat_dict)
+        return super().fetch_stage(harvest_object)
 
     def import_stage(self, harvest_object):
         self._set_config(harvest_object.source.config)
+        self._start_job(harvest_object.harvest_job_id)
 
-        package_dict, dcat_dict = self._get_package_dict(harvest_object)
-        dcat_modified = dcat_dict.get("modified")
-        existing_dataset = self._get_existing_dataset(harvest_object.guid)
+        # delete objects have no content
+        dcat_modified = harvest_object.content and self._get_modified_date(
+            json.loads(harvest_object.content)
+        )
+        existing_dataset = (
+            None
+            if self._force_all() or not dcat_modified
+            else self._get_existing_datasets([harvest_object.guid]).get(
+                harvest_object.guid
+            )
+        )
 
         if dcat_modified and existing_dataset:
-            dcat_modified = helpers.convert_date_to_isoformat(
-                dcat_modified, "modified", dcat_dict["title"]
-            ).lower().split("t")[0]
+            pkg_modified = existing_dataset.date_modified_data_asset
 
-            pkg_modified = existing_dataset['date_modified_data_asset']
-            
             if pkg_modified and pkg_modified == dcat_modified:
                 log.info(
-                    f"Dataset with id {existing_dataset['id']} wasn't modified "
+                    f"Dataset with id {existing_dataset.id} wasn't modified "
                     "from the last harvest. Skipping this dataset..."
                 )
                 return False
 
-        return super().import_stage(harvest_object)
+        with deferred_indexing(harvest_object, self.config) as deferred_import:
+            deferred_import.result = super().import_stage(harvest_object)
+
+        return deferred_import.result
+
+    def _force_all(self) -> bool:
+        return tk.asbool(self.config.get("force_all", False))
+
+    def _get_modified_date(self, dcat_dict: dict[str, Any]) -> Optional[str]:
+        """Return the modified date of a DCAT dataset in the form of the
+        date_modified_data_asset of the datasets harvested from it"""
+        dcat_modified = helpers.convert_date_to_isoformat(
+            dcat_dict.get("modified"), "modified", dcat_dict.get("title")
+        )
+
+        return dcat_modified.lower().split("t")[0] if dcat_modified else None
+
+    def _get_modified_dates(self, source_id: str) -> dict[str, str]:
+        """Return the date_modified_data_asset of the active datasets
+        harvested by the source, by guid"""
+        return {
+            guid: dataset.date_modified_data_asset
+            for guid, dataset in self._query_existing_datasets(
+                source_id=source_id
+            ).items()
+            if dataset.date_modified_data_asset
+        }
+
+    def _start_job(self, job_id: Optional[str]) -> None:
+        """Drop the update frequencies fetched during another job"""
+        if job_id != self._current_job_id:
+            self._current_job_id = job_id
+            self._update_frequencies = {}
 
     def _get_package_dict(
         self, harvest_object: HarvestObject
@@ -72,78 +289,108 @@ class DataVicDCATJSONHarvester(DCATJSONHarvester, DataVicBaseHarvester):
         dcat_dict: dict[str, Any] = json.loads(harvest_object.content)
         pkg_dict = converters.dcat_to_ckan(dcat_dict) 
 
-        soup: BeautifulSoup = BeautifulSoup(pkg_dict["notes"], "html.parser")
+        notes = helpers.sanitise_html(pkg_dict["notes"])
 
         pkg_dict["name"] = self._get_package_name(harvest_object, pkg_dict["title"])
 
-        self._set_description_and_extract(pkg_dict, soup)
-        self._set_full_metadata_url_and_update_frequency(pkg_dict, soup)
+        self._set_description_and_extract(pkg_dict, notes)
+        self._set_full_metadata_url_and_update_frequency(
+            pkg_dict, notes.links, dcat_dict.get(FETCHED_UPDATE_FREQUENCY)
+        )
         self._mutate_tags(pkg_dict)
         self._set_default_group(pkg_dict)
         self._set_required_fields_defaults(dcat_dict, pkg_dict)
 
         return pkg_dict, dcat_dict
 
-    def _set_description_and_extract(self, pkg_dict: dict[str, Any], soup) -> None:
+    def _set_description_and_extract(
+        self, pkg_dict: dict[str, Any], notes: helpers.SanitisedHtml
+    ) -> None:
         if "default.description" in pkg_dict["notes"]:
             pkg_dict["notes"] = "No description has been entered for this dataset."
             pkg_dict["extract"] = "No abstract has been entered for this dataset."
         else:
-            pkg_dict["notes"] = helpers.unwrap_all_except(
-                helpers.remove_all_attrs_except_for(soup),
-            )
-            pkg_dict["extract"] = self._generate_extract(soup)
+            pkg_dict["notes"] = notes.html
+            pkg_dict["extract"] = self._generate_extract(notes)
 
-    def _generate_extract(self, soup: BeautifulSoup) -> str:
+    def _generate_extract(self, notes: helpers.SanitisedHtml) -> str:
         """Extract is the first sentence of the description/notes"""
 
         try:
-            notes = soup.get_text()
-            index = notes.index(".")
-            notes = notes[: index + 1]
+            index = notes.text.index(".")
         except Exception as ex:
-            log.error(f"Generate extract error for: {soup}")
+            log.error(f"Generate extract error for: {notes.html}")
             log.error(str(ex))
             return ""
-        return notes
+        return notes.text[: index + 1]
 
     def _set_full_metadata_url_and_update_frequency(
-        self, pkg_dict: dict[str, Any], soup: BeautifulSoup
+        self,
+        pkg_dict: dict[str, Any],
+        links: list[str],
+        update_frequency: Optional[str] = None,
     ) -> None:
+        """Set the full metadata URL and the update frequency from its page.
+        The update frequency is only fetched here when fetch_stage did not."""
+        metadata_url = self._get_full_metadata_url(pkg_dict, links)
+
+        if metadata_url:
+            pkg_dict["update_frequency"] = (
+                update_frequency or self._fetch_update_frequency(metadata_url)
+            )
+            pkg_dict["full_metadata_url"] = metadata_url
+
+    def _get_full_metadata_url(
+        self, pkg_dict: dict[str, Any], links: list[str]
+    ) -> Optional[str]:
+        """Return the full metadata URL of the dataset, the default one of the
+        source or the first link of the description matching the pattern of
+        the source"""
         metadata_url: Optional[str] = self._get_extra(pkg_dict, "full_metadata_url")
 
         if not metadata_url and "default_full_metadata_url" in self.config:
             metadata_url = self.config["default_full_metadata_url"]
 
         if not metadata_url and "full_metadata_url_pattern" in self.config:
-            desc_metadata_url: Optional[str] = helpers.extract_metadata_url(
-                soup, self.config["full_metadata_url_pattern"]
+            desc_metadata_url: Optional[str] = helpers.find_metadata_url(
+                links, self.config["full_metadata_url_pattern"]
             )
 
             if desc_metadata_url:
                 metadata_url = desc_metadata_url
 
-        if metadata_url:
-            pkg_dict["update_frequency"] = self._fetch_update_frequency(metadata_url)
-            pkg_dict["full_metadata_url"] = metadata_url
+        return metadata_url
 
     def _fetch_update_frequency(self, full_metadata_url: str) -> str:
-        """Fetch an update_frequency by full_metadata_url"""
+        """Fetch an update_frequency by full_metadata_url.
 
-        default_udp_frequency: str = "unknown"
+        Each URL is requested once per job. With the update frequency cache
+        enabled, the page is requested conditionally and the frequency found
+        in an unchanged page is reused."""
+        if self.test:
+            return self._parse_update_frequency([self._get_mocked_full_metadata()])
 
-        resp_text: Optional[str] = (
-            self._get_mocked_full_metadata()
-            if self.test
-            else self._make_request(full_metadata_url)
-        )
+        if full_metadata_url in self._update_frequencies:
+            return self._update_frequencies[full_metadata_url]
 
-        if not resp_text:
-            log.error(f"Request error occured during fetching update_frequency")
-            return default_udp_frequency
+        try:
+            update_frequency = fetch_derived_value(
+                full_metadata_url,
+                self._parse_update_frequency,
+                self._get_session(),
+                get_update_frequency_cache(),
+            )
+        except requests.RequestException as e:
+            log.error(f"Request error occured during fetching update_frequency: {e}")
+            return DEFAULT_UPDATE_FREQUENCY
 
-        soup: BeautifulSoup = BeautifulSoup(resp_text, "html.parser")
+        self._update_frequencies[full_metadata_url] = update_frequency
+        return update_frequency
 
+    def _parse_update_frequency(self, page: Iterable[str]) -> str:
+        """Map the frequency of updates in a full metadata page, read in
+        chunks, to an update_frequency. The rest of the page is not read once
+        the frequency is found."""
         frequency_mapping: dict[str, str] = {
             "deemed": "asNeeded",
             "week": "weekly",
@@ -153,14 +400,14 @@ class DataVicDCATJSONHarvester(DCATJSONHarvester, DataVicBaseHarvester):
             "quarter": "quarterly",
         }
 
-        for tag in soup(
-            "script", attrs={"id": "tpx_ExternalView_Frequency_of_Updates"}
+        for text in helpers.iter_script_texts(
+            page, "tpx_ExternalView_Frequency_of_Updates"
         ):
             for k, v in frequency_mapping.items():
-                if k in tag.string:
+                if k in text:
                     return v
 
-        return default_udp_frequency
+        return DEFAULT_UPDATE_FREQUENCY
 
     def _mutate_tags(self, pkg_dict: dict[str, Any]) -> None:
         """Replace ampersands with "and" in tags"""
@@ -265,8 +512,75 @@ class DataVicDCATJSONHarvester(DCATJSONHarvester, DataVicBaseHarvester):
         if not isinstance(value, str):
             raise ValueError(f"{key} must be a string")
 
+    def _get_existing_datasets(self, guids: list[str]) -> dict[str, ExistingDataset]:
+        """Return the id and date_modified_data_asset of the active datasets
+        with the guids, by guid, with one query per chunk of guids"""
+        datasets: dict[str, ExistingDataset] = {}
+
+        for start in range(0, len(guids), EXISTING_DATASETS_CHUNK_SIZE):
+            datasets.update(
+                self._query_existing_datasets(
+                    guids=guids[start : start + EXISTING_DATASETS_CHUNK_SIZE]
+                )
+            )
+
+        return datasets
+
+    def _query_existing_datasets(
+        self,
+        guids: Optional[list[str]] = None,
+        source_id: Optional[str] = None,
+    ) -> dict[str, ExistingDataset]:
+        """Return the id and date_modified_data_asset of the active datasets
+        with the guids and/or harvested by the source, by guid.
+
+        A guid shared by several datasets is left out, so it is never skipped
+        as unchanged; the upstream import_stage decides for it."""
+        guid_extra = aliased(model.PackageExtra)
+        modified_extra = aliased(model.PackageExtra)
+
+        query = (
+            model.Session.query(
+                guid_extra.value, model.Package.id, modified_extra.value
+            )
+            .join(guid_extra, guid_extra.package_id == model.Package.id)
+            .outerjoin(
+                modified_extra,
+                and_(
+                    modified_extra.package_id == model.Package.id,
+                    modified_extra.key == "date_modified_data_asset",
+                ),
+            )
+            .filter(guid_extra.key == "guid")
+            .filter(model.Package.state == "active")
+        )
+
+        if guids is not None:
+            query = query.filter(guid_extra.value.in_(guids))
+
+        if source_id is not None:
+            query = (
+                query.join(HarvestObject, HarvestObject.package_id == model.Package.id)
+                .filter(HarvestObject.current == True)  # noqa: E712
+                .filter(HarvestObject.harvest_source_id == source_id)
+            )
+
+        datasets: dict[str, ExistingDataset] = {}
+        duplicates: set[str] = set()
+
+        for guid, package_id, modified in query:
+            if datasets.setdefault(guid, ExistingDataset(package_id, modified)).id != package_id:
+                duplicates.add(guid)
+
+        for guid in duplicates:
+            log.error(f"Found more than one dataset with the same guid: {guid}")
+            del datasets[guid]
+
+        return datasets
+
     def _get_existing_dataset(self, guid: str) -> Optional[dict[str, Any]]:
-        """Return a package with specific guid extra if exists"""
+        """Return a package with specific guid extra if exists. The DCAT
+        import_stage reads the resource ids of a changed dataset from it."""
 
         datasets: list[tuple[str]] = self._read_datasets_from_db(guid)
 
@@ -305,7 +619,15 @@ class DataVicDCATJSONHarvester(DCATJSONHarvester, DataVicBaseHarvester):
             creating or updating the actual package.
         '''
         resources = package_dict["resources"]
-        for resource in resources:
-            resource["size"] = get_resource_size(resource["url"])
-            resource["filesize"] = resource["size"]
+        urls = [resource["url"] for resource in resources]
+        fetched_sizes: dict[str, int] = dcat_dict.get(FETCHED_RESOURCE_SIZES) or {}
+
+        if all(url in fetched_sizes for url in urls):
+            sizes = [fetched_sizes[url] for url in urls]
+        else:
+            sizes = get_resource_sizes(urls, self._get_session_settings())
+
+        for resource, size in zip(resources, sizes):
+            resource["size"] = size
+            resource["filesize"] = size
         return package_dict
@@ -3,14 +3,24 @@ from __future__ import annotations
 import json
 import logging
 import os
+import threading
+import time
 import traceback
 import uuid
+import xml.etree.ElementTree as ET
+from collections import deque
+from copy import deepcopy
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta, timezone
 from hashlib import sha256
+from io import StringIO
+from itertools import islice
+from math import ceil
 from os import path
-from typing import Iterator, Optional, Any
+from types import MappingProxyType
+from typing import Iterable, Iterator, Mapping, NamedTuple, Optional, Any
 
-from bs4 import BeautifulSoup, Tag
 import requests
 from sqlalchemy import and_, or_
 
@@ -24,12 +34,86 @@ from ckanext.harvest.model import HarvestJob, HarvestObject, HarvestObjectExtra
 import ckanext.datavic_harvester.helpers as helpers
 from ckanext.datavic_harvester.harvesters.base import (
     DataVicBaseHarvester,
-    get_resource_size,
+    get_resource_sizes,
 )
+from ckanext.datavic_harvester.archive import (
+    ARCHIVE_SUFFIX,
+    INDEX_SUFFIX,
+    ArchiveWriter,
+    read_archive,
+)
+from ckanext.datavic_harvester.hashing import (
+    COMPAT_ALGORITHM,
+    canonical_hash,
+    validate_algorithm,
+)
+from ckanext.datavic_harvester.http_session import (
+    SessionSettings,
+    connection_stats,
+    get_session,
+    get_session_settings,
+)
+from ckanext.datavic_harvester.indexing import deferred_indexing
 
 
 log = logging.getLogger(__name__)
 HASH_FIELD = "harvester_data_hash"
+# Free-form extra with the hashes of the sections of HASH_FIELD, used to update
+# only the changed part of a dataset (see partial_updates)
+HASH_SECTIONS_FIELD = "harvester_data_hash_sections"
+
+# Gather-time fingerprint of everything a dataset is built from: the source
+# config, the record fields and the GeoServer layers tagged with its uuid.
+# Bump the version when the mapping in _get_pkg_dict changes, so the next
+# harvest re-imports every record.
+FINGERPRINT_EXTRA = "source_fingerprint"
+FINGERPRINT_VERSION = 1
+# Source config options that change how a job runs but not the packages it
+# produces. They are left out of the fingerprint, so changing them does not
+# re-import every record.
+FINGERPRINT_IGNORED_CONFIG = frozenset(
+    {
+        "replay_archive",
+        "replay_guids",
+        "skip_unchanged",
+        "force_all",
+        "parallel_page_workers",
+        "page_retries",
+        "gather_batch_size",
+        "fetch_prefetch_workers",
+        "import_prefetch_workers",
+        "partial_updates",
+        "deferred_indexing",
+        "index_batch_size",
+        "http_pool_size",
+        "http_retries",
+        "http_backoff_factor",
+        "http_timeout",
+        "deletion_safeguard_enabled",
+        "deletion_safeguard_drop_threshold_percent",
+        "deletion_safeguard_min_previous_count",
+        "deletion_safeguard_allow_bulk_delete",
+        "deletion_safeguard_notify_anomaly_url",
+        "deletion_safeguard_notify_ok_url",
+    }
+)
+
+# Number of package ids per query when loading the existing packages of a job
+EXISTING_PACKAGES_CHUNK_SIZE = 500
+
+# Key of the resources fetched in fetch_stage, stored in the harvest object content
+FETCHED_RESOURCES = "_resources"
+
+# Harvest archives, their indexes, unfinished archives, and the plain JSON
+# archives of earlier versions are all subject to the retention period.
+HARVEST_ARCHIVE_SUFFIXES = (ARCHIVE_SUFFIX, INDEX_SUFFIX, ".part", ".json")
+
+# GetCapabilities documents are large and the same for every dataset, so they
+# are indexed once per harvest job and re-fetched at most once per TTL window.
+GEOSERVER_CAPABILITIES_TTL = int(
+    tk.config.get("ckanext.datavic_harvester.geoserver_capabilities_ttl") or 3600
+)
+GEOSERVER_METADATA_KEYWORD = "MetadataID="
 
 # Change-detection hash whitelist. Only fields genuinely derived from the remote
 # source metadata are hashed; everything the harvester injects (static literals,
@@ -91,9 +175,159 @@ PRESERVE_PKG_FIELDS = frozenset(
 )
 
 
+class DelwpSourceConfig(NamedTuple):
+    """Settings of a DELWP harvest source, built once per job"""
+
+    test: bool
+    source_org_id: Optional[str]
+    deletion_safeguard_enabled: bool
+    deletion_safeguard_drop_threshold_percent: float
+    deletion_safeguard_min_previous_count: int
+    deletion_safeguard_allow_mass_delete: bool
+    deletion_safeguard_notify_ok_url: Optional[str]
+    deletion_safeguard_notify_anomaly_url: Optional[str]
+    parallel_page_workers: int
+    gather_batch_size: int
+    skip_unchanged: bool
+    partial_updates: bool
+    force_all: bool
+    replay_archive: str
+    replay_guids: tuple[str, ...]
+    page_retries: int
+    fetch_prefetch_workers: int
+    hash_algorithm: str
+    geoserver_urls: Optional[dict[str, dict[str, str]]]
+
+
+class ResourceSettings(NamedTuple):
+    """The settings resources are fetched with. Prefetch threads get a copy,
+    so _set_config for another object cannot change them mid-fetch."""
+
+    config: Mapping[str, Any]
+    geoserver_urls: Optional[Mapping[str, Mapping[str, str]]]
+    test: bool
+    # HTTP session settings of the source config
+    session: SessionSettings
+
+
+class ExistingPackage(NamedTuple):
+    """The parts of an existing package the change path of import_stage reads"""
+
+    id: str
+    name: str
+    title: str
+    state: str
+    data_hash: Optional[str]
+    # active resources, in position order, with id, name, format and state
+    resources: list[Any]
+    # HASH_SECTIONS_FIELD as stored
+    data_hash_sections: Optional[str] = None
+
+
+class PartialUpdate(NamedTuple):
+    """The part of an existing package an import has to write"""
+
+    # package fields or tags changed, resources did not
+    metadata: bool
+    # (existing resource id, incoming resource) of the changed resources
+    resources: list[tuple[str, dict[str, Any]]]
+
+
+class PageFetchError(Exception):
+    pass
+
+
+class ReplayError(Exception):
+    pass
+
+
+def _remove_files(filepaths: tuple[str, ...]) -> None:
+    for filepath in filepaths:
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
+
+
+def _get_record_guid(record: dict[str, Any]) -> str:
+    return record["fields"]["uuid"]
+
+
+def _get_resource_section_keys(
+    resources: Iterable[tuple[Optional[str], Optional[str]]]
+) -> list[str]:
+    """Key (name, format) pairs of resources for the hash sections, like
+    _preserve_resource_ids matches them. The n-th resource with the same pair
+    gets #n appended."""
+    keys = []
+    seen: dict[str, int] = {}
+
+    for name, res_format in resources:
+        key = f"{(name or '').strip().lower()}|{(res_format or '').strip().lower()}"
+        seen[key] = seen.get(key, 0) + 1
+        keys.append(key if seen[key] == 1 else f"{key}#{seen[key]}")
+
+    return keys
+
+
+def _show_field_value(field: dict[str, Any], value: Any) -> Any:
+    """Convert a stored extra to the value package_show returns for the
+    scheming field, by running the output validators of the field on it.
+
+    Raises ValueError when they cannot be run outside of package_show."""
+    if not field.get("output_validators"):
+        return value
+
+    from ckan.lib.navl.dictization_functions import validate
+
+    try:
+        from ckanext.scheming.validation import validators_from_string
+
+        validators = validators_from_string(field["output_validators"], field, {})
+        data, errors = validate({"value": value}, {"value": validators}, {})
+    except Exception as e:
+        raise ValueError(f"cannot show field {field['field_name']}: {e}") from e
+
+    if errors:
+        raise ValueError(f"cannot show field {field['field_name']}: {errors}")
+
+    return data.get("value")
+
+
 class DelwpHarvester(DataVicBaseHarvester):
     HARVESTER = "DELWP Harvester"
 
+    # until a source config sets it
+    hash_algorithm = COMPAT_ALGORITHM
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._current_job_id: Optional[str] = None
+        # (source id, hash of the source config) -> settings parsed from it
+        self._source_configs: dict[tuple[str, int], DelwpSourceConfig] = {}
+        # geoserver_url -> (requested at, future of
+        # {"MetadataID=<uuid>": (layer name, layer title)}), so concurrent
+        # prefetch threads wait for one download of each document
+        self._geoserver_capabilities: dict[
+            str, tuple[float, Future[dict[str, tuple[str, str]]]]
+        ] = {}
+        self._geoserver_capabilities_lock = threading.Lock()
+        # organisation_mapping -> {resowner: org-name}
+        self._organisation_index: Optional[
+            tuple[list[dict[str, str]], dict[str, str]]
+        ] = None
+        # organisation name -> id, loaded on first use
+        self._organisation_ids: Optional[dict[str, str]] = None
+        # resowner -> resolved owner_org, including the source org fallback
+        self._resolved_organisations: dict[str, Optional[str]] = {}
+        self._organisation_lock = threading.RLock()
+        # harvest object id -> resources being fetched ahead of its fetch stage
+        self._prefetched_resources: dict[str, Future[list[dict[str, Any]]]] = {}
+        # package id -> existing package, loaded for the whole job on first use
+        self._existing_packages: Optional[dict[str, ExistingPackage]] = None
+        # (max workers, executor) of the resource prefetch pool
+        self._prefetch_executor: Optional[tuple[int, ThreadPoolExecutor]] = None
+
     def info(self):
         return {
             "name": "delwp",
@@ -129,10 +363,12 @@ class DelwpHarvester(DataVicBaseHarvester):
 
         if "organisation_mapping" not in config_obj:
             self._validate_optional_deletion_safeguard_config(config_obj)
+            self._validate_optional_gather_config(config_obj)
             return json.dumps(config_obj, indent=4)
 
         self._validate_organisation_mapping(config_obj)
         self._validate_optional_deletion_safeguard_config(config_obj)
+        self._validate_optional_gather_config(config_obj)
 
         return json.dumps(config_obj, indent=4)
 
@@ -200,6 +436,59 @@ class DelwpHarvester(DataVicBaseHarvester):
                 if _v is not None and not isinstance(_v, str):
                     raise ValueError(f"{_key} must be a string")
 
+    def _validate_optional_gather_config(self, config: dict[str, Any]) -> None:
+        for key in (
+            "parallel_page_workers",
+            "page_retries",
+            "fetch_prefetch_workers",
+            "import_prefetch_workers",
+        ):
+            if key not in config:
+                continue
+
+            try:
+                value = int(config[key])
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be an integer")
+
+            if value < 0:
+                raise ValueError(f"{key} must be >= 0")
+
+        if "gather_batch_size" in config:
+            try:
+                batch_size = int(config["gather_batch_size"])
+            except (TypeError, ValueError):
+                raise ValueError("gather_batch_size must be an integer")
+
+            if batch_size < 1:
+                raise ValueError("gather_batch_size must be >= 1")
+
+        for key in ("skip_unchanged", "force_all", "partial_updates"):
+            if key not in config or isinstance(config[key], bool):
+                continue
+
+            try:
+                config[key] = tk.asbool(config[key])
+            except ValueError as e:
+                raise ValueError(f"{key} must be a boolean") from e
+
+        if config.get("hash_algorithm") is not None:
+            validate_algorithm(config["hash_algorithm"])
+
+        replay_archive = config.get("replay_archive")
+        if replay_archive is not None and not isinstance(replay_archive, str):
+            raise ValueError("replay_archive must be a string")
+
+        replay_guids = config.get("replay_guids")
+        if replay_guids is not None:
+            if not isinstance(replay_guids, list) or not all(
+                isinstance(guid, str) for guid in replay_guids
+            ):
+                raise ValueError("replay_guids must be a list of strings")
+
+            if not replay_archive:
+                raise ValueError("replay_guids requires replay_archive")
+
     def _validate_organisation_mapping(self, config: dict[str, Any]) -> None:
         if not isinstance(config["organisation_mapping"], list):
             raise ValueError("organisation_mapping must be a *list* of organisations")
@@ -248,8 +537,8 @@ class DelwpHarvester(DataVicBaseHarvester):
         return path.join(storage_path, "harvest", "delwp")
 
     def _parse_date_from_harvest_filename(self, filename: str) -> Optional[datetime]:
-        """Parse YYYY-MM-DD from filename like YYYY-MM-DD_HH-MM-SS_<job_id>.json."""
-        if not filename.endswith(".json"):
+        """Parse YYYY-MM-DD from filename like YYYY-MM-DD_HH-MM-SS_<job_id>.jsonl.gz."""
+        if not filename.endswith(HARVEST_ARCHIVE_SUFFIXES):
             return None
         parts = filename.split("_")
         if len(parts) < 1:
@@ -266,7 +555,7 @@ class DelwpHarvester(DataVicBaseHarvester):
             return
         cutoff_date = (datetime.now(timezone.utc) - timedelta(days=retention_days)).date()
         for name in os.listdir(dir_path):
-            if not name.endswith(".json"):
+            if not name.endswith(HARVEST_ARCHIVE_SUFFIXES):
                 continue
             file_date = self._parse_date_from_harvest_filename(name)
             if file_date is None:
@@ -288,18 +577,27 @@ class DelwpHarvester(DataVicBaseHarvester):
                         e,
                     )
 
-    def _save_harvest_json_to_filestore(
-        self, records: list[dict[str, Any]], job_id: Any
-    ) -> None:
+    @contextmanager
+    def _open_harvest_json_writer(self, job_id: Any) -> Iterator[ArchiveWriter]:
+        """Stream records into the harvest archive of a job.
+
+        The archive and its index are written under temporary names and only
+        renamed when the block exits without an exception, so a failed gather
+        does not leave a truncated archive behind."""
+        writer = ArchiveWriter(key=_get_record_guid)
+
         retention_days = self._get_harvest_json_retention_days()
         if retention_days == 0:
+            yield writer
             return
+
         dir_path = self._get_harvest_filestore_dir()
         if not dir_path:
             log.warning(
                 "%s: ckan.storage_path not set, skipping harvest JSON filestore save",
                 self.HARVESTER,
             )
+            yield writer
             return
 
         self._cleanup_old_harvest_json_files(dir_path, retention_days)
@@ -313,32 +611,129 @@ class DelwpHarvester(DataVicBaseHarvester):
                 dir_path,
                 e,
             )
+            yield writer
             return
 
-        # Re-playable shape: same as API response with "records" key, other keys are ignored.
-        payload = {"records": records}
-
         # Filename: date + time + job_id so multiple runs per day are allowed.
         timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"{timestamp}_{job_id}.json"
+        filename = f"{timestamp}_{job_id}{ARCHIVE_SUFFIX}"
         filepath = path.join(dir_path, filename)
+        index_filepath = path.join(dir_path, f"{timestamp}_{job_id}{INDEX_SUFFIX}")
+        partial_filepaths = (f"{filepath}.part", f"{index_filepath}.part")
 
         try:
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
-            log.info(
-                "%s: saved harvest JSON to %s (%d records)",
+            writer.open(*partial_filepaths)
+        except OSError as e:
+            log.warning(
+                "%s: could not write harvest JSON %s: %s",
                 self.HARVESTER,
-                filename,
-                len(records),
+                filepath,
+                e,
             )
-        except OSError as e:
+            yield writer
+            return
+
+        try:
+            yield writer
+        except BaseException:
+            writer.close()
+            _remove_files(partial_filepaths)
+            raise
+
+        writer.close()
+
+        if not writer.error:
+            try:
+                os.replace(partial_filepaths[1], index_filepath)
+                os.replace(partial_filepaths[0], filepath)
+            except OSError as e:
+                writer.error = e
+
+        if writer.error:
             log.warning(
                 "%s: could not write harvest JSON %s: %s",
                 self.HARVESTER,
                 filepath,
+                writer.error,
+            )
+            _remove_files(partial_filepaths + (index_filepath,))
+            return
+
+        log.info(
+            "%s: saved harvest JSON to %s (%d records)",
+            self.HARVESTER,
+            filename,
+            writer.count,
+        )
+
+    def _read_harvest_archive(
+        self, archive: str, guids: Optional[list[str]] = None
+    ) -> Iterator[dict[str, Any]]:
+        """Yield the records archived by a previous job, or only the ones
+        with the given guids.
+
+        `archive` is either the file name of the archive or the id of the job
+        that wrote it."""
+        dir_path = self._get_harvest_filestore_dir()
+        filename = path.basename(archive)
+
+        if dir_path and not filename.endswith(ARCHIVE_SUFFIX):
+            matches = sorted(
+                name
+                for name in os.listdir(dir_path)
+                if name.endswith(f"_{filename}{ARCHIVE_SUFFIX}")
+            ) if path.isdir(dir_path) else []
+            filename = matches[-1] if matches else ""
+
+        filepath = path.join(dir_path, filename) if dir_path and filename else None
+
+        if not filepath or not path.isfile(filepath):
+            raise ReplayError(f"{self.HARVESTER}: harvest archive {archive} not found")
+
+        log.info(
+            "%s: replaying %s from harvest archive %s",
+            self.HARVESTER,
+            f"{len(guids)} record(s)" if guids else "all records",
+            filename,
+        )
+
+        yield from read_archive(
+            filepath,
+            filepath[: -len(ARCHIVE_SUFFIX)] + INDEX_SUFFIX,
+            keys=guids or None,
+            key=_get_record_guid,
+        )
+
+    def _end_replay(self, harvest_job: HarvestJob) -> None:
+        """Remove the replay options from the source config once a job has
+        gathered the replayed records, so the next job harvests the portal.
+
+        The config is stored as validate_config stores it when the source is
+        saved. If it no longer validates, e.g. because a default group was
+        deleted, the replay options are still removed."""
+        source = harvest_job.source
+        config = json.loads(source.config)
+        config.pop("replay_archive", None)
+        config.pop("replay_guids", None)
+
+        try:
+            source.config = self.validate_config(json.dumps(config))
+        except ValueError as e:
+            log.warning(
+                "%s: config of source id=%s does not validate: %s",
+                self.HARVESTER,
+                source.id,
                 e,
             )
+            source.config = json.dumps(config, indent=4)
+
+        model.Session.commit()
+
+        log.info(
+            "%s: removed the replay options from the config of source id=%s",
+            self.HARVESTER,
+            source.id,
+        )
 
     def gather_stage(self, harvest_job):
         log.debug(f"In {self.HARVESTER} gather_stage")
@@ -353,14 +748,108 @@ class DelwpHarvester(DataVicBaseHarvester):
         guid_to_package_id = self._get_guids_to_package_ids(harvest_job.source.id)
         current_guids = self._get_current_harvest_guids(harvest_job.source.id)
         guids_in_source: list[str] = []
-
-        records = self._fetch_records_from_remote_portal(
-            harvest_job.source.url.rstrip("?")
+        # Fingerprints are stored for the next skip_unchanged job, also by a
+        # force_all job, and compared unless force_all is set. Replayed
+        # records may be outdated, so they get none.
+        store_fingerprints = self.skip_unchanged and not self.replay_archive
+        fingerprints = (
+            self._get_source_fingerprints(harvest_job.source.id)
+            if store_fingerprints and not self.force_all
+            else {}
         )
-        self._save_harvest_json_to_filestore(records, harvest_job.id)
+        fingerprint_config = (
+            self._get_fingerprint_config(harvest_job.source.config)
+            if store_fingerprints
+            else {}
+        )
+        unchanged_count = 0
+
+        if self.replay_archive:
+            # Replaying re-imports archived records as they are; the archive is
+            # not rewritten and nothing outside of it is deleted.
+            records = self._read_harvest_archive(
+                self.replay_archive, list(self.replay_guids)
+            )
+            archive_writer = nullcontext(ArchiveWriter(key=_get_record_guid))
+        else:
+            records = self._fetch_records_from_remote_portal(
+                harvest_job.source.url.rstrip("?")
+            )
+            archive_writer = self._open_harvest_json_writer(harvest_job.id)
+
+        batch: list[dict[str, Any]] = []
+
+        try:
+            with archive_writer as archive:
+                for record in records:
+                    archive.write(record)
+                    uuid = record["fields"]["uuid"]
+                    guids_in_source.append(uuid)
+
+                    fingerprint = (
+                        self._calculate_source_fingerprint(
+                            record["fields"], fingerprint_config
+                        )
+                        if store_fingerprints
+                        else None
+                    )
+                    if fingerprint and fingerprints.get(uuid) == fingerprint:
+                        unchanged_count += 1
+                        log.debug(
+                            "%s: guid=%s is unchanged in the source, skipping",
+                            self.HARVESTER,
+                            uuid,
+                        )
+                        continue
+
+                    status = "change" if uuid in guid_to_package_id and guid_to_package_id[uuid] is not None else "new"
+
+                    extras = {"status": status}
+                    if fingerprint:
+                        extras[FINGERPRINT_EXTRA] = fingerprint
+
+                    # Create harvest object with appropriate status based on if dataset
+                    # already exists in the database
+                    batch.append(
+                        {
+                            "guid": uuid,
+                            "content": json.dumps(record["fields"]),
+                            "package_id": (
+                                guid_to_package_id[uuid] if status == "change" else None
+                            ),
+                            "extras": extras,
+                        }
+                    )
+
+                    if len(batch) >= self.gather_batch_size:
+                        harvest_object_ids.extend(
+                            self._insert_harvest_objects(harvest_job, batch)
+                        )
+                        batch = []
+
+            if batch:
+                harvest_object_ids.extend(
+                    self._insert_harvest_objects(harvest_job, batch)
+                )
+        except (PageFetchError, ReplayError) as e:
+            log.error(str(e))
+            self._discard_harvest_objects(harvest_object_ids)
+            self._save_gather_error(str(e), harvest_job)
+            return None
+        finally:
+            if self.replay_archive:
+                self._end_replay(harvest_job)
+
+        if self.replay_archive:
+            log.info(
+                "%s: gather_stage replayed %d harvest objects",
+                self.HARVESTER,
+                len(harvest_object_ids),
+            )
+            return harvest_object_ids
 
         previous_count = len(current_guids)
-        source_count = len(records)
+        source_count = len(guids_in_source)
         anomaly_detected, anomaly_message = self._detect_deletion_anomaly(
             previous_count, source_count
         )
@@ -370,31 +859,6 @@ class DelwpHarvester(DataVicBaseHarvester):
         elif self.deletion_safeguard_enabled:
             self._send_deletion_safeguard_notify(anomaly=False)
 
-        for record in records:
-            uuid = record["fields"]["uuid"]
-
-            status = "change" if uuid in guid_to_package_id and guid_to_package_id[uuid] is not None else "new"
-
-            # Create harvest object with appropriate status based on if dataset
-            # already exists in the database
-            obj = HarvestObject(
-                guid=uuid,
-                job=harvest_job,
-                content=json.dumps(record["fields"]),
-                extras=[
-                    HarvestObjectExtra(key="status", value=status)
-                ],
-            )
-
-            if status == "change":
-                obj.package_id = guid_to_package_id[uuid]  # type: ignore
-
-            obj.save()
-
-            harvest_object_ids.append(obj.id)
-            guids_in_source.append(uuid)
-            log.debug("%s: harvest object id=%s guid=%s status=%s", self.HARVESTER, obj.id, uuid, status)
-
         # Only active (current=True) guids are candidates for deletion. Soft-deleted
         # rows in guid_to_package_id have already been deleted in a prior run —
         # re-deleting them creates noisy duplicate delete harvest_objects.
@@ -413,67 +877,197 @@ class DelwpHarvester(DataVicBaseHarvester):
                 self.HARVESTER,
                 len(guids_to_delete),
             )
-        for guid in guids_to_delete:
-            obj = HarvestObject(
-                guid=guid,
-                job=harvest_job,
-                package_id=guid_to_package_id[guid],
-                extras=[HarvestObjectExtra(key="status", value="delete")],
+        guids = sorted(guids_to_delete)
+        for start in range(0, len(guids), self.gather_batch_size):
+            guids_batch = guids[start : start + self.gather_batch_size]
+
+            model.Session.query(HarvestObject).filter(
+                HarvestObject.guid.in_(guids_batch)
+            ).update({"current": False}, False)
+
+            harvest_object_ids.extend(
+                self._insert_harvest_objects(
+                    harvest_job,
+                    [
+                        {
+                            "guid": guid,
+                            "content": None,
+                            "package_id": guid_to_package_id[guid],
+                            "extras": {"status": "delete"},
+                        }
+                        for guid in guids_batch
+                    ],
+                )
             )
 
-            model.Session.query(HarvestObject).filter_by(guid=guid).update(
-                {"current": False}, False
+        log.info(
+            "%s: gather_stage finished, total harvest objects: %d (from source: %d, unchanged: %d, to delete: %d)",
+            self.HARVESTER,
+            len(harvest_object_ids),
+            len(guids_in_source),
+            unchanged_count,
+            len(guids_to_delete),
+        )
+        log.debug(
+            "%s: HTTP connection usage: %s", self.HARVESTER, connection_stats()
+        )
+        return harvest_object_ids
+
+    def _insert_harvest_objects(
+        self, harvest_job: HarvestJob, objects: list[dict[str, Any]]
+    ) -> list[str]:
+        """Insert a batch of harvest objects with their status extras and
+        commit it.
+
+        Each item has the guid, content, package_id and extras of an object.
+        bulk_insert_mappings bypasses the ORM, including the listener that
+        copies the source from the job, so all the ids are set here."""
+        harvest_objects = []
+        extras = []
+
+        for item in objects:
+            object_id = str(uuid.uuid4())
+
+            harvest_objects.append(
+                {
+                    "id": object_id,
+                    "guid": item["guid"],
+                    "content": item["content"],
+                    "package_id": item["package_id"],
+                    "harvest_job_id": harvest_job.id,
+                    "harvest_source_id": harvest_job.source_id,
+                }
+            )
+            extras.extend(
+                {
+                    "id": str(uuid.uuid4()),
+                    "harvest_object_id": object_id,
+                    "key": key,
+                    "value": value,
+                }
+                for key, value in item["extras"].items()
+            )
+            log.debug(
+                "%s: harvest object id=%s guid=%s status=%s",
+                self.HARVESTER, object_id, item["guid"], item["extras"]["status"]
             )
 
-            obj.save()
+        model.Session.bulk_insert_mappings(HarvestObject, harvest_objects)
+        model.Session.bulk_insert_mappings(HarvestObjectExtra, extras)
+        model.Session.commit()
 
-            harvest_object_ids.append(obj.id)
+        return [harvest_object["id"] for harvest_object in harvest_objects]
+
+    def _get_fingerprint_config(
+        self, source_config: Optional[str]
+    ) -> dict[str, Any]:
+        """The source config options that affect the produced packages."""
+        config = json.loads(source_config) if source_config else {}
+
+        return {
+            key: value
+            for key, value in config.items()
+            if key not in FINGERPRINT_IGNORED_CONFIG
+        }
+
+    def _calculate_source_fingerprint(
+        self, fields: dict[str, Any], fingerprint_config: dict[str, Any]
+    ) -> str:
+        """Hash the inputs of a dataset that are known at gather time.
+
+        A record with the same fingerprint as its last imported version would
+        produce the same package, apart from the resource sizes, which are not
+        part of the change-detection hash either."""
+        layers = []
+
+        if "geoserver_dns" in self.config:
+            layers = [
+                self._get_geoserver_content_with_uuid(
+                    self.geoserver_urls[res_fmt]["geoserver_url"], fields.get("uuid")
+                )
+                for res_fmt in sorted(self.geoserver_urls)
+            ]
+
+        payload = {
+            "version": FINGERPRINT_VERSION,
+            "config": fingerprint_config,
+            "fields": fields,
+            "layers": layers,
+        }
+        return sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def _get_source_fingerprints(self, source_id: str) -> dict[str, str]:
+        """Fingerprints of the current objects of a source whose dataset is
+        still active. Records of deleted datasets are always re-imported, so
+        they can be restored."""
+        query = (
+            model.Session.query(HarvestObject.guid, HarvestObjectExtra.value)
+            .join(
+                HarvestObjectExtra,
+                HarvestObjectExtra.harvest_object_id == HarvestObject.id,
+            )
+            .join(model.Package, model.Package.id == HarvestObject.package_id)
+            .filter(HarvestObject.harvest_source_id == source_id)
+            .filter(HarvestObject.current == True)
+            .filter(HarvestObjectExtra.key == FINGERPRINT_EXTRA)
+            .filter(model.Package.state == "active")
+        )
+
+        return {guid: fingerprint for guid, fingerprint in query}
+
+    def _discard_harvest_objects(self, harvest_object_ids: list[str]) -> None:
+        """Remove the objects of a gather stage that could not be completed,
+        so they are neither imported nor counted as the source contents."""
+        if not harvest_object_ids:
+            return
+
+        model.Session.query(HarvestObjectExtra).filter(
+            HarvestObjectExtra.harvest_object_id.in_(harvest_object_ids)
+        ).delete(synchronize_session=False)
+        model.Session.query(HarvestObject).filter(
+            HarvestObject.id.in_(harvest_object_ids)
+        ).delete(synchronize_session=False)
+        model.Session.commit()
 
         log.info(
-            "%s: gather_stage finished, total harvest objects: %d (from source: %d, to delete: %d)",
+            "%s: discarded %d harvest object(s) of the incomplete gather stage",
             self.HARVESTER,
             len(harvest_object_ids),
-            len(guids_in_source),
-            len(guids_to_delete),
         )
-        return harvest_object_ids
 
     def _set_config(self, harvest_item: HarvestJob | HarvestObject) -> None:
         super()._set_config(harvest_item.source.config)
+        self._start_job(getattr(harvest_item, "harvest_job_id", None) or harvest_item.id)
 
-        _test = self.config.get("test", False)
-        self.test = tk.asbool(False if _test is None else _test)
-        self.source_org_id = self._get_source_owner_org_id(harvest_item.source.id)
-        _dse = self.config.get("deletion_safeguard_enabled", True)
-        self.deletion_safeguard_enabled = tk.asbool(True if _dse is None else _dse)
-        self.deletion_safeguard_drop_threshold_percent = float(
-            self.config.get("deletion_safeguard_drop_threshold_percent", 10)
-        )
-        self.deletion_safeguard_min_previous_count = int(
-            self.config.get("deletion_safeguard_min_previous_count", 100)
-        )
-        _amd = self.config.get("deletion_safeguard_allow_bulk_delete", False)
-        self.deletion_safeguard_allow_mass_delete = tk.asbool(
-            False if _amd is None else _amd
-        )
+        key = (harvest_item.source.id, hash(harvest_item.source.config))
+        source_config = self._source_configs.get(key)
+
+        if source_config is None:
+            source_config = self._source_configs[key] = self._build_source_config(
+                harvest_item.source.id
+            )
+
+        # The stages read the settings as attributes of the harvester
+        for name, value in source_config._asdict().items():
+            setattr(self, name, value)
 
+    def _build_source_config(self, source_id: str) -> DelwpSourceConfig:
         def _strip_url(v: Any) -> Optional[str]:
             if v is None:
                 return None
             s = str(v).strip()
             return s or None
 
-        self.deletion_safeguard_notify_ok_url = _strip_url(
-            self.config.get("deletion_safeguard_notify_ok_url")
-        )
-        self.deletion_safeguard_notify_anomaly_url = _strip_url(
-            self.config.get("deletion_safeguard_notify_anomaly_url")
-        )
+        _test = self.config.get("test", False)
+        _dse = self.config.get("deletion_safeguard_enabled", True)
+        _amd = self.config.get("deletion_safeguard_allow_bulk_delete", False)
+        _page_retries = self.config.get("page_retries")
+        geoserver_urls = None
 
         if "geoserver_dns" in self.config:
             geoserver_dns = self.config["geoserver_dns"]
 
-            self.geoserver_urls = {
+            geoserver_urls = {
                 "WMS": {
                     "geoserver_url": f"{geoserver_dns}/geoserver/ows?service=WMS&request=getCapabilities",
                     "resource_url": f"{geoserver_dns}/geoserver/wms?service=wms&request=getmap&format=image%2Fpng8&transparent=true&layers={{layername}}&width=512&height=512&crs=epsg%3A3857&bbox=16114148.554967716%2C-4456584.4971389165%2C16119040.524777967%2C-4451692.527328665",
@@ -484,6 +1078,64 @@ class DelwpHarvester(DataVicBaseHarvester):
                 },
             }
 
+        return DelwpSourceConfig(
+            test=tk.asbool(False if _test is None else _test),
+            source_org_id=self._get_source_owner_org_id(source_id),
+            deletion_safeguard_enabled=tk.asbool(True if _dse is None else _dse),
+            deletion_safeguard_drop_threshold_percent=float(
+                self.config.get("deletion_safeguard_drop_threshold_percent", 10)
+            ),
+            deletion_safeguard_min_previous_count=int(
+                self.config.get("deletion_safeguard_min_previous_count", 100)
+            ),
+            deletion_safeguard_allow_mass_delete=tk.asbool(
+                False if _amd is None else _amd
+            ),
+            deletion_safeguard_notify_ok_url=_strip_url(
+                self.config.get("deletion_safeguard_notify_ok_url")
+            ),
+            deletion_safeguard_notify_anomaly_url=_strip_url(
+                self.config.get("deletion_safeguard_notify_anomaly_url")
+            ),
+            parallel_page_workers=int(self.config.get("parallel_page_workers") or 0),
+            gather_batch_size=int(self.config.get("gather_batch_size") or 500),
+            skip_unchanged=tk.asbool(self.config.get("skip_unchanged") or False),
+            partial_updates=tk.asbool(self.config.get("partial_updates") or False),
+            force_all=tk.asbool(self.config.get("force_all") or False),
+            replay_archive=(self.config.get("replay_archive") or "").strip(),
+            replay_guids=tuple(self.config.get("replay_guids") or ()),
+            page_retries=int(2 if _page_retries is None else _page_retries),
+            # import_prefetch_workers is the former name of the option
+            fetch_prefetch_workers=int(
+                self.config.get(
+                    "fetch_prefetch_workers",
+                    self.config.get("import_prefetch_workers"),
+                )
+                or 0
+            ),
+            hash_algorithm=self.config.get("hash_algorithm") or COMPAT_ALGORITHM,
+            geoserver_urls=geoserver_urls,
+        )
+
+    def _start_job(self, job_id: Optional[str]) -> None:
+        """Drop per-job caches when the harvester moves on to another job."""
+        if job_id == self._current_job_id:
+            return
+
+        self._current_job_id = job_id
+
+        with self._geoserver_capabilities_lock:
+            self._geoserver_capabilities.clear()
+
+        self._source_configs.clear()
+        self._drop_prefetched_resources()
+        self._existing_packages = None
+
+        with self._organisation_lock:
+            self._organisation_index = None
+            self._organisation_ids = None
+            self._resolved_organisations.clear()
+
     def _detect_deletion_anomaly(
         self, previous_count: int, source_count: int
     ) -> tuple[bool, Optional[str]]:
@@ -554,7 +1206,7 @@ class DelwpHarvester(DataVicBaseHarvester):
             return
 
         try:
-            requests.get(target_url, timeout=10)
+            self._get_session().get(target_url, timeout=10)
         except requests.RequestException as e:
             log.warning(
                 "%s: deletion safeguard notify GET failed (%s): %s",
@@ -574,11 +1226,19 @@ class DelwpHarvester(DataVicBaseHarvester):
 
     def _fetch_records_from_remote_portal(
         self, harvest_source_url: str
-    ) -> list[dict[str, Any]]:
+    ) -> Iterator[dict[str, Any]]:
+        """Yield the records of the remote portal page by page, so only the
+        pages being fetched are held in memory."""
         page: int = 1
         records_per_page: int = 500
 
-        records = []
+        if self.parallel_page_workers and not self.test:
+            yield from self._fetch_records_concurrently(
+                harvest_source_url, records_per_page
+            )
+            return
+
+        total = 0
 
         while True:
             result = self._fetch_records(harvest_source_url, page, records_per_page)
@@ -587,11 +1247,12 @@ class DelwpHarvester(DataVicBaseHarvester):
                 log.debug("%s: empty document at page %d, no more records", self.HARVESTER, page)
                 break
 
-            records.extend(result)
+            total += len(result)
             log.debug(
                 "%s: page %d returned %d records (total so far: %d)",
-                self.HARVESTER, page, len(result), len(records)
+                self.HARVESTER, page, len(result), total
             )
+            yield from result
 
             if self.test:
                 log.debug("%s: test mode, stopping after first page", self.HARVESTER)
@@ -599,8 +1260,7 @@ class DelwpHarvester(DataVicBaseHarvester):
 
             page = page + 1
 
-        log.info("%s: fetched %d total records from remote portal", self.HARVESTER, len(records))
-        return records
+        log.info("%s: fetched %d total records from remote portal", self.HARVESTER, total)
 
     def _get_current_harvest_guids(self, source_id: str) -> set[str]:
         """Active GUIDs for this source (current=True only).
@@ -645,13 +1305,175 @@ class DelwpHarvester(DataVicBaseHarvester):
             )
         )
 
-        return {
-            harvest_object.guid: harvest_object.package_id for harvest_object in query
-        }
+        return {
+            harvest_object.guid: harvest_object.package_id for harvest_object in query
+        }
+
+    def _fetch_records_concurrently(
+        self, harvest_source_url: str, records_per_page: int
+    ) -> Iterator[dict[str, Any]]:
+        """Fetch the first page, then all the pages announced by its `nhits`
+        with parallel_page_workers threads.
+
+        Records are yielded in page order. At most two pages per worker are
+        requested ahead of the page being consumed. A page that cannot be
+        fetched or keeps returning fewer records than announced after
+        page_retries retries raises PageFetchError instead of cutting the
+        record list short. Records added meanwhile are read from the pages
+        past nhits until one of them is empty or fails."""
+        document = self._fetch_page_with_retries(
+            harvest_source_url, 1, records_per_page
+        )
+        records: list[dict[str, Any]] = document["records"]
+        total = len(records)
+
+        try:
+            nhits = int(document["nhits"])
+        except (KeyError, TypeError, ValueError):
+            log.warning(
+                "%s: no nhits in the first page, fetching pages sequentially",
+                self.HARVESTER,
+            )
+            nhits = len(records)
+
+        del document
+        yield from records
+
+        last_page = max(ceil(nhits / records_per_page), 1)
+        pages = iter(range(2, last_page + 1))
+
+        with ThreadPoolExecutor(
+            max_workers=self.parallel_page_workers,
+            thread_name_prefix="delwp-pages",
+        ) as executor:
+
+            def submit(page: int) -> tuple[int, Future[dict[str, Any]]]:
+                return page, executor.submit(
+                    self._fetch_page_with_retries,
+                    harvest_source_url,
+                    page,
+                    records_per_page,
+                    min(records_per_page, nhits - (page - 1) * records_per_page),
+                )
+
+            pending = deque(
+                submit(page)
+                for page in islice(pages, self.parallel_page_workers * 2)
+            )
+
+            while pending:
+                page, future = pending.popleft()
+                records = future.result()["records"]
+
+                next_page = next(pages, None)
+                if next_page is not None:
+                    pending.append(submit(next_page))
+
+                total += len(records)
+                log.debug(
+                    "%s: page %d returned %d records (total so far: %d)",
+                    self.HARVESTER, page, len(records), total
+                )
+                yield from records
+
+        # records added while the pages were being fetched end up past nhits
+        page = last_page + 1
+        while records := self._fetch_trailing_records(
+            harvest_source_url, page, records_per_page
+        ):
+            total += len(records)
+            yield from records
+            page += 1
+
+        log.info(
+            "%s: fetched %d total records from remote portal (nhits: %d)",
+            self.HARVESTER, total, nhits
+        )
+
+    def _fetch_page_with_retries(
+        self,
+        url: str,
+        page: int,
+        records_per_page: int,
+        min_records: Optional[int] = None,
+    ) -> dict[str, Any]:
+        """Fetch a page, retrying page_retries times when the request fails,
+        the response is not a JSON object with a list of records or the list
+        holds fewer than min_records records. A page may hold more records
+        than announced when records are added while the pages are fetched."""
+        for attempt in range(self.page_retries + 1):
+            if attempt:
+                time.sleep(attempt)
+
+            try:
+                document = self._fetch_page(url, page, records_per_page)
+            except ValueError as e:
+                log.warning(
+                    "%s: invalid JSON for page %d: %s", self.HARVESTER, page, e
+                )
+                continue
+
+            if document is None:
+                continue
+
+            records = (
+                document.get("records") if isinstance(document, dict) else None
+            )
+
+            if not isinstance(records, list):
+                log.warning(
+                    "%s: no records in page %d", self.HARVESTER, page
+                )
+                continue
+
+            if min_records is not None and len(records) < min_records:
+                log.warning(
+                    "%s: page %d returned %d records instead of at least %d",
+                    self.HARVESTER,
+                    page,
+                    len(records),
+                    min_records,
+                )
+                continue
+
+            return document
+
+        raise PageFetchError(
+            f"{self.HARVESTER}: could not fetch page {page} of records "
+            f"after {self.page_retries + 1} attempts"
+        )
+
+    def _fetch_trailing_records(
+        self, url: str, page: int, records_per_page: int
+    ) -> Optional[list[dict[str, Any]]]:
+        """Fetch a page past nhits. The portal may answer a start past the
+        end of the list with an empty or an error response, so any failure
+        ends the record list here, as in _fetch_records."""
+        try:
+            document = self._fetch_page(url, page, records_per_page)
+        except ValueError as e:
+            log.debug(
+                "%s: no records past nhits in page %d: %s", self.HARVESTER, page, e
+            )
+            return
+
+        records = document.get("records") if isinstance(document, dict) else None
+
+        return records if isinstance(records, list) else None
 
     def _fetch_records(
         self, url: str, page: int, records_per_page: int = 100
     ) -> Optional[list[dict[str, Any]]]:
+        document = self._fetch_page(url, page, records_per_page)
+
+        if document is None:
+            return
+
+        return document.get("records")
+
+    def _fetch_page(
+        self, url: str, page: int, records_per_page: int = 100
+    ) -> Optional[dict[str, Any]]:
         start = 0 if page == 1 else ((page - 1) * records_per_page)
 
         request_url: str = "{}?dataset={}&start={}&rows={}&format=json".format(
@@ -673,7 +1495,7 @@ class DelwpHarvester(DataVicBaseHarvester):
             log.warning("%s: empty response from %s (page %d)", self.HARVESTER, request_url, page)
             return
 
-        return json.loads(resp_text).get("records")
+        return json.loads(resp_text)
 
     def _get_record_metadata(self, datasets) -> Iterator[dict[str, Any]]:
         """Fetch remote portal record data from `fields` field. The field
@@ -688,11 +1510,53 @@ class DelwpHarvester(DataVicBaseHarvester):
         for dataset in datasets:
             yield dataset.get("fields", {})
 
+    def fetch_stage(self, harvest_object: HarvestObject) -> bool:
+        """Fetch the resources of the record (file sizes and GeoServer layers)
+        and store them in the harvest object content, so the import stage
+        only writes to the database"""
+        if (
+            harvest_object.content is None
+            or harvest_object.guid is None
+            or self._get_object_extra(harvest_object, "status") == "delete"
+        ):
+            return True
+
+        self._set_config(harvest_object)
+
+        if self.fetch_prefetch_workers:
+            self._prefetch_resources(harvest_object)
+
+        try:
+            content = json.loads(harvest_object.content)
+            metashare_dict = dict(content, _uuid=harvest_object.guid)
+            content[FETCHED_RESOURCES] = self._get_resources(
+                harvest_object, metashare_dict
+            )
+        except Exception as e:
+            self._save_object_error(
+                f"{self.HARVESTER}: error fetching resources for object "
+                f"{harvest_object.id}: {e}",
+                harvest_object,
+                "Fetch",
+            )
+            return False
+
+        harvest_object.content = json.dumps(content)
+        return True
+
     def import_stage(self, harvest_object: HarvestObject) -> bool | str:
         if not harvest_object:
             log.error(f"{self.HARVESTER}: no harvest object received")
             return False
 
+        self._set_config(harvest_object)
+
+        with deferred_indexing(harvest_object, self.config) as deferred_import:
+            deferred_import.result = self._import_harvest_object(harvest_object)
+
+        return deferred_import.result
+
+    def _import_harvest_object(self, harvest_object: HarvestObject) -> bool | str:
         status = self._get_object_extra(harvest_object, "status")  # type: ignore
         log.debug(
             "%s: import_stage object id=%s guid=%s status=%s package_id=%s",
@@ -729,8 +1593,6 @@ class DelwpHarvester(DataVicBaseHarvester):
             )
             return False
 
-        self._set_config(harvest_object)
-
         # Validate before setting current=True to prevent orphaned harvest_objects
         pkg_dict = self._get_pkg_dict(harvest_object)
 
@@ -771,12 +1633,24 @@ class DelwpHarvester(DataVicBaseHarvester):
 
         context = self._make_context()
         data_hash = self._calculate_hash_for_data_dict(pkg_dict)
+        hash_sections = None
+
+        if self.partial_updates:
+            hash_sections = self._calculate_hash_sections(pkg_dict, data_hash)
+            pkg_dict.setdefault("extras", []).append(
+                {
+                    "key": HASH_SECTIONS_FIELD,
+                    "value": json.dumps(hash_sections, sort_keys=True),
+                }
+            )
 
         # Existing package whose resource IDs / metadata must be preserved on the
         # update path. Left as None for creates. The preserve helpers run inside
         # the package_update try block below so any failure is rolled back and
         # recorded on the harvest object like a failed update.
         pkg_to_preserve = None
+        # Set when only the metadata or a resource of an existing package changed
+        partial_update = None
 
         if status == "new":
             context["schema"] = self._create_custom_package_create_schema()
@@ -794,7 +1668,7 @@ class DelwpHarvester(DataVicBaseHarvester):
             pkg_dict[HASH_FIELD] = data_hash
         elif status == "change":
             pkg_dict["id"] = harvest_object.package_id
-            pkg = model.Package.get(pkg_dict["id"])
+            pkg = self._get_existing_package(harvest_object)
 
             if not pkg:
                 # Package was likely purged after gather stage.
@@ -820,7 +1694,7 @@ class DelwpHarvester(DataVicBaseHarvester):
 
                 pkg_dict[HASH_FIELD] = data_hash
             else:
-                previous_hash = pkg.extras.get(HASH_FIELD)
+                previous_hash = pkg.data_hash
                 needs_restore = pkg.state != "active"
 
                 if previous_hash == data_hash and not needs_restore:
@@ -855,6 +1729,11 @@ class DelwpHarvester(DataVicBaseHarvester):
                     # package_update try block below so failures are handled.
                     pkg_to_preserve = pkg
 
+                    if hash_sections and not needs_restore:
+                        partial_update = self._get_partial_update(
+                            pkg_dict, pkg, hash_sections
+                        )
+
         action: str = "package_create" if status == "new" else "package_update"
         status: str = "Created" if status == "new" else "Updated"
         log.debug("%s: calling action=%s for guid=%s", self.HARVESTER, action, harvest_object.guid)
@@ -862,16 +1741,25 @@ class DelwpHarvester(DataVicBaseHarvester):
         try:
             context["return_id_only"] = False
 
-            if pkg_to_preserve is not None:
-                # Preserve resource IDs so package_update edits resources in
-                # place rather than recreating them with new UUIDs.
-                self._preserve_resource_ids(pkg_dict, pkg_to_preserve)
+            if partial_update is not None:
+                dataset = self._apply_partial_update(
+                    context, pkg_dict, pkg_to_preserve, partial_update
+                )
+            else:
+                if pkg_to_preserve is not None:
+                    # Preserve resource IDs so package_update edits resources in
+                    # place rather than recreating them with new UUIDs.
+                    self._preserve_resource_ids(pkg_dict, pkg_to_preserve)
+
+                    # Preserve existing metadata (e.g. syndicated_id,
+                    # skip_syndication) that package_update would otherwise drop.
+                    self._preserve_existing_metadata(pkg_dict, pkg_to_preserve)
+
+                dataset = tk.get_action(action)(context, pkg_dict)
 
-                # Preserve existing metadata (e.g. syndicated_id,
-                # skip_syndication) that package_update would otherwise drop.
-                self._preserve_existing_metadata(pkg_dict, pkg_to_preserve)
+            if self._existing_packages is not None:
+                self._existing_packages.pop(dataset["id"], None)
 
-            dataset = tk.get_action(action)(context, pkg_dict)
             log.info(
                 "%s: %s dataset with id %s (%s)",
                 self.HARVESTER,
@@ -978,7 +1866,7 @@ class DelwpHarvester(DataVicBaseHarvester):
             metashare_dict.get("maintenanceandupdatefrequency_text", "unknown"),
         )
 
-        pkg_dict["resources"] = self._fetch_resources(metashare_dict)
+        pkg_dict["resources"] = self._get_resources(harvest_object, metashare_dict)
 
         pkg_dict["private"] = self._is_pkg_private(metashare_dict)
 
@@ -1006,6 +1894,101 @@ class DelwpHarvester(DataVicBaseHarvester):
 
         return pkg_dict
 
+    def _get_existing_package(
+        self, harvest_object: HarvestObject
+    ) -> Optional[ExistingPackage]:
+        """Return the existing package of a harvest object.
+
+        The existing packages of all the objects of the job are loaded at
+        once on first use. A package is loaded again after the import has
+        created or updated it.
+
+        The queries do not flush the session, so pending changes to the
+        harvest object are only written by the import itself."""
+        package_id = harvest_object.package_id
+
+        with model.Session.no_autoflush:
+            if self._existing_packages is None:
+                package_ids = [
+                    job_package_id
+                    for (job_package_id,) in model.Session.query(
+                        HarvestObject.package_id
+                    )
+                    .filter(
+                        HarvestObject.harvest_job_id == harvest_object.harvest_job_id
+                    )
+                    .filter(HarvestObject.package_id != None)  # noqa: E711
+                    .distinct()
+                ]
+                self._existing_packages = self._load_existing_packages(package_ids)
+
+            if package_id not in self._existing_packages:
+                self._existing_packages.update(
+                    self._load_existing_packages([package_id])
+                )
+
+        return self._existing_packages.get(package_id)
+
+    def _load_existing_packages(
+        self, package_ids: list[str]
+    ) -> dict[str, ExistingPackage]:
+        """Load the hash, state and active resources of packages with three
+        queries per chunk of ids"""
+        packages: dict[str, ExistingPackage] = {}
+
+        for start in range(0, len(package_ids), EXISTING_PACKAGES_CHUNK_SIZE):
+            chunk = package_ids[start : start + EXISTING_PACKAGES_CHUNK_SIZE]
+
+            hashes: dict[str, dict[str, str]] = {}
+            for package_id, key, value in (
+                model.Session.query(
+                    model.PackageExtra.package_id,
+                    model.PackageExtra.key,
+                    model.PackageExtra.value,
+                )
+                .filter(model.PackageExtra.package_id.in_(chunk))
+                .filter(model.PackageExtra.key.in_([HASH_FIELD, HASH_SECTIONS_FIELD]))
+            ):
+                hashes.setdefault(package_id, {})[key] = value
+
+            resources: dict[str, list[Any]] = {}
+            for resource in (
+                model.Session.query(
+                    model.Resource.package_id,
+                    model.Resource.id,
+                    model.Resource.name,
+                    model.Resource.format,
+                    model.Resource.state,
+                )
+                .filter(model.Resource.package_id.in_(chunk))
+                .filter(model.Resource.state == "active")
+                .order_by(model.Resource.position)
+            ):
+                resources.setdefault(resource.package_id, []).append(resource)
+
+            for package_id, name, title, state in model.Session.query(
+                model.Package.id,
+                model.Package.name,
+                model.Package.title,
+                model.Package.state,
+            ).filter(model.Package.id.in_(chunk)):
+                packages[package_id] = ExistingPackage(
+                    id=package_id,
+                    name=name,
+                    title=title,
+                    state=state,
+                    data_hash=hashes.get(package_id, {}).get(HASH_FIELD),
+                    resources=resources.get(package_id, []),
+                    data_hash_sections=hashes.get(package_id, {}).get(
+                        HASH_SECTIONS_FIELD
+                    ),
+                )
+
+        log.debug(
+            "%s: loaded %d existing package(s)", self.HARVESTER, len(packages)
+        )
+        return packages
+
     def _preserve_resource_ids(self, pkg_dict: dict[str, Any], pkg) -> None:
         """Carry existing resource IDs onto matching incoming resources so
         package_update updates them in place instead of recreating them with
@@ -1075,40 +2058,112 @@ class DelwpHarvester(DataVicBaseHarvester):
         The harvester's own values win wherever it set them. Resources are
         owned by _preserve_resource_ids and are left untouched here.
         """
+        existing = self._read_preserved_metadata(pkg.id)
+
+        if existing is None:
+            existing = self._show_preserved_metadata(pkg.id)
+
+        self._merge_existing_extras(pkg_dict, existing)
+
+        # Preserve only the known scheming fields the harvester does not set
+        # (PRESERVE_PKG_FIELDS). This deliberately excludes CKAN computed/managed
+        # fields returned by package_show (metadata_created, revision_id,
+        # organization, num_tags, ...) which must not be echoed back into
+        # package_update. setdefault keeps the harvester's own value where it set
+        # one; resources/extras are handled separately above.
+        for key in PRESERVE_PKG_FIELDS:
+            if key in existing:
+                pkg_dict.setdefault(key, existing[key])
+
+    @staticmethod
+    def _merge_existing_extras(
+        pkg_dict: dict[str, Any], existing: dict[str, Any]
+    ) -> None:
+        pkg_dict.setdefault("extras", [])
+        harvester_extra_keys = {e.get("key") for e in pkg_dict["extras"]}
+
+        # Merge the extras LIST element-wise so existing-only free-form extras
+        # are not dropped (dict.update would replace the whole list).
+        for extra in existing.get("extras", []):
+            if extra.get("key") not in harvester_extra_keys:
+                pkg_dict["extras"].append(
+                    {"key": extra["key"], "value": extra["value"]}
+                )
+
+    def _show_preserved_metadata(self, package_id: str) -> dict[str, Any]:
         try:
-            existing = tk.get_action("package_show")(
-                {"ignore_auth": True}, {"id": pkg.id}
+            return tk.get_action("package_show")(
+                {"ignore_auth": True}, {"id": package_id}
             )
         except tk.ObjectNotFound:
             log.error(
                 "%s: unable to read existing package id=%s while preserving "
                 "metadata; aborting update to avoid dropping preserved fields",
                 self.HARVESTER,
-                pkg.id,
+                package_id,
                 exc_info=True,
             )
             raise
 
-        pkg_dict.setdefault("extras", [])
-        harvester_extra_keys = {e.get("key") for e in pkg_dict["extras"]}
-
-        # Merge the extras LIST element-wise so existing-only free-form extras
-        # are not dropped (dict.update would replace the whole list).
-        for extra in existing.get("extras", []):
-            if extra.get("key") not in harvester_extra_keys:
-                pkg_dict["extras"].append(
-                    {"key": extra["key"], "value": extra["value"]}
+    def _read_preserved_metadata(self, package_id: str) -> Optional[dict[str, Any]]:
+        """Read the free-form extras and the PRESERVE_PKG_FIELDS of a package
+        straight from the model, in the shape package_show returns them.
+
+        package_show dictizes the whole package, resources included, runs the
+        scheming validators and the plugin hooks, only for a handful of values
+        to be read here. Returns None when the scheming schema of the package
+        is not available or the output validators of a field cannot be run
+        here, so the caller falls back to package_show."""
+        columns = sorted(PRESERVE_PKG_FIELDS & set(model.Package.__table__.c.keys()))
+
+        with model.Session.no_autoflush:
+            row = (
+                model.Session.query(
+                    model.Package.type,
+                    *[getattr(model.Package, column) for column in columns],
                 )
+                .filter(model.Package.id == package_id)
+                .one_or_none()
+            )
 
-        # Preserve only the known scheming fields the harvester does not set
-        # (PRESERVE_PKG_FIELDS). This deliberately excludes CKAN computed/managed
-        # fields returned by package_show (metadata_created, revision_id,
-        # organization, num_tags, ...) which must not be echoed back into
-        # package_update. setdefault keeps the harvester's own value where it set
-        # one; resources/extras are handled separately above.
-        for key in PRESERVE_PKG_FIELDS:
-            if key in existing:
-                pkg_dict.setdefault(key, existing[key])
+            if row is None:
+                return self._show_preserved_metadata(package_id)
+
+            fields = helpers.get_dataset_fields(row[0])
+            if fields is None:
+                return None
+
+            extras = dict(
+                model.Session.query(
+                    model.PackageExtra.key, model.PackageExtra.value
+                ).filter(model.PackageExtra.package_id == package_id)
+            )
+
+        # scheming shows schema fields at the top level, only the other
+        # extras stay in the extras list
+        existing: dict[str, Any] = {
+            "extras": [
+                {"key": key, "value": value}
+                for key, value in sorted(extras.items())
+                if key not in fields
+            ]
+        }
+        existing.update(zip(columns, row[1:]))
+
+        for key in PRESERVE_PKG_FIELDS - set(columns):
+            if key in extras and key in fields:
+                try:
+                    existing[key] = _show_field_value(fields[key], extras[key])
+                except ValueError:
+                    log.debug(
+                        "%s: falling back to package_show for package id=%s",
+                        self.HARVESTER,
+                        package_id,
+                        exc_info=True,
+                    )
+                    return None
+
+        return existing
 
     def _create_custom_package_create_schema(self) -> dict[str, Any]:
         from ckan.lib.navl.validators import unicode_safe
@@ -1172,7 +2227,11 @@ class DelwpHarvester(DataVicBaseHarvester):
         harvest_object: HarvestObject,
     ) -> Optional[str]:
         """Get existing organization from the config `organization_mapping`
-        field or create a new one"""
+        field or create a new one.
+
+        The result is memoized per job, as most records share a handful of
+        resowner values. The lock makes sure that concurrent imports create
+        a missing organization only once."""
 
         if not resowner:
             log.warning(
@@ -1182,28 +2241,29 @@ class DelwpHarvester(DataVicBaseHarvester):
                 self.source_org_id,
             )
             return self.source_org_id
-        owner_org = None
 
-        if organisation_mapping:
-            owner_org: Optional[str] = self._get_existing_organization(
-                organisation_mapping, resowner
-            )
+        with self._organisation_lock:
+            if resowner in self._resolved_organisations:
+                return self._resolved_organisations[resowner]
+
+            owner_org = None
 
-        return owner_org or self._create_organization(resowner, harvest_object)
+            if organisation_mapping:
+                owner_org: Optional[str] = self._get_existing_organization(
+                    organisation_mapping, resowner
+                )
+
+            owner_org = owner_org or self._create_organization(resowner, harvest_object)
+            self._resolved_organisations[resowner] = owner_org
+
+            return owner_org
 
     def _get_existing_organization(
         self, organisation_mapping: list[dict[str, str]], resowner: str
     ) -> Optional[str]:
         """Get an organization name either from config mapping or try to find
         an existing one on a portal by `resowner` field"""
-        org_name = next(
-            (
-                organisation.get("org-name")
-                for organisation in organisation_mapping
-                if organisation.get("resowner") == resowner
-            ),
-            None,
-        )
+        org_name = self._get_organisation_index(organisation_mapping).get(resowner)
 
         if org_name:
             return org_name
@@ -1216,8 +2276,8 @@ class DelwpHarvester(DataVicBaseHarvester):
         )
         org_name = helpers.munge_title_to_name(resowner)
 
-        if organization := self._get_organization(org_name):
-            return organization.id
+        if org_id := self._get_organization_id(org_name):
+            return org_id
 
         log.warning(
             "%s get_organisation: organisation does not exist: %s, dataset %s",
@@ -1226,6 +2286,50 @@ class DelwpHarvester(DataVicBaseHarvester):
             self.pkg_dict["title"],
         )
 
+    def _get_organisation_index(
+        self, organisation_mapping: list[dict[str, str]]
+    ) -> dict[str, str]:
+        """Return the `resowner -> org-name` index of the mapping. The first
+        item wins when a resowner is mapped twice, as in a linear scan."""
+        with self._organisation_lock:
+            if (
+                self._organisation_index is None
+                or self._organisation_index[0] is not organisation_mapping
+            ):
+                index: dict[str, str] = {}
+
+                for organisation in organisation_mapping:
+                    index.setdefault(
+                        organisation.get("resowner"), organisation.get("org-name")
+                    )
+
+                self._organisation_index = (organisation_mapping, index)
+
+            return self._organisation_index[1]
+
+    def _get_organization_id(self, org_name: str) -> Optional[str]:
+        """Return the id of an organization by name.
+
+        All organizations are loaded with a single query on first use. A name
+        missing from them is looked up again, in case the organization was
+        created after they were loaded."""
+        with self._organisation_lock:
+            if self._organisation_ids is None:
+                self._organisation_ids = dict(
+                    model.Session.query(model.Group.name, model.Group.id).filter_by(
+                        is_organization=True
+                    )
+                )
+
+            if org_name in self._organisation_ids:
+                return self._organisation_ids[org_name]
+
+            if organization := self._get_organization(org_name):
+                self._organisation_ids[org_name] = organization.id
+                return organization.id
+
+        return None
+
     def _create_organization(self, resowner: str, harvest_object: HarvestObject) -> str:
         """Create organization from a resowner field"""
         org_name = helpers.munge_title_to_name(resowner)
@@ -1260,7 +2364,11 @@ class DelwpHarvester(DataVicBaseHarvester):
 
     def _get_package_name(self, harvest_object: HarvestObject, title: str) -> str:
         """Generate package name from title"""
-        package = harvest_object.package
+        package = (
+            self._get_existing_package(harvest_object)
+            if harvest_object.package_id
+            else None
+        )
 
         if package is None or package.title != title:
             log.debug("%s: generating new package name for title=%s (object %s)", self.HARVESTER, title, harvest_object.id)
@@ -1276,26 +2384,143 @@ class DelwpHarvester(DataVicBaseHarvester):
 
         return name
 
-    def _fetch_resources(self, metashare_dict: dict[str, Any]) -> list[dict[str, Any]]:
+    def _prefetch_resources(self, harvest_object: HarvestObject) -> None:
+        """Start fetching the resources of the next waiting objects of the job.
+
+        Fetching resources only involves HTTP requests (file sizes and
+        GeoServer layers), so it runs on a thread pool while the fetch stage
+        of the current object runs. The worker threads never touch the
+        SQLAlchemy session or the harvester settings, which change with
+        every _set_config; they get a copy of them, including the HTTP
+        session settings. Everything else in the fetch stage of an object
+        still happens on the consumer thread.
+
+        The window follows the gather order. Consumers may take the objects
+        in another order, in which case the resources of an object that was
+        not prefetched are fetched on the consumer thread."""
+        window = self.fetch_prefetch_workers * 2
+        next_objects = (
+            model.Session.query(
+                HarvestObject.id, HarvestObject.guid, HarvestObject.content
+            )
+            .filter(HarvestObject.harvest_job_id == harvest_object.harvest_job_id)
+            .filter(HarvestObject.state == "WAITING")
+            .filter(HarvestObject.content != None)  # noqa: E711
+            .filter(HarvestObject.id != harvest_object.id)
+            # objects inserted in one batch share their gathered time
+            .order_by(HarvestObject.gathered, HarvestObject.id)
+            .limit(window)
+            .all()
+        )
+        next_ids = {object_id for object_id, _guid, _content in next_objects}
+
+        # Objects that left the window were taken by another consumer
+        for object_id in list(self._prefetched_resources):
+            if object_id != harvest_object.id and object_id not in next_ids:
+                self._prefetched_resources.pop(object_id).cancel()
+
+        executor = self._get_prefetch_executor()
+        settings = self._get_resource_settings(snapshot=True)
+
+        for object_id, guid, content in next_objects:
+            if object_id in self._prefetched_resources:
+                continue
+
+            try:
+                metashare_dict = json.loads(content)
+            except ValueError:
+                continue
+
+            metashare_dict["_uuid"] = guid
+            self._prefetched_resources[object_id] = executor.submit(
+                self._fetch_resources, metashare_dict, settings
+            )
+
+    def _get_prefetch_executor(self) -> ThreadPoolExecutor:
+        if (
+            self._prefetch_executor is None
+            or self._prefetch_executor[0] != self.fetch_prefetch_workers
+        ):
+            if self._prefetch_executor is not None:
+                self._prefetch_executor[1].shutdown(wait=False, cancel_futures=True)
+
+            self._prefetch_executor = (
+                self.fetch_prefetch_workers,
+                ThreadPoolExecutor(
+                    max_workers=self.fetch_prefetch_workers,
+                    thread_name_prefix="delwp-fetch-prefetch",
+                ),
+            )
+
+        return self._prefetch_executor[1]
+
+    def _drop_prefetched_resources(self) -> None:
+        for future in self._prefetched_resources.values():
+            future.cancel()
+
+        self._prefetched_resources.clear()
+
+    def _get_resources(
+        self, harvest_object: HarvestObject, metashare_dict: dict[str, Any]
+    ) -> list[dict[str, Any]]:
+        """Return the resources stored by fetch_stage or prefetched for the
+        object, or fetch them now.
+
+        An exception raised while prefetching is raised here, so it is
+        recorded against the object exactly as without prefetching."""
+        if FETCHED_RESOURCES in metashare_dict:
+            return metashare_dict[FETCHED_RESOURCES]
+
+        future = self._prefetched_resources.pop(harvest_object.id, None)
+
+        if future is None or future.cancelled():
+            return self._fetch_resources(metashare_dict)
+
+        return future.result()
+
+    def _get_resource_settings(self, snapshot: bool = False) -> ResourceSettings:
+        """The current resource settings, or with snapshot set a copy of them
+        for another thread."""
+        config = getattr(self, "config", None) or {}
+        geoserver_urls = getattr(self, "geoserver_urls", None)
+
+        if snapshot:
+            config = MappingProxyType(deepcopy(config))
+            geoserver_urls = deepcopy(geoserver_urls)
+
+        return ResourceSettings(
+            config=config,
+            geoserver_urls=geoserver_urls,
+            test=self.test,
+            session=get_session_settings(config),
+        )
+
+    def _fetch_resources(
+        self,
+        metashare_dict: dict[str, Any],
+        settings: Optional[ResourceSettings] = None,
+    ) -> list[dict[str, Any]]:
         """Fetch resources data from a metashare_dict"""
+        if settings is None:
+            settings = self._get_resource_settings()
 
         resources: list[dict[str, Any]] = []
 
-        resources.extend(self._get_resources_by_formats(metashare_dict))
-        resources.extend(self._get_geoserver_resoures(metashare_dict))
+        resources.extend(self._get_resources_by_formats(metashare_dict, settings))
+        resources.extend(self._get_geoserver_resoures(metashare_dict, settings))
 
         return resources
 
     def _get_resources_by_formats(
-        self, metashare_dict: dict[str, Any]
+        self, metashare_dict: dict[str, Any], settings: ResourceSettings
     ) -> list[dict[str, Any]]:
         resources: list[dict[str, Any]] = []
 
-        res_url_prefix: Optional[str] = self.config.get("resource_url_prefix")
+        res_url_prefix: Optional[str] = settings.config.get("resource_url_prefix")
         res_url: str = (
             f"{res_url_prefix}{metashare_dict['_uuid']}" if res_url_prefix else ""
         )
-        attribution = self.config.get("resource_attribution")
+        attribution = settings.config.get("resource_attribution")
 
         if metashare_dict.get("available_formats") is None:
             return resources
@@ -1323,39 +2548,44 @@ class DelwpHarvester(DataVicBaseHarvester):
 
             res["name"] = f"{res['name']} {res_format}".replace("_", "")
 
-            res["size"] = get_resource_size(res_url)
-            res["filesize"] = res["size"]
-
             if attribution:
                 res["attribution"] = attribution
 
             resources.append(res)
 
+        sizes = get_resource_sizes(
+            [res["url"] for res in resources], settings.session
+        )
+        for res, size in zip(resources, sizes):
+            res["size"] = size
+            res["filesize"] = size
+
         return resources
 
     def _get_geoserver_resoures(
-        self, metashare_dict: dict[str, Any]
+        self, metashare_dict: dict[str, Any], settings: ResourceSettings
     ) -> list[dict[str, Any]]:
         resources: list[dict[str, Any]] = []
 
-        if "geoserver_dns" not in self.config:
+        if "geoserver_dns" not in settings.config or not settings.geoserver_urls:
             return resources
 
-        for res_fmt in self.geoserver_urls:
-            layer_data = self._get_geoserver_content_with_uuid(
-                self.geoserver_urls[res_fmt]["geoserver_url"], metashare_dict["_uuid"]
+        for res_fmt in settings.geoserver_urls:
+            layer = self._get_geoserver_content_with_uuid(
+                settings.geoserver_urls[res_fmt]["geoserver_url"],
+                metashare_dict["_uuid"],
+                settings,
             )
 
-            if not layer_data:
+            if not layer:
                 continue
 
-            layer_title: str = layer_data.find_previous("Title").text.upper()
-            layer_name: str = layer_data.find_previous("Name").text
-            resource_url: str = self.geoserver_urls[res_fmt]["resource_url"]
+            layer_name, layer_title = layer
+            resource_url: str = settings.geoserver_urls[res_fmt]["resource_url"]
 
             resources.append(
                 {
-                    "name": f"{layer_title} {res_fmt}",
+                    "name": f"{layer_title.upper()} {res_fmt}",
                     "format": res_fmt,
                     "url": resource_url.format(layername=layer_name),
                     "period_start": helpers.convert_date_to_isoformat(
@@ -1374,20 +2604,127 @@ class DelwpHarvester(DataVicBaseHarvester):
         return resources
 
     def _get_geoserver_content_with_uuid(
-        self, geoserver_url: str, metadata_uuid: Optional[str]
-    ) -> Optional[Tag]:
+        self,
+        geoserver_url: str,
+        metadata_uuid: Optional[str],
+        settings: Optional[ResourceSettings] = None,
+    ) -> Optional[tuple[str, str]]:
+        """Return the ``(name, title)`` of the GeoServer layer tagged with the
+        ``MetadataID=<uuid>`` keyword, if there is one."""
+        index = self._get_geoserver_capabilities_index(
+            geoserver_url, settings or self._get_resource_settings()
+        )
+
+        return index.get(f"{GEOSERVER_METADATA_KEYWORD}{metadata_uuid}")
+
+    def _get_geoserver_capabilities_index(
+        self, geoserver_url: str, settings: ResourceSettings
+    ) -> dict[str, tuple[str, str]]:
+        """Return the keyword index of a GetCapabilities document, fetching and
+        parsing it only once per job and TTL window.
+
+        The thread that finds no fresh entry downloads the document, threads
+        asking for it in the meantime wait for its result."""
+        with self._geoserver_capabilities_lock:
+            cached = self._geoserver_capabilities.get(geoserver_url)
+
+            if cached and time.monotonic() - cached[0] < GEOSERVER_CAPABILITIES_TTL:
+                future = cached[1]
+                owner = False
+            else:
+                future = Future()
+                self._geoserver_capabilities[geoserver_url] = (time.monotonic(), future)
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            index = self._fetch_geoserver_capabilities_index(geoserver_url, settings)
+        except BaseException as e:
+            self._forget_geoserver_capabilities(geoserver_url, future)
+            future.set_exception(e)
+            raise
+
+        if index is None:
+            # a failed download is not cached, the next call tries again
+            self._forget_geoserver_capabilities(geoserver_url, future)
+            index = {}
+
+        future.set_result(index)
+        return index
+
+    def _forget_geoserver_capabilities(
+        self, geoserver_url: str, future: Future[dict[str, tuple[str, str]]]
+    ) -> None:
+        with self._geoserver_capabilities_lock:
+            cached = self._geoserver_capabilities.get(geoserver_url)
+
+            if cached and cached[1] is future:
+                del self._geoserver_capabilities[geoserver_url]
+
+    def _fetch_geoserver_capabilities_index(
+        self, geoserver_url: str, settings: ResourceSettings
+    ) -> Optional[dict[str, tuple[str, str]]]:
         resp_text: Optional[str] = (
             self._get_mocked_geores(geoserver_url)
-            if self.test
-            else self._make_request(geoserver_url)
+            if settings.test
+            else self._make_request(
+                geoserver_url, session=get_session(settings.session)
+            )
         )
 
         if not resp_text:
-            return
+            return None
+
+        index = self._build_geoserver_capabilities_index(resp_text)
 
-        return BeautifulSoup(resp_text, "lxml-xml").find(  # type: ignore
-            "Keyword", string=f"MetadataID={metadata_uuid}"
+        log.debug(
+            "%s: indexed %d GeoServer layers from %s",
+            self.HARVESTER,
+            len(index),
+            geoserver_url,
         )
+        return index
+
+    def _build_geoserver_capabilities_index(
+        self, capabilities: str
+    ) -> dict[str, tuple[str, str]]:
+        """Map every ``MetadataID=<uuid>`` keyword of a GetCapabilities document
+        to the ``(Name, Title)`` of the layer it belongs to.
+
+        The document is read in a single streaming pass. The layer is the last
+        ``Name``/``Title`` element seen before the keyword, i.e. the same
+        elements ``find_previous`` returns on a full DOM. When a keyword is
+        repeated, the first layer wins.
+        """
+        index: dict[str, tuple[str, str]] = {}
+        name = title = ""
+
+        try:
+            for _event, elem in ET.iterparse(StringIO(capabilities)):
+                tag = elem.tag.rpartition("}")[2]
+
+                if tag == "Name":
+                    name = elem.text or ""
+                elif tag == "Title":
+                    title = elem.text or ""
+                elif tag == "Keyword" and (elem.text or "").startswith(
+                    GEOSERVER_METADATA_KEYWORD
+                ):
+                    index.setdefault(elem.text, (name, title))  # type: ignore
+
+                elem.clear()
+        except ET.ParseError as e:
+            log.warning(
+                "%s: malformed GetCapabilities document, indexed %d layers "
+                "before the error: %s",
+                self.HARVESTER,
+                len(index),
+                e,
+            )
+
+        return index
 
     def _get_mocked_records(self) -> str:
         """Mock data, use it instead _make_request for develop process"""
@@ -1420,9 +2757,7 @@ class DelwpHarvester(DataVicBaseHarvester):
         ``size``/``filesize``) are excluded so that an unchanged dataset hashes
         identically between runs.
         """
-        canonical = self._build_hash_payload(pkg_dict)
-        json_str = json.dumps(canonical, sort_keys=True)
-        return sha256(json_str.encode()).hexdigest()
+        return canonical_hash(self._build_hash_payload(pkg_dict), self.hash_algorithm)
 
     def _build_hash_payload(self, pkg_dict: dict[str, Any]) -> dict[str, Any]:
         """Project a pkg_dict onto the source-derived hash whitelist.
@@ -1430,36 +2765,149 @@ class DelwpHarvester(DataVicBaseHarvester):
         Resources are reduced to whitelisted fields and sorted by a stable key so
         that resource ordering does not affect the hash.
         """
-        # Keep only the package-level fields that come from the source metadata.
-        payload = self._pick_whitelisted_fields(pkg_dict, HASH_PKG_FIELDS)
-
-        # Reduce each resource to its source-derived fields (drops volatile values
-        # such as size/filesize).
-        source_resources = pkg_dict.get("resources") or []
-        whitelisted_resources = []
-        for resource in source_resources:
-            reduced_resource = self._pick_whitelisted_fields(
-                resource, HASH_RESOURCE_FIELDS
+        payload = {key: pkg_dict[key] for key in HASH_PKG_FIELDS if key in pkg_dict}
+
+        # Sort so that resource ordering does not change the hash. Resources
+        # with the same key keep their order, as they did when the reduced
+        # copies were sorted.
+        payload["resources"] = [
+            {key: resource[key] for key in HASH_RESOURCE_FIELDS if key in resource}
+            for resource in sorted(
+                pkg_dict.get("resources") or [], key=self._resource_sort_key
             )
-            whitelisted_resources.append(reduced_resource)
+        ]
 
-        # Sort so that resource ordering does not change the hash.
-        whitelisted_resources.sort(key=self._resource_sort_key)
+        return payload
 
-        payload["resources"] = whitelisted_resources
+    def _calculate_hash_sections(
+        self, pkg_dict: dict[str, Any], data_hash: str
+    ) -> dict[str, Any]:
+        """Hash the package fields, the tags and each resource of the
+        HASH_FIELD payload separately.
+
+        Resources are keyed by _get_resource_section_keys. The sections are
+        only compared while the stored HASH_FIELD is data_hash."""
+        payload = self._build_hash_payload(pkg_dict)
+        resources = payload.pop("resources")
+        tags = payload.pop("tags", None)
+        keys = _get_resource_section_keys(
+            (r.get("name"), r.get("format")) for r in pkg_dict.get("resources") or []
+        )
 
-        return payload
+        return {
+            "hash": data_hash,
+            "package": canonical_hash(payload, self.hash_algorithm),
+            "tags": canonical_hash(tags, self.hash_algorithm),
+            "resources": {
+                key: canonical_hash(
+                    {k: r[k] for k in HASH_RESOURCE_FIELDS if k in r},
+                    self.hash_algorithm,
+                )
+                for key, r in zip(keys, pkg_dict.get("resources") or [])
+            },
+        }
 
-    @staticmethod
-    def _pick_whitelisted_fields(
-        source: dict[str, Any], whitelist: frozenset[str]
+    def _get_partial_update(
+        self,
+        pkg_dict: dict[str, Any],
+        pkg: ExistingPackage,
+        hash_sections: dict[str, Any],
+    ) -> Optional[PartialUpdate]:
+        """Compare the hash sections of an import with the stored ones.
+
+        Returns None when the whole package has to be updated: the stored
+        sections are missing or outdated, resources were added or removed,
+        both the metadata and the resources changed, or more than one resource
+        changed."""
+        try:
+            stored = json.loads(pkg.data_hash_sections or "")
+        except ValueError:
+            return None
+
+        if not isinstance(stored, dict) or stored.get("hash") != pkg.data_hash:
+            return None
+
+        resources = hash_sections["resources"]
+        if set(stored.get("resources") or {}) != set(resources):
+            return None
+
+        metadata = (
+            stored.get("package") != hash_sections["package"]
+            or stored.get("tags") != hash_sections["tags"]
+        )
+        changed = [
+            key for key, value in resources.items() if stored["resources"][key] != value
+        ]
+
+        if metadata == bool(changed) or len(changed) > 1:
+            return None
+
+        existing_keys = _get_resource_section_keys(
+            (r.name, r.format) for r in pkg.resources
+        )
+        existing_ids = dict(zip(existing_keys, (r.id for r in pkg.resources)))
+
+        if set(existing_ids) != set(resources):
+            return None
+
+        incoming = dict(zip(resources, pkg_dict.get("resources") or []))
+        return PartialUpdate(
+            metadata=metadata,
+            resources=[(existing_ids[key], incoming[key]) for key in changed],
+        )
+
+    def _apply_partial_update(
+        self,
+        context: dict[str, Any],
+        pkg_dict: dict[str, Any],
+        pkg: ExistingPackage,
+        partial_update: PartialUpdate,
     ) -> dict[str, Any]:
-        """Return a copy of ``source`` containing only the whitelisted keys."""
-        picked: dict[str, Any] = {}
-        for key in whitelist:
-            if key in source:
-                picked[key] = source[key]
-        return picked
+        """Write the changed part of an existing package.
+
+        Changed metadata is written with package_update leaving the resources
+        out, which keeps them as they are. Changed resources are written with
+        one package_revise, together with the new hashes."""
+        if partial_update.metadata:
+            log.debug(
+                "%s: updating the metadata of dataset id=%s only",
+                self.HARVESTER,
+                pkg.id,
+            )
+            self._preserve_existing_metadata(pkg_dict, pkg)
+            pkg_dict.pop("resources", None)
+            context["allow_partial_update"] = True
+
+            return tk.get_action("package_update")(context, pkg_dict)
+
+        existing = self._read_preserved_metadata(pkg.id)
+
+        if existing is None:
+            existing = self._show_preserved_metadata(pkg.id)
+
+        self._merge_existing_extras(pkg_dict, existing)
+
+        # the extras list is replaced as a whole, package_revise would merge
+        # it with the existing one by position
+        revision: dict[str, Any] = {
+            "match": {"id": pkg.id},
+            "filter": ["-extras"],
+            "update": {
+                HASH_FIELD: pkg_dict[HASH_FIELD],
+                "extras": pkg_dict["extras"],
+            },
+        }
+
+        for resource_id, resource in partial_update.resources:
+            log.debug(
+                "%s: updating resource id=%s of dataset id=%s only",
+                self.HARVESTER,
+                resource_id,
+                pkg.id,
+            )
+            revision[f"update__resources__{resource_id}"] = resource
+
+        return tk.get_action("package_revise")(context, revision)["package"]
 
     @staticmethod
     def _resource_sort_key(resource: dict[str, Any]) -> tuple[str, str]:
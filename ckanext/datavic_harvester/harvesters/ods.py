@@ -15,7 +15,7 @@ from markdownify import markdownify
 
 import ckan.plugins.toolkit as tk
 from ckanext.harvest_basket.harvesters import ODSHarvester
-from .base import get_resource_size
+from .base import get_resource_sizes
 
 class DataVicODSHarvester(ODSHarvester):
 
@@ -40,7 +40,9 @@ class DataVicODSHarvester(ODSHarvester):
             if res["format"] == "CSV":
                 res["url"] = f'{res["url"]}?delimiter=%2C'
 
-            res["size"] = get_resource_size(res["url"])
-            res["filesize"] = res["size"]
+        sizes = get_resource_sizes([res["url"] for res in resources])
+        for res, size in zip(resources, sizes):
+            res["size"] = size
+            res["filesize"] = size
 
         return resources
@@ -0,0 +1,46 @@
+"""Canonical hashing of harvested data.
+
+A payload is hashed in the form of ``json.dumps(payload, sort_keys=True)``.
+With the ``sha256`` algorithm the hex digest is exactly the one of
+``sha256(json.dumps(payload, sort_keys=True).encode())``, which keeps hashes
+stored before the algorithm could be chosen valid. Digests of other
+algorithms are prefixed with the algorithm name, so they never match a hash
+of another algorithm.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from functools import partial
+from typing import Any, Callable
+
+
+COMPAT_ALGORITHM = "sha256"
+
+HASH_ALGORITHMS: dict[str, Callable[..., Any]] = {
+    "sha256": hashlib.sha256,
+    "blake2b": partial(hashlib.blake2b, digest_size=32),
+}
+
+# json.dumps builds a new encoder on every call with sort_keys. Payloads are
+# plain trees of dicts, lists and scalars, so the circular reference check is
+# not needed either.
+_encode = json.JSONEncoder(sort_keys=True, check_circular=False).encode
+
+
+def validate_algorithm(algorithm: str) -> None:
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(
+            "hash_algorithm must be one of: " + ", ".join(sorted(HASH_ALGORITHMS))
+        )
+
+
+def canonical_hash(payload: Any, algorithm: str = COMPAT_ALGORITHM) -> str:
+    """Return the hex digest of the canonical JSON form of payload"""
+    validate_algorithm(algorithm)
+    digest = HASH_ALGORITHMS[algorithm](_encode(payload).encode()).hexdigest()
+
+    if algorithm == COMPAT_ALGORITHM:
+        return digest
+
+    return f"{algorithm}:{digest}"
@@ -2,7 +2,9 @@ from __future__ import annotations
 
 import re
 import logging
-from typing import Optional, Any
+import threading
+from html.parser import HTMLParser
+from typing import Iterable, Iterator, NamedTuple, Optional, Any
 
 from bs4 import BeautifulSoup
 
@@ -14,6 +16,10 @@ from ckanext.datavicmain.helpers import field_choices
 
 log = logging.getLogger(__name__)
 
+# field name -> (schemas the lookup was built from, {lowercased label: value})
+_choice_lookups: dict[str, tuple[Any, dict[str, Any]]] = {}
+_choice_lookups_lock = threading.Lock()
+
 
 def remove_all_attrs_except_for(soup: BeautifulSoup) -> BeautifulSoup:
     """Remove all attributes from tags inside soup except for the listed ones
@@ -47,6 +53,88 @@ def extract_metadata_url(soup: BeautifulSoup, base_url: str) -> Optional[str]:
             return tag["href"]
 
 
+class SanitisedHtml(NamedTuple):
+    html: str
+    text: str
+    links: list[str]
+
+
+def sanitise_html(html: str) -> SanitisedHtml:
+    """Clean an HTML description with one walk over the tags of its soup.
+
+    Returns the HTML with all tags removed except for <a> and <br>, which only
+    keep their "href" and "target" attributes, its text and the href of each
+    <a> tag, in document order. The results are the ones of
+    remove_all_attrs_except_for, unwrap_all_except and get_text of a
+    html.parser soup."""
+    soup = BeautifulSoup(html, "html.parser")
+    links: list[str] = []
+
+    for tag in soup.find_all(True):
+        if tag.name not in ["a", "br"]:
+            tag.unwrap()
+            continue
+
+        if tag.name == "a" and "href" in tag.attrs:
+            links.append(tag["href"])
+
+        tag.attrs = {
+            attr: value
+            for attr, value in tag.attrs.items()
+            if attr in ["target", "href"]
+        }
+
+    return SanitisedHtml(str(soup), soup.get_text(), links)
+
+
+def find_metadata_url(links: Iterable[str], base_url: str) -> Optional[str]:
+    """Return the first link to a metadata URL"""
+    for link in links:
+        if base_url in link:
+            return link
+
+
+def iter_script_texts(chunks: Iterable[str], element_id: str) -> Iterator[str]:
+    """Yield the text of each <script> element with the id in an HTML
+    document read in chunks.
+
+    Each text is yielded as soon as its closing tag has been read, so the
+    caller can stop reading the document once it found what it needs. The
+    texts are the ones html.parser soups return as the string of the
+    elements."""
+    parser = _ScriptTextParser(element_id)
+
+    for chunk in chunks:
+        parser.feed(chunk)
+
+        while parser.texts:
+            yield parser.texts.pop(0)
+
+    parser.close()
+    yield from parser.texts
+
+
+class _ScriptTextParser(HTMLParser):
+    def __init__(self, element_id: str):
+        super().__init__()
+        self.texts: list[str] = []
+        self._element_id = element_id
+        self._text: Optional[list[str]] = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]):
+        if tag == "script" and ("id", self._element_id) in attrs:
+            self._text = []
+
+    def handle_data(self, data: str):
+        if self._text is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag: str):
+        if tag == "script" and self._text is not None:
+            self.texts.append("".join(self._text))
+            self._text = None
+
+
 def convert_date_to_isoformat(
     value: Optional[str], key: str, dataset_name: Optional[str], strip_tz=True
 ) -> Optional[str]:
@@ -80,15 +168,57 @@ def get_tags(tags: str) -> list[dict[str, str]]:
 
 def map_update_frequency(value: str):
     """Map local update_frequency to remote portal ones"""
+    return get_field_choice_lookup("update_frequency").get(value.lower(), "unknown")
 
-    frequency_mapping: list[dict[str, Any]] = get_datavic_update_frequencies()
 
-    for frequency in frequency_mapping:
-        if frequency["label"].lower() == value.lower():
-            return frequency["value"]
+def get_datavic_update_frequencies():
+    return field_choices("update_frequency")
 
-    return "unknown"
 
+def get_field_choice_lookup(field_name: str) -> dict[str, Any]:
+    """Return a lowercased `label -> value` lookup of the choices of a dataset
+    field.
 
-def get_datavic_update_frequencies():
-    return field_choices("update_frequency")
+    The lookup is built once per process and rebuilt when scheming reloads
+    the dataset schemas. The first choice wins for duplicate labels."""
+    schemas = _get_dataset_schemas()
+
+    with _choice_lookups_lock:
+        cached = _choice_lookups.get(field_name)
+
+        if cached and cached[0] is schemas:
+            return cached[1]
+
+    lookup: dict[str, Any] = {}
+    for choice in field_choices(field_name):
+        lookup.setdefault(choice["label"].lower(), choice["value"])
+
+    with _choice_lookups_lock:
+        _choice_lookups[field_name] = (schemas, lookup)
+
+    return lookup
+
+
+def clear_field_choice_lookups() -> None:
+    with _choice_lookups_lock:
+        _choice_lookups.clear()
+
+
+def get_dataset_fields(dataset_type: str) -> Optional[dict[str, dict[str, Any]]]:
+    """Return the fields of the scheming schema of a dataset type by name, or
+    None when scheming does not know the type"""
+    helper = tk.h.get("scheming_get_dataset_schema")
+    schema = helper(dataset_type) if helper else None
+
+    if not schema:
+        return None
+
+    return {field["field_name"]: field for field in schema.get("dataset_fields", [])}
+
+
+def _get_dataset_schemas() -> Any:
+    """Return the dataset schemas loaded by scheming. A reload replaces the
+    object, which tells the cached lookups apart."""
+    helper = tk.h.get("scheming_dataset_schemas")
+
+    return helper() if helper else None
@@ -0,0 +1,162 @@
+"""Shared HTTP sessions for the harvesters.
+
+Each distinct set of settings gets one process-wide ``requests.Session`` with a
+connection pool, so the thousands of requests made during a harvest job reuse
+keep-alive connections instead of opening a new TCP/TLS connection each time.
+Idempotent requests are retried on connection errors and on 429/5xx responses.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import ckan.plugins.toolkit as tk
+
+
+log = logging.getLogger(__name__)
+
+HTTP_POOL_SIZE = int(tk.config.get("ckanext.datavic_harvester.http_pool_size") or 10)
+HTTP_RETRIES = int(tk.config.get("ckanext.datavic_harvester.http_retries") or 3)
+HTTP_BACKOFF_FACTOR = float(
+    tk.config.get("ckanext.datavic_harvester.http_backoff_factor") or 0.5
+)
+HTTP_TIMEOUT = int(tk.config.get("ckanext.datavic_harvester.http_timeout") or 60)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions: dict["SessionSettings", "HarvesterSession"] = {}
+_sessions_lock = threading.Lock()
+
+
+class SessionSettings(NamedTuple):
+    pool_size: int = HTTP_POOL_SIZE
+    retries: int = HTTP_RETRIES
+    backoff_factor: float = HTTP_BACKOFF_FACTOR
+    timeout: int = HTTP_TIMEOUT
+
+
+class HarvesterSession(requests.Session):
+    """Session that applies a default timeout to every request"""
+
+    def __init__(self, settings: SessionSettings):
+        super().__init__()
+        self.settings = settings
+
+        adapter = HTTPAdapter(
+            pool_connections=settings.pool_size,
+            pool_maxsize=settings.pool_size,
+            max_retries=Retry(
+                total=settings.retries,
+                backoff_factor=settings.backoff_factor,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset(["GET", "HEAD"]),
+                raise_on_status=False,
+            ),
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.settings.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def get_session(settings: Optional[SessionSettings] = None) -> HarvesterSession:
+    """Return the process-wide session for the settings"""
+    settings = settings or SessionSettings()
+
+    with _sessions_lock:
+        if settings not in _sessions:
+            _sessions[settings] = HarvesterSession(settings)
+
+        return _sessions[settings]
+
+
+def get_session_settings(config: dict[str, Any]) -> SessionSettings:
+    """Build session settings from a harvest source config, falling back to
+    the CKAN config for the options it does not set"""
+    defaults = SessionSettings()
+    retries = config.get("http_retries")
+    backoff_factor = config.get("http_backoff_factor")
+
+    return SessionSettings(
+        pool_size=int(config.get("http_pool_size") or defaults.pool_size),
+        retries=defaults.retries if retries is None else int(retries),
+        backoff_factor=(
+            defaults.backoff_factor if backoff_factor is None else float(backoff_factor)
+        ),
+        timeout=int(config.get("http_timeout") or defaults.timeout),
+    )
+
+
+def validate_session_config(config: dict[str, Any]) -> None:
+    for key in ("http_pool_size", "http_retries", "http_timeout"):
+        if key not in config:
+            continue
+
+        try:
+            value = int(config[key])
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} must be an integer")
+
+        if value < 0 or (value == 0 and key != "http_retries"):
+            raise ValueError(f"{key} must be a positive integer")
+
+    if "http_backoff_factor" in config:
+        try:
+            value = float(config["http_backoff_factor"])
+        except (TypeError, ValueError):
+            raise ValueError("http_backoff_factor must be a number")
+
+        if value < 0:
+            raise ValueError("http_backoff_factor must not be negative")
+
+
+def get_download_proxies() -> Optional[dict[str, str]]:
+    """Return the proxies for resource downloads from ckan.download_proxy"""
+    if "ckan.download_proxy" not in tk.config:
+        return None
+
+    proxy = tk.config.get("ckan.download_proxy")
+    return {"http": proxy, "https": proxy}
+
+
+def connection_stats() -> dict[str, dict[str, int]]:
+    """Return the number of connections opened and requests sent per host.
+
+    The difference between the two is the number of requests that reused a
+    keep-alive connection."""
+    stats: dict[str, dict[str, int]] = {}
+
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+
+    for session in sessions:
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            if not isinstance(adapter, HTTPAdapter):
+                continue
+
+            pool_managers = [adapter.poolmanager, *adapter.proxy_manager.values()]
+
+            for manager in pool_managers:
+                for key in manager.pools.keys():
+                    pool = manager.pools.get(key)
+                    if pool is None:
+                        continue
+
+                    host_stats = stats.setdefault(
+                        f"{pool.scheme}://{pool.host}:{pool.port}",
+                        {"connections": 0, "requests": 0, "reused": 0},
+                    )
+                    host_stats["connections"] += pool.num_connections
+                    host_stats["requests"] += pool.num_requests
+                    host_stats["reused"] = max(
+                        host_stats["requests"] - host_stats["connections"], 0
+                    )
+
+    return stats
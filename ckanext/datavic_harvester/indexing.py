@@ -0,0 +1,302 @@
+"""Deferred search indexing for harvest imports.
+
+CKAN indexes a package in Solr as part of every package_create, package_update
+and package_delete call. With the ``deferred_indexing`` source option the
+harvesters turn this off for the thread that imports an object, queue the id
+of the package if the import wrote it and index the queued packages in
+batches, with one Solr commit per batch. A batch is indexed when it is full,
+when the oldest queued package has waited for INDEX_INTERVAL seconds, when the
+process starts importing the objects of another job, when the process has
+imported as many objects as the job had left when it started on it and when
+the process exits. A batch that fails is indexed again one package at a time.
+"""
+from __future__ import annotations
+
+import atexit
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Iterator, Optional
+
+import flask
+
+import ckan.plugins.toolkit as tk
+import ckan.lib.search as search
+from ckan import model
+
+from ckanext.harvest.model import HarvestObject
+
+
+log = logging.getLogger(__name__)
+
+INDEX_BATCH_SIZE = int(
+    tk.config.get("ckanext.datavic_harvester.index_batch_size") or 100
+)
+INDEX_INTERVAL = int(tk.config.get("ckanext.datavic_harvester.index_interval") or 300)
+
+_indexer: Optional["DeferredIndexer"] = None
+_indexer_lock = threading.Lock()
+
+# threads running a deferred import, whose package writes are not indexed
+_local = threading.local()
+
+
+class DeferredIndexer:
+    """Queue of packages waiting to be indexed"""
+
+    def __init__(self, batch_size: int = INDEX_BATCH_SIZE, interval: int = INDEX_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+
+        # dict as an ordered set of package ids
+        self._pending: dict[str, None] = {}
+        self._pending_since: Optional[float] = None
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.RLock()
+
+        # the harvest job of the last imported object and the number of its
+        # objects left to import, counted when the process started on the job
+        self.job_id: Optional[str] = None
+        self.objects_left: Optional[int] = None
+
+    @property
+    def pending(self) -> list[str]:
+        return list(self._pending)
+
+    def add(self, package_id: str, batch_size: Optional[int] = None) -> None:
+        """Queue a package. batch_size overrides the one of the indexer for
+        the batches indexed by this call."""
+        batch_size = batch_size or self.batch_size
+
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+                self._start_timer()
+
+            self._pending[package_id] = None
+
+            if (
+                len(self._pending) >= batch_size
+                or time.monotonic() - self._pending_since >= self.interval  # type: ignore
+            ):
+                self.flush(batch_size)
+
+    def flush(self, batch_size: Optional[int] = None) -> None:
+        """Index all queued packages, batch_size at a time"""
+        batch_size = batch_size or self.batch_size
+
+        with self._lock:
+            package_ids, self._pending = list(self._pending), {}
+            self._pending_since = None
+
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+            for start in range(0, len(package_ids), batch_size):
+                self._index_batch(package_ids[start : start + batch_size])
+
+    def _start_timer(self) -> None:
+        """Index the queue after interval seconds, even if no other package
+        is queued in the meantime"""
+        app = flask.current_app._get_current_object() if flask.has_app_context() else None
+
+        self._timer = threading.Timer(self.interval, self._flush_on_timer, (app,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_on_timer(self, app: Optional[flask.Flask]) -> None:
+        try:
+            with app.app_context() if app else nullcontext():
+                self.flush()
+        except Exception:
+            log.error("Failed to index the queued packages", exc_info=True)
+        finally:
+            # the timer thread has a session of its own
+            model.Session.remove()
+
+    def _index_batch(self, package_ids: list[str]) -> None:
+        try:
+            search.rebuild(package_ids=package_ids)
+        except Exception:
+            log.warning(
+                "Failed to index a batch of %d packages, indexing them one at a time",
+                len(package_ids),
+                exc_info=True,
+            )
+
+            for package_id in package_ids:
+                _index_package(package_id)
+        else:
+            log.debug("Indexed a batch of %d packages", len(package_ids))
+
+
+def get_indexer() -> DeferredIndexer:
+    """Return the process-wide indexer. The queued packages are indexed when
+    the process exits."""
+    global _indexer
+
+    with _indexer_lock:
+        if _indexer is None:
+            _indexer = DeferredIndexer()
+            atexit.register(_indexer.flush)
+
+        _install_index_filter()
+
+        return _indexer
+
+
+def _install_index_filter() -> None:
+    """Make the search plugin of CKAN skip the packages written by a thread
+    that runs a deferred import.
+
+    The plugin indexes every package written while
+    ckan.search.automatic_indexing is set, and that option is shared by all
+    threads of the process, so it cannot be turned off for one import."""
+    plugin = search.SynchronousSearchPlugin
+    notify = plugin.notify
+
+    if getattr(notify, "deferred_indexing", False):
+        return
+
+    @functools.wraps(notify)
+    def notify_unless_deferred(self, entity: Any, operation: str) -> None:
+        if getattr(_local, "deferred", False):
+            return
+
+        notify(self, entity, operation)
+
+    notify_unless_deferred.deferred_indexing = True  # type: ignore
+    plugin.notify = notify_unless_deferred  # type: ignore
+
+
+class DeferredImport:
+    """An import run by deferred_indexing. The caller sets result to the
+    return value of the import."""
+
+    def __init__(self):
+        self.result: Any = None
+
+
+@contextmanager
+def deferred_indexing(
+    harvest_object: HarvestObject, config: dict[str, Any]
+) -> Iterator[DeferredImport]:
+    """Import a harvest object without indexing its package, when the source
+    config enables deferred_indexing, and queue the package for indexing if
+    the import succeeded and created, updated or deleted it.
+
+    Only the packages written by the current thread are left out of the
+    index, other threads of the process index theirs as usual."""
+    deferred_import = DeferredImport()
+
+    if not tk.asbool(config.get("deferred_indexing", False)):
+        _start_job(harvest_object.harvest_job_id)
+        yield deferred_import
+        return
+
+    indexer = get_indexer()
+    _start_job(harvest_object.harvest_job_id)
+    batch_size = int(config.get("index_batch_size") or 0) or None
+    revision = _get_package_revision(harvest_object.package_id)
+
+    with indexer._lock:
+        if indexer.objects_left is None:
+            indexer.objects_left = _count_objects_to_import(
+                harvest_object.harvest_job_id
+            )
+
+    _local.deferred = True
+
+    try:
+        yield deferred_import
+    finally:
+        _local.deferred = False
+
+        if (
+            deferred_import.result is True
+            and harvest_object.package_id
+            and _get_package_revision(harvest_object.package_id) != revision
+        ):
+            indexer.add(harvest_object.package_id, batch_size)
+
+        with indexer._lock:
+            indexer.objects_left -= 1  # type: ignore
+            job_done = indexer.objects_left <= 0
+
+        # when other processes import objects of the job too, the count is
+        # not reached and the timer indexes the queue
+        if job_done:
+            indexer.flush(batch_size)
+
+
+def validate_indexing_config(config: dict[str, Any]) -> None:
+    if "deferred_indexing" in config and not isinstance(
+        config["deferred_indexing"], bool
+    ):
+        try:
+            config["deferred_indexing"] = tk.asbool(config["deferred_indexing"])
+        except ValueError as e:
+            raise ValueError("deferred_indexing must be a boolean") from e
+
+    if "index_batch_size" in config:
+        try:
+            batch_size = int(config["index_batch_size"])
+        except (TypeError, ValueError):
+            raise ValueError("index_batch_size must be an integer")
+
+        if batch_size < 1:
+            raise ValueError("index_batch_size must be >= 1")
+
+
+def _start_job(job_id: Optional[str]) -> None:
+    """Index the packages queued for another job, so they do not wait for
+    the end of this one"""
+    if _indexer is None:
+        return
+
+    with _indexer._lock:
+        if _indexer.job_id != job_id:
+            _indexer.job_id = job_id
+            _indexer.objects_left = None
+            _indexer.flush()
+
+
+def _get_package_revision(package_id: Optional[str]) -> Optional[tuple[Any, ...]]:
+    """Return the modification time and state of a package, which change
+    when it is updated or deleted"""
+    if not package_id:
+        return None
+
+    row = (
+        model.Session.query(model.Package.metadata_modified, model.Package.state)
+        .filter(model.Package.id == package_id)
+        .first()
+    )
+    return tuple(row) if row else None
+
+
+def _index_package(package_id: str) -> None:
+    try:
+        search.rebuild(package_id)
+    except tk.ObjectNotFound:
+        # purged since it was queued
+        search.clear(package_id)
+    except Exception:
+        log.error("Failed to index package %s", package_id, exc_info=True)
+
+
+def _count_objects_to_import(job_id: Optional[str]) -> int:
+    """Number of objects of the job that are still waiting to be imported,
+    including the one being imported"""
+    if not job_id:
+        return 0
+
+    return (
+        model.Session.query(HarvestObject.id)
+        .filter(HarvestObject.harvest_job_id == job_id)
+        .filter(HarvestObject.state.in_(["WAITING", "FETCH", "IMPORT"]))
+        .count()
+    )
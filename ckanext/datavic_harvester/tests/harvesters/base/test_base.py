@@ -1,9 +1,17 @@
+import threading
+import time
+from unittest import mock
+
 import pytest
+import requests
 
 from ckan.model import State
 from ckan.tests.helpers import call_action
 
+from ckanext.datavic_harvester.cache import ValidatorCache
+from ckanext.datavic_harvester.harvesters import base
 from ckanext.datavic_harvester.harvesters.base import DataVicBaseHarvester as Base
+from ckanext.datavic_harvester.http_session import SessionSettings
 
 
 @pytest.fixture
@@ -46,3 +54,377 @@ class TestBaseHarvester:
 
         harvest_object = harvest_object_factory()
         assert not harvester._get_object_extra(harvest_object, "test")
+
+
+class TestGetResourceSizes:
+    def test_sizes_returned_in_input_order(self):
+        sizes = {"https://a.example/1": 10, "https://b.example/2": 20, "": 0}
+
+        with mock.patch.object(
+            base,
+            "get_resource_size",
+            side_effect=lambda url, stop=None, session_settings=None: sizes[url],
+        ):
+            result = base.get_resource_sizes(
+                ["https://b.example/2", "", "https://a.example/1"]
+            )
+
+        assert result == [20, 0, 10]
+
+    def test_session_settings_are_passed_to_probes(self):
+        settings = SessionSettings(timeout=5)
+
+        with mock.patch.object(
+            base, "get_resource_size", return_value=1
+        ) as mock_size:
+            base.get_resource_sizes(
+                ["https://a.example/1", "https://b.example/2"], settings
+            )
+
+        assert [call.args[2] for call in mock_size.call_args_list] == [
+            settings,
+            settings,
+        ]
+
+    def test_duplicate_urls_are_measured_once(self):
+        with mock.patch.object(
+            base, "get_resource_size", return_value=42
+        ) as mock_size:
+            result = base.get_resource_sizes(
+                ["https://a.example/1", "https://a.example/1", "https://a.example/2"]
+            )
+
+        assert result == [42, 42, 42]
+        assert sorted(call.args[0] for call in mock_size.call_args_list) == [
+            "https://a.example/1",
+            "https://a.example/2",
+        ]
+
+    def test_unfinished_probes_get_zero_after_deadline(self):
+        def fake_size(url, stop=None, session_settings=None):
+            if "slow" in url:
+                time.sleep(1)
+            return 5
+
+        with (
+            mock.patch.object(base, "get_resource_size", side_effect=fake_size),
+            mock.patch.object(base, "FILESIZE_DEADLINE", 0.2),
+        ):
+            result = base.get_resource_sizes(
+                ["https://fast.example/1", "https://slow.example/1"]
+            )
+
+        assert result == [5, 0]
+
+    def test_per_host_limit(self):
+        active: list[int] = []
+        peak: list[int] = []
+        lock = threading.Lock()
+
+        def fake_size(url, stop=None, session_settings=None):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+            return 1
+
+        urls = [f"https://limited.example/{i}" for i in range(6)]
+        with (
+            mock.patch.object(base, "get_resource_size", side_effect=fake_size),
+            mock.patch.object(base, "_host_slots", {}),
+            mock.patch.object(base, "FILESIZE_MAX_PER_HOST", 1),
+        ):
+            assert base.get_resource_sizes(urls) == [1] * 6
+
+            # hosts without running probes are not kept
+            assert base._host_slots == {}
+
+        assert max(peak) == 1
+
+    def test_probes_are_stopped_after_deadline(self):
+        chunks_read: list[int] = []
+
+        def slow_chunks(*args, **kwargs):
+            for i in range(100):
+                chunks_read.append(i)
+                time.sleep(0.05)
+                yield b"x"
+
+        response = _response()
+        response.iter_content.side_effect = slow_chunks
+        urls = ["https://slow.example/1", "https://slow.example/2"]
+
+        with (
+            mock.patch.object(base, "_get_response", return_value=response),
+            mock.patch.object(base, "FILESIZE_PROBE_STRATEGIES", ["stream"]),
+            mock.patch.object(base, "get_filesize_cache", return_value=None),
+            mock.patch.object(base, "_host_slots", {}),
+            mock.patch.object(base, "FILESIZE_MAX_PER_HOST", 1),
+            mock.patch.object(base, "FILESIZE_DEADLINE", 0.2),
+        ):
+            assert base.get_resource_sizes(urls) == [0, 0]
+
+            # the stopped probes give back their host slot
+            for _ in range(20):
+                if not base._host_slots:
+                    break
+                time.sleep(0.05)
+
+            assert base._host_slots == {}
+
+        response.close.assert_called()
+        assert len(chunks_read) < 100
+
+
+def _response(status_code=200, headers=None, body=b"12345"):
+    response = mock.Mock(status_code=status_code, headers=headers or {})
+    response.iter_content.return_value = [body]
+    return response
+
+
+def _http_error(status_code):
+    return requests.exceptions.HTTPError(
+        response=mock.Mock(status_code=status_code)
+    )
+
+
+class TestResourceSizeCache:
+    url = "https://a.example/data.csv"
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        cache = ValidatorCache(str(tmp_path / "cache.sqlite3"), "filesize", 3600, 100)
+
+        with (
+            mock.patch.object(base, "get_filesize_cache", return_value=cache),
+            mock.patch.object(
+                base, "FILESIZE_PROBE_STRATEGIES", [base.PROBE_STREAM]
+            ),
+        ):
+            yield cache
+
+    def test_size_is_stored_with_validators(self, cache: ValidatorCache):
+        response = _response(headers={"etag": '"v1"', "last-modified": "Mon"})
+
+        with mock.patch.object(base, "_get_response", return_value=response):
+            assert base.get_resource_size(self.url) == 5
+
+        entry = cache.get(self.url)
+        assert entry.value == 5
+        assert entry.etag == '"v1"'
+        assert entry.last_modified == "Mon"
+
+    def test_not_modified_reuses_cached_size(self, cache: ValidatorCache):
+        cache.set(self.url, 1024, etag='"v1"', last_modified="Mon")
+
+        with mock.patch.object(
+            base, "_get_response", return_value=_response(status_code=304)
+        ) as mock_get:
+            assert base.get_resource_size(self.url) == 1024
+
+        assert mock_get.call_args.args[1] == {
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Mon",
+        }
+        assert cache.stats()["hits"] == 1
+
+    def test_matching_etag_reuses_cached_size(self, cache: ValidatorCache):
+        """Servers that ignore conditional headers still answer with the same
+        ETag for an unchanged resource"""
+        cache.set(self.url, 1024, etag='"v1"')
+        response = _response(headers={"etag": '"v1"'})
+
+        with mock.patch.object(base, "_get_response", return_value=response):
+            assert base.get_resource_size(self.url) == 1024
+
+        response.iter_content.assert_not_called()
+
+    def test_changed_resource_is_measured_again(self, cache: ValidatorCache):
+        cache.set(self.url, 1024, etag='"v1"')
+        response = _response(headers={"etag": '"v2"'})
+
+        with mock.patch.object(base, "_get_response", return_value=response):
+            assert base.get_resource_size(self.url) == 5
+
+        assert cache.get(self.url).value == 5
+        assert cache.stats()["misses"] == 1
+
+    def test_response_without_validators_is_not_stored(self, cache: ValidatorCache):
+        with mock.patch.object(base, "_get_response", return_value=_response()):
+            assert base.get_resource_size(self.url) == 5
+
+        assert cache.get(self.url) is None
+
+
+class TestFetchDerivedValue:
+    url = "https://a.example/metadata.html"
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return ValidatorCache(
+            str(tmp_path / "cache.sqlite3"), "update_frequency", 3600, 100
+        )
+
+    def _session(self, response):
+        session = mock.Mock()
+        session.get.return_value = response
+        return session
+
+    def test_value_is_stored_with_validators(self, cache: ValidatorCache):
+        response = _response(headers={"etag": '"v1"'})
+        response.iter_content.return_value = ["123", "45"]
+        session = self._session(response)
+
+        assert (
+            base.fetch_derived_value(
+                self.url, lambda chunks: "".join(chunks), session, cache
+            )
+            == "12345"
+        )
+
+        assert session.get.call_args.kwargs["stream"] is True
+        response.iter_content.assert_called_once_with(
+            base.CHUNK_SIZE, decode_unicode=True
+        )
+        response.close.assert_called()
+        assert cache.get(self.url).value == "12345"
+
+    def test_not_modified_reuses_cached_value(self, cache: ValidatorCache):
+        cache.set(self.url, "weekly", etag='"v1"')
+        session = self._session(_response(status_code=304))
+        derive = mock.Mock()
+
+        assert base.fetch_derived_value(self.url, derive, session, cache) == "weekly"
+
+        derive.assert_not_called()
+        assert session.get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+        assert cache.stats()["hits"] == 1
+
+    def test_changed_page_is_derived_again(self, cache: ValidatorCache):
+        cache.set(self.url, "weekly", etag='"v1"')
+        response = _response(headers={"etag": '"v2"'})
+
+        assert (
+            base.fetch_derived_value(
+                self.url, lambda chunks: "monthly", self._session(response), cache
+            )
+            == "monthly"
+        )
+        assert cache.get(self.url).value == "monthly"
+
+    def test_request_error_is_raised(self, cache: ValidatorCache):
+        response = _response(status_code=500)
+        response.raise_for_status.side_effect = _http_error(500)
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            base.fetch_derived_value(
+                self.url, mock.Mock(), self._session(response), cache
+            )
+
+        assert cache.get(self.url) is None
+
+
+class TestProbeStrategies:
+    url = "https://a.example/data.csv"
+
+    @pytest.fixture(autouse=True)
+    def probes(self):
+        with (
+            mock.patch.object(base, "get_filesize_cache", return_value=None),
+            mock.patch.object(base, "_host_probe_failures", {}),
+            mock.patch.object(
+                base,
+                "FILESIZE_PROBE_STRATEGIES",
+                [base.PROBE_HEAD, base.PROBE_RANGE, base.PROBE_STREAM],
+            ),
+        ):
+            yield
+
+    def test_head_content_length(self):
+        response = _response(headers={"content-length": "1024"})
+
+        with mock.patch.object(
+            base, "_get_response", return_value=response
+        ) as mock_get:
+            assert base.get_resource_size(self.url) == 1024
+
+        mock_get.assert_called_once_with(
+            self.url,
+            {"Accept-Encoding": "identity"},
+            method="head",
+            session_settings=None,
+        )
+        response.iter_content.assert_not_called()
+
+    def test_source_session_settings_are_used(self):
+        settings = SessionSettings(timeout=5, retries=0)
+        session = mock.Mock()
+        session.request.return_value = _response(headers={"content-length": "1024"})
+
+        with mock.patch.object(
+            base, "get_session", return_value=session
+        ) as get_session:
+            assert base.get_resource_size(self.url, session_settings=settings) == 1024
+
+        get_session.assert_called_once_with(settings)
+        # the timeout of the source settings applies
+        assert "timeout" not in session.request.call_args.kwargs
+
+    def test_compressed_head_falls_back_to_range(self):
+        """A gzipped content-length is not the size of the resource"""
+        responses = [
+            _response(headers={"content-length": "10", "content-encoding": "gzip"}),
+            _response(status_code=206, headers={"content-range": "bytes 0-0/2048"}),
+        ]
+
+        with mock.patch.object(
+            base, "_get_response", side_effect=responses
+        ) as mock_get:
+            assert base.get_resource_size(self.url) == 2048
+
+        assert mock_get.call_args.args[1] == {
+            "Accept-Encoding": "identity",
+            "Range": "bytes=0-0",
+        }
+
+    def test_stream_is_the_last_resort(self):
+        responses = [
+            _http_error(405),
+            _response(headers={"content-range": "bytes */*"}),
+            _response(body=b"123"),
+        ]
+
+        with mock.patch.object(base, "_get_response", side_effect=responses):
+            assert base.get_resource_size(self.url) == 3
+
+    def test_missing_resource_is_not_probed_further(self):
+        with mock.patch.object(
+            base, "_get_response", side_effect=_http_error(404)
+        ) as mock_get:
+            assert base.get_resource_size(self.url) == 0
+
+        mock_get.assert_called_once()
+
+    def test_failing_strategies_are_skipped_for_the_host(self):
+        def fake_response(url, headers, method="get", session_settings=None):
+            if method == "head" or "Range" in headers:
+                raise _http_error(405)
+            return _response(body=b"123")
+
+        with mock.patch.object(
+            base, "_get_response", side_effect=fake_response
+        ) as mock_get:
+            for _ in range(base._PROBE_FAILURE_LIMIT):
+                base.get_resource_size(self.url)
+
+            mock_get.reset_mock()
+            assert base.get_resource_size("https://a.example/other.csv") == 3
+            mock_get.assert_called_once_with(
+                "https://a.example/other.csv", {}, session_settings=None
+            )
+
+            mock_get.reset_mock()
+            base.get_resource_size("https://b.example/data.csv")
+            assert mock_get.call_count == 3
@@ -27,6 +27,16 @@ class TestBaseConfig:
         harvester._set_config("")
         assert harvester.config == {}
 
+    def test_set_config_parses_each_string_once(self, harvester: Base):
+        harvester._set_config('{"a": 1}')
+        config = harvester.config
+
+        harvester._set_config('{"a": 1}')
+        assert harvester.config is config
+
+        harvester._set_config('{"a": 2}')
+        assert harvester.config == {"a": 2}
+
     def test_validate_empty(self, harvester: Base):
         with pytest.raises(ValueError, match="No config options set"):  # type: ignore
             harvester.validate_config(None)
@@ -1,12 +1,16 @@
 from __future__ import annotations
 
 import json
+import time
 from typing import Any
 from typing_extensions import TypedDict
 from types import GeneratorType
 from datetime import datetime as dt
+from unittest import mock
 
 import pytest
+import requests
+from bs4 import BeautifulSoup
 
 from ckan import model
 from ckan.tests.helpers import call_action
@@ -17,6 +21,7 @@ import ckanext.datavic_harvester.helpers as h
 from ckanext.datavic_harvester.harvesters import (
     DataVicDCATJSONHarvester as DcatHarvester,
 )
+from ckanext.datavic_harvester.harvesters import dcat_json
 
 
 class DcatConfig(TypedDict):
@@ -60,6 +65,41 @@ class TestDcatHarvester:
         assert harvest_object.guid == datasets[0]["identifier"]
         assert json.loads(harvest_object.content) == datasets[0]
 
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_gather_stage_skips_unchanged(
+        self,
+        harvester: DcatHarvester,
+        harvest_job_factory,
+        harvest_source_factory,
+        dcat_config: DcatConfig,
+    ):
+        source = harvest_source_factory(
+            config=json.dumps(dcat_config), source_type=harvester.info()["name"]
+        )
+        obj_ids = harvester.gather_stage(harvest_job_factory(source=source))
+        harvest_object = harvest_model.HarvestObject.get(obj_ids[0])
+        assert harvester.import_stage(harvest_object) is True
+
+        assert harvester._get_modified_dates(source.id) == {
+            harvest_object.guid: harvester._get_modified_date(
+                json.loads(harvest_object.content)
+            )
+        }
+
+        obj_ids = harvester.gather_stage(harvest_job_factory(source=source))
+        guids = {harvest_model.HarvestObject.get(id_).guid for id_ in obj_ids}
+
+        assert len(obj_ids) == len(guids) == len(
+            json.loads(harvester._get_mocked_content())["dataset"]
+        ) - 1
+        assert harvest_object.guid not in guids
+
+        source.config = json.dumps(dict(dcat_config, force_all=True))
+        obj_ids = harvester.gather_stage(harvest_job_factory(source=source))
+        guids = {harvest_model.HarvestObject.get(id_).guid for id_ in obj_ids}
+
+        assert harvest_object.guid in guids
+
     @pytest.mark.usefixtures("with_plugins", "clean_db")
     def test_import_stage(
         self,
@@ -142,6 +182,132 @@ class TestDcatHarvester:
         for tag in pkg_dict["tags"]:
             assert tag["name"] in dcat_dataset["keyword"]
 
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_fetch_stage_stores_fetched_values(
+        self,
+        harvester: DcatHarvester,
+        harvest_source_factory,
+        harvest_job_factory,
+        harvest_object_factory,
+        dcat_config: DcatConfig,
+        dcat_dataset: dict[str, Any],
+    ):
+        source = harvest_source_factory(
+            config=json.dumps(dcat_config), source_type=harvester.info()["name"]
+        )
+        harvest_object = harvest_object_factory(
+            guid=dcat_dataset["identifier"],
+            content=json.dumps(dcat_dataset),
+            job=harvest_job_factory(source=source),
+        )
+
+        with mock.patch.object(
+            dcat_json,
+            "get_resource_sizes",
+            side_effect=lambda urls, session_settings=None: [10] * len(urls),
+        ):
+            assert harvester.fetch_stage(harvest_object) is True
+
+        content = json.loads(harvest_object.content)
+        assert content[dcat_json.FETCHED_UPDATE_FREQUENCY] == "asNeeded"
+        assert set(content[dcat_json.FETCHED_RESOURCE_SIZES].values()) == {10}
+
+        with (
+            mock.patch.object(harvester, "_fetch_update_frequency") as fetch,
+            mock.patch.object(dcat_json, "get_resource_sizes") as get_sizes,
+        ):
+            pkg_dict, dcat_dict = harvester._get_package_dict(harvest_object)
+            pkg_dict = harvester.modify_package_dict(
+                pkg_dict, dcat_dict, harvest_object
+            )
+
+        fetch.assert_not_called()
+        get_sizes.assert_not_called()
+        assert pkg_dict["update_frequency"] == "asNeeded"
+        assert pkg_dict["resources"][0]["size"] == 10
+
+    def test_update_frequency_is_fetched_once_per_job(self, harvester: DcatHarvester):
+        harvester.test = False
+        url = "https://a.example/metadata.html"
+
+        with mock.patch.object(
+            dcat_json, "fetch_derived_value", return_value="weekly"
+        ) as fetch:
+            harvester._start_job("job-1")
+            assert harvester._fetch_update_frequency(url) == "weekly"
+            assert harvester._fetch_update_frequency(url) == "weekly"
+            assert fetch.call_count == 1
+
+            harvester._start_job("job-2")
+            assert harvester._fetch_update_frequency(url) == "weekly"
+            assert fetch.call_count == 2
+
+    def test_update_frequency_request_error(self, harvester: DcatHarvester):
+        harvester.test = False
+        url = "https://a.example/metadata.html"
+
+        with mock.patch.object(
+            dcat_json,
+            "fetch_derived_value",
+            side_effect=[requests.ConnectionError(), "weekly"],
+        ):
+            assert harvester._fetch_update_frequency(url) == "unknown"
+            assert harvester._fetch_update_frequency(url) == "weekly"
+
+    def test_parse_update_frequency(self, harvester: DcatHarvester):
+        page = harvester._get_mocked_full_metadata()
+
+        assert harvester._parse_update_frequency([page]) == "asNeeded"
+        assert harvester._parse_update_frequency(["<html></html>"]) == "unknown"
+
+    def test_parse_update_frequency_stops_reading(self, harvester: DcatHarvester):
+        page = harvester._get_mocked_full_metadata()
+        chunks = [page[i : i + 1024] for i in range(0, len(page), 1024)]
+        read = []
+
+        def stream():
+            for chunk in chunks:
+                read.append(chunk)
+                yield chunk
+
+        assert harvester._parse_update_frequency(stream()) == "asNeeded"
+        assert len(read) < len(chunks)
+
+    def test_parse_update_frequency_matches_soup(self, harvester: DcatHarvester):
+        """The streamed extractor finds the same script texts as a full
+        html.parser soup of the bundled page."""
+        page = harvester._get_mocked_full_metadata()
+        element_id = "tpx_ExternalView_Frequency_of_Updates"
+        soup = BeautifulSoup(page, "html.parser")
+
+        assert list(h.iter_script_texts([page], element_id)) == [
+            tag.string for tag in soup("script", attrs={"id": element_id})
+        ]
+
+    @pytest.mark.benchmark
+    def test_parse_update_frequency_benchmark(self, harvester: DcatHarvester):
+        """Time the streamed extractor and a full html.parser soup of the
+        bundled page."""
+        page = harvester._get_mocked_full_metadata()
+        element_id = "tpx_ExternalView_Frequency_of_Updates"
+        rounds = 20
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            soup = BeautifulSoup(page, "html.parser")
+            soup("script", attrs={"id": element_id})
+        soup_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            harvester._parse_update_frequency([page])
+        parse_time = time.perf_counter() - start
+
+        print(
+            f"update frequency x{rounds}: soup {soup_time:.3f}s, "
+            f"streamed {parse_time:.3f}s"
+        )
+
     def test_get_existing_dataset_by_guid(
         self, dataset_factory, harvester: DcatHarvester
     ):
@@ -149,3 +315,132 @@ class TestDcatHarvester:
         assert dataset == harvester._get_existing_dataset("test")
 
         assert not harvester._get_existing_dataset("test2")
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_get_existing_datasets(self, dataset_factory, harvester: DcatHarvester):
+        for i in range(3):
+            dataset_factory(
+                extras=[{"key": "guid", "value": f"test-{i}"}],
+                date_modified_data_asset=f"2024-01-0{i + 1}",
+            )
+        deleted = dataset_factory(extras=[{"key": "guid", "value": "deleted"}])
+        call_action("package_delete", id=deleted["id"])
+
+        guids = ["test-0", "test-1", "test-2", "deleted", "missing"]
+        with mock.patch.object(dcat_json, "EXISTING_DATASETS_CHUNK_SIZE", 2):
+            datasets = harvester._get_existing_datasets(guids)
+
+        assert sorted(datasets) == guids[:3]
+
+        for guid, existing_dataset in datasets.items():
+            dataset = harvester._get_existing_dataset(guid)
+            assert existing_dataset == (
+                dataset["id"],
+                dataset["date_modified_data_asset"],
+            )
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_import_stage_skips_unchanged(
+        self,
+        harvester: DcatHarvester,
+        harvest_source_factory,
+        harvest_job_factory,
+        harvest_object_factory,
+        dcat_config: DcatConfig,
+        dcat_dataset: dict[str, Any],
+    ):
+        source = harvest_source_factory(
+            config=json.dumps(dcat_config), source_type=harvester.info()["name"]
+        )
+
+        def make_object(dcat_dataset: dict[str, Any]):
+            return harvest_object_factory(
+                guid=dcat_dataset["identifier"],
+                content=json.dumps(dcat_dataset),
+                job=harvest_job_factory(source=source),
+            )
+
+        assert harvester.import_stage(make_object(dcat_dataset)) is True
+
+        # the skip decision is the one made with package_show before
+        guid = dcat_dataset["identifier"]
+        dataset = harvester._get_existing_dataset(guid)
+        assert harvester._get_existing_datasets([guid])[guid] == (
+            dataset["id"],
+            dataset["date_modified_data_asset"],
+        )
+
+        with mock.patch.object(
+            dcat_json.DCATJSONHarvester, "import_stage", return_value=True
+        ) as import_stage:
+            assert harvester.import_stage(make_object(dcat_dataset)) is False
+            assert not import_stage.called
+
+            modified = dict(dcat_dataset, modified="2000-01-01T00:00:00.000Z")
+            assert harvester.import_stage(make_object(modified)) is True
+            assert import_stage.called
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_duplicate_guids_are_left_out(
+        self,
+        dataset_factory,
+        harvester: DcatHarvester,
+        harvest_source_factory,
+        harvest_job_factory,
+        dcat_config: DcatConfig,
+    ):
+        """The gather and import lookups agree on a guid shared by several
+        datasets: neither of them returns it, so it is never skipped."""
+        source = harvest_source_factory(
+            config=json.dumps(dcat_config), source_type=harvester.info()["name"]
+        )
+        harvest_job = harvest_job_factory(source=source)
+
+        for guid in ("shared", "shared", "single"):
+            dataset = dataset_factory(
+                extras=[{"key": "guid", "value": guid}],
+                date_modified_data_asset="2024-01-01",
+            )
+            model.Session.add(
+                harvest_model.HarvestObject(
+                    guid=guid,
+                    job=harvest_job,
+                    content="{}",
+                    current=True,
+                    package_id=dataset["id"],
+                )
+            )
+        model.Session.commit()
+
+        assert sorted(harvester._get_existing_datasets(["shared", "single"])) == [
+            "single"
+        ]
+        assert sorted(harvester._get_modified_dates(source.id)) == ["single"]
+
+    @pytest.mark.benchmark
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_get_existing_datasets_benchmark(
+        self, dataset_factory, harvester: DcatHarvester
+    ):
+        """Time looking up the fields import_stage compares and showing the
+        dataset"""
+        dataset_factory(
+            extras=[{"key": "guid", "value": "test"}],
+            date_modified_data_asset="2024-01-01",
+        )
+        rounds = 20
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            harvester._get_existing_dataset("test")
+        show_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            harvester._get_existing_datasets(["test"])
+        lookup_time = time.perf_counter() - start
+
+        print(
+            f"existing dataset x{rounds}: package_show {show_time:.3f}s, "
+            f"lookup {lookup_time:.3f}s"
+        )
@@ -3,11 +3,16 @@ from __future__ import annotations
 import json
 import os
 import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any
 from typing_extensions import TypedDict
 from types import GeneratorType
 from datetime import datetime as dt
+from hashlib import sha256
 from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
 import pytest
 
@@ -18,6 +23,20 @@ import ckanext.harvest.model as harvest_model
 
 import ckanext.datavic_harvester.helpers as h
 from ckanext.datavic_harvester.harvesters import DelwpHarvester
+from ckanext.datavic_harvester.archive import read_archive
+from ckanext.datavic_harvester.harvesters.delwp import (
+    FETCHED_RESOURCES,
+    FINGERPRINT_EXTRA,
+    HASH_SECTIONS_FIELD,
+    HASH_PKG_FIELDS,
+    HASH_RESOURCE_FIELDS,
+    PRESERVE_PKG_FIELDS,
+    ExistingPackage,
+    PageFetchError,
+    PartialUpdate,
+    ReplayError,
+    _show_field_value,
+)
 
 
 class DelwpConfig(TypedDict):
@@ -87,6 +106,280 @@ class TestDelwpHarvester:
         assert harvest_object.guid == datasets[0]["fields"]["uuid"]
         assert json.loads(harvest_object.content) == datasets[0]["fields"]
 
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_gather_stage_inserts_objects_in_batches(
+        self,
+        harvester: DelwpHarvester,
+        harvest_job_factory,
+        harvest_source_factory,
+        dataset_factory,
+        delwp_config: DelwpConfig,
+    ):
+        cfg = dict(delwp_config, gather_batch_size=2, deletion_safeguard_enabled=False)
+        source = harvest_source_factory(
+            config=json.dumps(cfg), source_type=harvester.info()["name"]
+        )
+        harvest_job = harvest_job_factory(source=source)
+
+        existing = {f"guid-{i}": dataset_factory()["id"] for i in range(4)}
+        records = [
+            {"fields": {"uuid": f"guid-{i}", "title": "t"}} for i in range(1, 6)
+        ]
+
+        with (
+            mock.patch.object(
+                harvester, "_get_guids_to_package_ids", return_value=existing
+            ),
+            mock.patch.object(
+                harvester, "_get_current_harvest_guids", return_value={"guid-0"}
+            ),
+            mock.patch.object(
+                harvester, "_fetch_records_from_remote_portal", return_value=records
+            ),
+            mock.patch.object(harvester, "_open_harvest_json_writer"),
+            mock.patch.object(
+                harvester,
+                "_insert_harvest_objects",
+                wraps=harvester._insert_harvest_objects,
+            ) as mock_insert,
+        ):
+            obj_ids = harvester.gather_stage(harvest_job)
+
+        # 5 records in batches of 2, then 1 deletion
+        assert mock_insert.call_count == 4
+
+        objects = [harvest_model.HarvestObject.get(obj_id) for obj_id in obj_ids]
+        assert [obj.guid for obj in objects] == [f"guid-{i}" for i in range(1, 6)] + [
+            "guid-0"
+        ]
+        assert [harvester._get_object_extra(obj, "status") for obj in objects] == [
+            "change",
+            "change",
+            "change",
+            "new",
+            "new",
+            "delete",
+        ]
+        assert {obj.harvest_source_id for obj in objects} == {source.id}
+        assert objects[0].package_id == existing["guid-1"]
+        assert objects[-1].package_id == existing["guid-0"]
+        assert objects[-1].content is None
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_gather_stage_skips_unchanged_records(
+        self,
+        harvester: DelwpHarvester,
+        harvest_job_factory,
+        harvest_source_factory,
+        dataset_factory,
+        delwp_config: DelwpConfig,
+    ):
+        """A record whose fingerprint matches the current object of an active
+        dataset is not queued again, but still counts as present in the
+        source so it is not deleted."""
+        cfg = dict(delwp_config, skip_unchanged=True)
+        source = harvest_source_factory(
+            config=json.dumps(cfg), source_type=harvester.info()["name"]
+        )
+        existing = {"guid-a": dataset_factory()["id"], "guid-b": dataset_factory()["id"]}
+        records = [
+            {"fields": {"uuid": "guid-a", "title": "a"}},
+            {"fields": {"uuid": "guid-b", "title": "b"}},
+        ]
+
+        def gather(records, **config):
+            source.config = json.dumps(dict(cfg, **config))
+            with (
+                mock.patch.object(
+                    harvester, "_get_guids_to_package_ids", return_value=existing
+                ),
+                mock.patch.object(
+                    harvester,
+                    "_get_current_harvest_guids",
+                    return_value=set(existing),
+                ),
+                mock.patch.object(
+                    harvester,
+                    "_fetch_records_from_remote_portal",
+                    return_value=records,
+                ),
+                mock.patch.object(harvester, "_open_harvest_json_writer"),
+            ):
+                return harvester.gather_stage(harvest_job_factory(source=source))
+
+        obj_ids = gather(records)
+        assert len(obj_ids) == 2
+
+        # what import_stage does for the imported objects
+        model.Session.query(harvest_model.HarvestObject).filter(
+            harvest_model.HarvestObject.id.in_(obj_ids)
+        ).update({"current": True}, False)
+        model.Session.commit()
+
+        assert gather(records) == []
+
+        changed = [records[0], {"fields": {"uuid": "guid-b", "title": "new"}}]
+        obj_ids = gather(changed)
+        assert [harvest_model.HarvestObject.get(i).guid for i in obj_ids] == [
+            "guid-b"
+        ]
+
+        obj_ids = gather(records, force_all=True)
+        assert len(obj_ids) == 2
+
+        # a force_all job stores the fingerprints for the next job
+        model.Session.query(harvest_model.HarvestObject).filter(
+            harvest_model.HarvestObject.id.in_(obj_ids)
+        ).update({"current": True}, False)
+        model.Session.commit()
+        assert gather(records) == []
+
+        with mock.patch.object(
+            harvester, "_calculate_source_fingerprint"
+        ) as calculate_fingerprint:
+            obj_ids = gather(records, skip_unchanged=False)
+
+        calculate_fingerprint.assert_not_called()
+        assert len(obj_ids) == 2
+        assert not (
+            model.Session.query(harvest_model.HarvestObjectExtra)
+            .filter(harvest_model.HarvestObjectExtra.harvest_object_id.in_(obj_ids))
+            .filter(harvest_model.HarvestObjectExtra.key == FINGERPRINT_EXTRA)
+            .count()
+        )
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_gather_stage_page_failure_discards_objects(
+        self,
+        harvester: DelwpHarvester,
+        harvest_job_factory,
+        harvest_source_factory,
+        delwp_config: DelwpConfig,
+    ):
+        """Records are turned into harvest objects while the pages are still
+        being fetched. When a later page fails, the objects already created
+        must not survive, otherwise the partial list would be imported."""
+        source = harvest_source_factory(
+            config=json.dumps(delwp_config), source_type=harvester.info()["name"]
+        )
+        harvest_job = harvest_job_factory(source=source)
+
+        def records():
+            yield {"fields": {"uuid": "guid-a", "title": "t"}}
+            raise PageFetchError("could not fetch page 2")
+
+        with (
+            mock.patch.object(
+                harvester, "_fetch_records_from_remote_portal", return_value=records()
+            ),
+            mock.patch.object(harvester, "_open_harvest_json_writer"),
+        ):
+            assert harvester.gather_stage(harvest_job) is None
+
+        assert len(harvest_job.gather_errors) == 1
+        assert "page 2" in harvest_job.gather_errors[0].message
+        assert not harvest_model.HarvestObject.filter(guid="guid-a").count()
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_gather_stage_replays_archived_records(
+        self,
+        harvester: DelwpHarvester,
+        harvest_job_factory,
+        harvest_source_factory,
+        delwp_config: DelwpConfig,
+    ):
+        """A replay re-imports the selected records of an archive without
+        calling the portal and without deleting the datasets it skips."""
+        source_config = harvester.validate_config(
+            json.dumps(
+                {
+                    **delwp_config,
+                    "replay_archive": "job-123",
+                    "replay_guids": ["guid-b"],
+                }
+            )
+        )
+        source = harvest_source_factory(
+            config=source_config,
+            source_type=harvester.info()["name"],
+        )
+        harvest_job = harvest_job_factory(source=source)
+
+        with (
+            mock.patch.object(
+                harvester,
+                "_read_harvest_archive",
+                return_value=iter([{"fields": {"uuid": "guid-b", "title": "t"}}]),
+            ) as read_archive,
+            mock.patch.object(
+                harvester, "_fetch_records_from_remote_portal"
+            ) as fetch_records,
+            mock.patch.object(harvester, "_open_harvest_json_writer") as writer,
+        ):
+            object_ids = harvester.gather_stage(harvest_job)
+
+        read_archive.assert_called_once_with("job-123", ["guid-b"])
+        fetch_records.assert_not_called()
+        writer.assert_not_called()
+
+        assert len(object_ids) == 1
+        harvest_object = harvest_model.HarvestObject.get(object_ids[0])
+        assert harvest_object.guid == "guid-b"
+        assert json.loads(harvest_object.content)["uuid"] == "guid-b"
+
+        # the replay runs once, the next job harvests the portal. The config
+        # is stored as when the source is saved, so the fingerprints of the
+        # next job still match.
+        config = harvest_model.HarvestSource.get(source.id).config
+        assert config == harvester.validate_config(json.dumps(delwp_config))
+        assert harvester._get_fingerprint_config(config) == (
+            harvester._get_fingerprint_config(source_config)
+        )
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_failed_replay_is_not_repeated(
+        self,
+        harvester: DelwpHarvester,
+        harvest_job_factory,
+        harvest_source_factory,
+        delwp_config: DelwpConfig,
+    ):
+        source = harvest_source_factory(
+            config=json.dumps({**delwp_config, "replay_archive": "missing"}),
+            source_type=harvester.info()["name"],
+        )
+        harvest_job = harvest_job_factory(source=source)
+
+        assert harvester.gather_stage(harvest_job) is None
+
+        assert "missing not found" in harvest_job.gather_errors[0].message
+        assert "replay_archive" not in json.loads(
+            harvest_model.HarvestSource.get(source.id).config
+        )
+
+    def test_replay_ends_when_config_does_not_validate(
+        self, harvester: DelwpHarvester
+    ):
+        harvest_job = mock.MagicMock()
+        harvest_job.source.config = json.dumps(
+            {"default_groups": ["deleted"], "replay_archive": "job-123"}
+        )
+
+        with (
+            mock.patch.object(
+                harvester, "validate_config", side_effect=ValueError("not found")
+            ),
+            mock.patch(
+                "ckanext.datavic_harvester.harvesters.delwp.model.Session"
+            ) as session,
+        ):
+            harvester._end_replay(harvest_job)
+
+        session.commit.assert_called_once()
+        assert harvest_job.source.config == json.dumps(
+            {"default_groups": ["deleted"]}, indent=4
+        )
+
     @pytest.mark.usefixtures("with_plugins", "clean_db")
     def test_import_stage(
         self,
@@ -122,12 +415,177 @@ class TestDelwpHarvester:
         # no new harvest_object, cause it's update
         assert harvest_model.HarvestObject.filter(guid=delwp_dataset["uuid"]).one()
 
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_fetch_stage_prefetches_resources_of_next_objects(
+        self,
+        harvester: DelwpHarvester,
+        harvest_source_factory,
+        harvest_job_factory,
+        harvest_object_factory,
+        delwp_config: DelwpConfig,
+        delwp_dataset: dict[str, Any],
+    ):
+        source = harvest_source_factory(
+            config=json.dumps({**delwp_config, "fetch_prefetch_workers": 2}),
+            source_type=harvester.info()["name"],
+        )
+        harvest_job = harvest_job_factory(source=source)
+        harvest_objects = [
+            harvest_object_factory(
+                guid=f"{delwp_dataset['uuid']}-{i}",
+                content=json.dumps(
+                    {**delwp_dataset, "title": f"{delwp_dataset['title']} {i}"}
+                ),
+                job=harvest_job,
+            )
+            for i in range(3)
+        ]
+
+        with mock.patch.object(
+            harvester, "_fetch_resources", wraps=harvester._fetch_resources
+        ) as fetch_resources:
+            for harvest_object in harvest_objects:
+                # the harvest queue moves an object out of WAITING before
+                # fetching it
+                harvest_object.state = "FETCH"
+                harvest_object.save()
+
+                assert harvester.fetch_stage(harvest_object) is True
+                assert harvester.import_stage(harvest_object) is True
+                assert harvest_object.errors == []
+
+        # the first object is fetched inline, the next two ahead of time
+        assert fetch_resources.call_count == 3
+        assert harvester._prefetched_resources == {}
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_fetch_stage_stores_resources_for_import(
+        self,
+        harvester: DelwpHarvester,
+        harvest_source_factory,
+        harvest_job_factory,
+        harvest_object_factory,
+        delwp_config: DelwpConfig,
+        delwp_dataset: dict[str, Any],
+    ):
+        source = harvest_source_factory(
+            config=json.dumps(delwp_config), source_type=harvester.info()["name"]
+        )
+        harvest_object = harvest_object_factory(
+            guid=delwp_dataset["uuid"],
+            content=json.dumps(delwp_dataset),
+            job=harvest_job_factory(source=source),
+        )
+        resources = [{"name": "fetched", "format": "CSV", "url": "https://a.example/1"}]
+
+        with mock.patch.object(
+            harvester, "_fetch_resources", return_value=resources
+        ) as fetch_resources:
+            assert harvester.fetch_stage(harvest_object) is True
+            assert json.loads(harvest_object.content)[FETCHED_RESOURCES] == resources
+
+            assert harvester.import_stage(harvest_object) is True
+
+        fetch_resources.assert_called_once()
+        package = model.Package.get(harvest_object.package_id)
+        assert [r.url for r in package.resources] == ["https://a.example/1"]
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_fetch_stage_error_is_recorded(
+        self,
+        harvester: DelwpHarvester,
+        harvest_source_factory,
+        harvest_job_factory,
+        harvest_object_factory,
+        delwp_config: DelwpConfig,
+        delwp_dataset: dict[str, Any],
+    ):
+        source = harvest_source_factory(
+            config=json.dumps(delwp_config), source_type=harvester.info()["name"]
+        )
+        harvest_object = harvest_object_factory(
+            guid=delwp_dataset["uuid"],
+            content=json.dumps(delwp_dataset),
+            job=harvest_job_factory(source=source),
+        )
+
+        with mock.patch.object(
+            harvester, "_fetch_resources", side_effect=ValueError("boom")
+        ):
+            assert harvester.fetch_stage(harvest_object) is False
+
+        assert len(harvest_object.errors) == 1
+        assert harvest_object.errors[0].stage == "Fetch"
+        assert "boom" in harvest_object.errors[0].message
+
+    def test_prefetched_resources_are_used(self, harvester: DelwpHarvester):
+        future = Future()
+        future.set_result([{"url": "prefetched"}])
+        harvester._prefetched_resources["object-1"] = future
+
+        with mock.patch.object(harvester, "_fetch_resources") as fetch_resources:
+            resources = harvester._get_resources(mock.Mock(id="object-1"), {})
+
+            assert resources == [{"url": "prefetched"}]
+            fetch_resources.assert_not_called()
+
+            harvester._get_resources(mock.Mock(id="object-2"), {})
+            fetch_resources.assert_called_once()
+
+    def test_prefetch_settings_are_a_snapshot(self, harvester: DelwpHarvester):
+        settings = harvester._get_resource_settings(snapshot=True)
+        harvester.config["resource_url_prefix"] = "https://other.example/"
+
+        with pytest.raises(TypeError):
+            settings.config["resource_url_prefix"] = "https://other.example/"
+
+        with mock.patch(
+            "ckanext.datavic_harvester.harvesters.delwp.get_resource_sizes",
+            side_effect=lambda urls, session_settings=None: [0] * len(urls),
+        ):
+            resources = harvester._fetch_resources(
+                {"_uuid": "uuid-1", "title": "Title", "available_formats": "CSV"},
+                settings,
+            )
+
+        assert [r["url"] for r in resources] == [""]
+
+    def test_prefetch_uses_the_session_settings_of_the_snapshot(
+        self, harvester: DelwpHarvester
+    ):
+        harvester.config["http_timeout"] = 5
+        settings = harvester._get_resource_settings(snapshot=True)
+        harvester.config["http_timeout"] = 60
+
+        with mock.patch.object(
+            harvester, "_make_request", return_value=None
+        ) as make_request:
+            harvester._fetch_geoserver_capabilities_index(
+                "url", settings._replace(test=False)
+            )
+
+        assert make_request.call_args.kwargs["session"].settings.timeout == 5
+
+    def test_prefetch_error_is_raised_for_its_object(
+        self, harvester: DelwpHarvester
+    ):
+        future = Future()
+        future.set_exception(ValueError("size probe failed"))
+        harvester._prefetched_resources["object-1"] = future
+
+        with pytest.raises(ValueError, match="size probe failed"):
+            harvester._get_resources(mock.Mock(id="object-1"), {})
+
     def test_mock_geores_data(self, harvester: DelwpHarvester):
         """The geoserver_url doesn't matter, because we're mocking response.
         The `content` with uuid below exists in test data"""
-        assert harvester._get_geoserver_content_with_uuid(
+        layer = harvester._get_geoserver_content_with_uuid(
             "geoserver_url", "8ad36246-9a39-53aa-bcbc-8b33aec63cde"
         )
+        assert layer
+        layer_name, layer_title = layer
+        assert layer_name
+        assert layer_title
 
         assert not harvester._get_geoserver_content_with_uuid("geoserver_url", "uuid")
 
@@ -304,9 +762,9 @@ class TestDelwpHarvester:
             mock.patch.object(
                 harvester, "_fetch_records_from_remote_portal", return_value=records
             ),
-            mock.patch.object(harvester, "_save_harvest_json_to_filestore"),
+            mock.patch.object(harvester, "_open_harvest_json_writer"),
             mock.patch(
-                "ckanext.datavic_harvester.harvesters.delwp.requests.get"
+                "ckanext.datavic_harvester.http_session.HarvesterSession.get"
             ) as mock_get,
         ):
             obj_ids = harvester.gather_stage(harvest_job)
@@ -366,9 +824,9 @@ class TestDelwpHarvester:
             mock.patch.object(
                 harvester, "_fetch_records_from_remote_portal", return_value=records
             ),
-            mock.patch.object(harvester, "_save_harvest_json_to_filestore"),
+            mock.patch.object(harvester, "_open_harvest_json_writer"),
             mock.patch(
-                "ckanext.datavic_harvester.harvesters.delwp.requests.get"
+                "ckanext.datavic_harvester.http_session.HarvesterSession.get"
             ) as mock_get,
         ):
             obj_ids = harvester.gather_stage(harvest_job)
@@ -426,7 +884,7 @@ class TestDelwpHarvester:
             mock.patch.object(
                 harvester, "_fetch_records_from_remote_portal", return_value=records
             ),
-            mock.patch.object(harvester, "_save_harvest_json_to_filestore"),
+            mock.patch.object(harvester, "_open_harvest_json_writer"),
         ):
             obj_ids = harvester.gather_stage(harvest_job)
 
@@ -482,7 +940,7 @@ class TestDelwpHarvester:
             mock.patch.object(
                 harvester, "_fetch_records_from_remote_portal", return_value=records
             ),
-            mock.patch.object(harvester, "_save_harvest_json_to_filestore"),
+            mock.patch.object(harvester, "_open_harvest_json_writer"),
         ):
             obj_ids = harvester.gather_stage(harvest_job)
 
@@ -541,9 +999,9 @@ class TestDelwpHarvester:
             mock.patch.object(
                 harvester, "_fetch_records_from_remote_portal", return_value=records
             ),
-            mock.patch.object(harvester, "_save_harvest_json_to_filestore"),
+            mock.patch.object(harvester, "_open_harvest_json_writer"),
             mock.patch(
-                "ckanext.datavic_harvester.harvesters.delwp.requests.get"
+                "ckanext.datavic_harvester.http_session.HarvesterSession.get"
             ) as mock_get,
         ):
             obj_ids = harvester.gather_stage(harvest_job)
@@ -616,7 +1074,7 @@ class TestDelwpHarvester:
             mock.patch.object(
                 harvester, "_fetch_records_from_remote_portal", return_value=records
             ),
-            mock.patch.object(harvester, "_save_harvest_json_to_filestore"),
+            mock.patch.object(harvester, "_open_harvest_json_writer"),
         ):
             obj_ids = harvester.gather_stage(harvest_job)
 
@@ -769,57 +1227,581 @@ class TestDetectDeletionAnomaly:
         detected, msg = h._detect_deletion_anomaly(
             previous_count=100, source_count=150
         )
-        assert detected is False
-        assert msg is None
+        assert detected is False
+        assert msg is None
+
+
+class TestSendDeletionSafeguardNotify:
+    """Unit tests for _send_deletion_safeguard_notify — no DB or plugins required."""
+
+    def _make_harvester(self, ok_url=None, anomaly_url=None) -> DelwpHarvester:
+        h = DelwpHarvester()
+        h.deletion_safeguard_notify_ok_url = ok_url
+        h.deletion_safeguard_notify_anomaly_url = anomaly_url
+        return h
+
+    def test_no_urls_configured_makes_no_request(self):
+        h = self._make_harvester()
+        with mock.patch(
+            "ckanext.datavic_harvester.http_session.HarvesterSession.get"
+        ) as mock_get:
+            h._send_deletion_safeguard_notify(anomaly=False)
+            h._send_deletion_safeguard_notify(anomaly=True)
+        mock_get.assert_not_called()
+
+    def test_ok_url_called_when_no_anomaly(self):
+        h = self._make_harvester(ok_url="https://notify.example/ok")
+        with mock.patch(
+            "ckanext.datavic_harvester.http_session.HarvesterSession.get"
+        ) as mock_get:
+            h._send_deletion_safeguard_notify(anomaly=False)
+        mock_get.assert_called_once_with("https://notify.example/ok", timeout=10)
+
+    def test_anomaly_url_called_when_anomaly(self):
+        h = self._make_harvester(anomaly_url="https://notify.example/anomaly")
+        with mock.patch(
+            "ckanext.datavic_harvester.http_session.HarvesterSession.get"
+        ) as mock_get:
+            h._send_deletion_safeguard_notify(anomaly=True)
+        mock_get.assert_called_once_with(
+            "https://notify.example/anomaly", timeout=10
+        )
+
+    def test_request_failure_does_not_raise(self):
+        """Notify is fail-open: a network error should be logged but not
+        propagate as an exception."""
+        import requests as req_lib
+
+        h = self._make_harvester(ok_url="https://notify.example/ok")
+        with mock.patch(
+            "ckanext.datavic_harvester.http_session.HarvesterSession.get",
+            side_effect=req_lib.RequestException("timeout"),
+        ):
+            h._send_deletion_safeguard_notify(anomaly=False)  # must not raise
+
+
+class TestGeoserverCapabilitiesIndex:
+    """The GetCapabilities documents are indexed once per job instead of being
+    downloaded and parsed again for every dataset."""
+
+    CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+        <WMS_Capabilities xmlns="http://www.opengis.net/wms">
+          <Service><Name>WMS</Name><Title/></Service>
+          <Capability>
+            <Layer>
+              <Name>open-data-platform:first</Name>
+              <Title>First layer</Title>
+              <KeywordList>
+                <Keyword>features</Keyword>
+                <Keyword>MetadataID=uuid-1</Keyword>
+              </KeywordList>
+            </Layer>
+            <Layer>
+              <Name>open-data-platform:second</Name>
+              <Title>Second layer</Title>
+              <KeywordList><Keyword>MetadataID=uuid-2</Keyword></KeywordList>
+            </Layer>
+            <Layer>
+              <Name>open-data-platform:duplicate</Name>
+              <Title>Duplicate</Title>
+              <KeywordList><Keyword>MetadataID=uuid-1</Keyword></KeywordList>
+            </Layer>
+          </Capability>
+        </WMS_Capabilities>"""
+
+    def test_index_maps_keyword_to_layer_name_and_title(self):
+        index = DelwpHarvester()._build_geoserver_capabilities_index(
+            self.CAPABILITIES
+        )
+
+        assert index == {
+            "MetadataID=uuid-1": ("open-data-platform:first", "First layer"),
+            "MetadataID=uuid-2": ("open-data-platform:second", "Second layer"),
+        }
+
+    def test_malformed_document_keeps_layers_indexed_so_far(self):
+        truncated = self.CAPABILITIES[: self.CAPABILITIES.index("<Layer>", 300)]
+
+        index = DelwpHarvester()._build_geoserver_capabilities_index(truncated)
+
+        assert index == {
+            "MetadataID=uuid-1": ("open-data-platform:first", "First layer")
+        }
+
+    def test_capabilities_fetched_once_per_job(self):
+        harvester = DelwpHarvester()
+        harvester._start_job("job-1")
+
+        with mock.patch.object(
+            harvester, "_make_request", return_value=self.CAPABILITIES
+        ) as mock_request:
+            assert harvester._get_geoserver_content_with_uuid("url", "uuid-1")
+            assert harvester._get_geoserver_content_with_uuid("url", "uuid-2")
+            assert not harvester._get_geoserver_content_with_uuid("url", "uuid-3")
+            assert mock_request.call_count == 1
+
+            harvester._start_job("job-2")
+            assert harvester._get_geoserver_content_with_uuid("url", "uuid-1")
+            assert mock_request.call_count == 2
+
+    def test_capabilities_fetched_once_by_concurrent_threads(self):
+        harvester = DelwpHarvester()
+        release = threading.Event()
+
+        def make_request(url, session=None):
+            release.wait(5)
+            return self.CAPABILITIES
+
+        with mock.patch.object(
+            harvester, "_make_request", side_effect=make_request
+        ) as mock_request:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [
+                    executor.submit(
+                        harvester._get_geoserver_content_with_uuid, "url", "uuid-1"
+                    )
+                    for _ in range(4)
+                ]
+                time.sleep(0.1)
+                release.set()
+
+                assert all(future.result() for future in futures)
+
+        assert mock_request.call_count == 1
+
+    def test_failed_fetch_is_not_cached(self):
+        harvester = DelwpHarvester()
+
+        with mock.patch.object(
+            harvester, "_make_request", side_effect=[None, self.CAPABILITIES]
+        ):
+            assert not harvester._get_geoserver_content_with_uuid("url", "uuid-1")
+            assert harvester._get_geoserver_content_with_uuid("url", "uuid-1")
+
+
+class TestOrganisationResolution:
+    """Organisations are resolved once per resowner and job instead of once
+    per imported record."""
+
+    MAPPING = [
+        {"resowner": "Owner A", "org-name": "org-a"},
+        {"resowner": "Owner B", "org-name": "org-b"},
+        {"resowner": "Owner A", "org-name": "org-a-duplicate"},
+    ]
+
+    def test_mapping_index_keeps_first_item(self):
+        harvester = DelwpHarvester()
+
+        assert harvester._get_organisation_index(self.MAPPING) == {
+            "Owner A": "org-a",
+            "Owner B": "org-b",
+        }
+
+    def test_resolution_is_memoized_per_job(self):
+        harvester = DelwpHarvester()
+        harvester._start_job("job-1")
+        harvest_object = mock.Mock(id="object-1")
+
+        with (
+            mock.patch.object(
+                harvester, "_get_existing_organization", return_value=None
+            ) as get_existing,
+            mock.patch.object(
+                harvester, "_create_organization", return_value="new-org-id"
+            ) as create,
+        ):
+            for _ in range(3):
+                assert (
+                    harvester._get_organisation(
+                        self.MAPPING, "Owner C", harvest_object
+                    )
+                    == "new-org-id"
+                )
+
+            assert get_existing.call_count == 1
+            assert create.call_count == 1
+
+            harvester._start_job("job-2")
+            harvester._get_organisation(self.MAPPING, "Owner C", harvest_object)
+            assert create.call_count == 2
+
+    def test_organisations_are_loaded_once(self):
+        harvester = DelwpHarvester()
+        harvester.pkg_dict = {"title": "test"}
+        query = mock.Mock()
+        query.return_value.filter_by.return_value = [("owner-c", "org-c-id")]
+
+        with (
+            mock.patch.object(model.Session, "query", query),
+            mock.patch.object(harvester, "_get_organization", return_value=None),
+        ):
+            assert (
+                harvester._get_existing_organization(self.MAPPING, "Owner C")
+                == "org-c-id"
+            )
+            assert not harvester._get_existing_organization(self.MAPPING, "Owner D")
+            assert (
+                harvester._get_existing_organization(self.MAPPING, "Owner C")
+                == "org-c-id"
+            )
+
+        assert query.call_count == 1
+
+    def test_missing_organisation_is_created_once_under_concurrency(self):
+        harvester = DelwpHarvester()
+        harvest_object = mock.Mock(id="object-1")
+
+        def create(resowner, harvest_object):
+            time.sleep(0.05)
+            return "new-org-id"
+
+        with (
+            mock.patch.object(
+                harvester, "_get_existing_organization", return_value=None
+            ),
+            mock.patch.object(
+                harvester, "_create_organization", side_effect=create
+            ) as create_organization,
+            ThreadPoolExecutor(max_workers=4) as executor,
+        ):
+            results = list(
+                executor.map(
+                    lambda _: harvester._get_organisation(
+                        self.MAPPING, "Owner C", harvest_object
+                    ),
+                    range(8),
+                )
+            )
+
+        assert results == ["new-org-id"] * 8
+        assert create_organization.call_count == 1
+
+
+class TestSourceConfig:
+    """The source config is parsed once per job instead of once per object."""
+
+    def _item(self, job_id: str, config: dict[str, Any]) -> mock.Mock:
+        item = mock.Mock(harvest_job_id=job_id)
+        item.source.id = "source-1"
+        item.source.config = json.dumps(config)
+        return item
+
+    def test_config_is_built_once_per_job(self):
+        harvester = DelwpHarvester()
+        config = {"geoserver_dns": "https://geo.example", "page_retries": 0}
+
+        with mock.patch.object(
+            harvester, "_get_source_owner_org_id", return_value="org-1"
+        ) as get_owner_org:
+            for _ in range(3):
+                harvester._set_config(self._item("job-1", config))
+
+            assert get_owner_org.call_count == 1
+            assert harvester.source_org_id == "org-1"
+            assert harvester.page_retries == 0
+            assert harvester.geoserver_urls["WMS"]["geoserver_url"].startswith(
+                "https://geo.example/geoserver/ows"
+            )
+
+            harvester._set_config(self._item("job-1", {**config, "page_retries": 1}))
+            assert get_owner_org.call_count == 2
+            assert harvester.page_retries == 1
+
+            harvester._set_config(self._item("job-2", config))
+            assert get_owner_org.call_count == 3
+
+
+class TestSourceFingerprint:
+    @pytest.fixture
+    def harvester(self):
+        harvester = DelwpHarvester()
+        harvester.config = {}
+        return harvester
+
+    def test_fingerprint_is_stable(self, harvester: DelwpHarvester):
+        fields = {"uuid": "guid-a", "title": "a", "topiccat": ["x", "y"]}
+
+        assert harvester._calculate_source_fingerprint(
+            fields, {}
+        ) == harvester._calculate_source_fingerprint(dict(reversed(fields.items())), {})
+
+    def test_fingerprint_follows_fields_and_config(self, harvester: DelwpHarvester):
+        fingerprint = harvester._calculate_source_fingerprint({"uuid": "a"}, {})
+
+        assert fingerprint != harvester._calculate_source_fingerprint(
+            {"uuid": "a", "title": "t"}, {}
+        )
+        assert fingerprint != harvester._calculate_source_fingerprint(
+            {"uuid": "a"}, {"license_id": "cc-by"}
+        )
+
+    def test_fingerprint_config_ignores_operational_options(
+        self, harvester: DelwpHarvester
+    ):
+        config = {"license_id": "cc-by", "resource_attribution": "x"}
+        fingerprint_config = harvester._get_fingerprint_config(json.dumps(config))
+
+        assert fingerprint_config == config
+        assert harvester._get_fingerprint_config(
+            json.dumps(
+                {
+                    **dict(reversed(config.items())),
+                    "replay_archive": "job-1",
+                    "replay_guids": ["guid-a"],
+                    "force_all": True,
+                    "parallel_page_workers": 4,
+                    "deferred_indexing": True,
+                },
+                indent=4,
+            )
+        ) == fingerprint_config
+        assert harvester._get_fingerprint_config(None) == {}
+
+    def test_fingerprint_follows_geoserver_layers(self, harvester: DelwpHarvester):
+        harvester.config = {"geoserver_dns": "https://geo.example"}
+        harvester.geoserver_urls = {
+            "WMS": {"geoserver_url": "wms"},
+            "WFS": {"geoserver_url": "wfs"},
+        }
+
+        with mock.patch.object(
+            harvester, "_get_geoserver_content_with_uuid", return_value=None
+        ):
+            without_layer = harvester._calculate_source_fingerprint({"uuid": "a"}, {})
+
+        with mock.patch.object(
+            harvester,
+            "_get_geoserver_content_with_uuid",
+            return_value=("layer", "Layer"),
+        ):
+            with_layer = harvester._calculate_source_fingerprint({"uuid": "a"}, {})
+
+        assert without_layer != with_layer
+
+
+class TestParallelPagination:
+    """With parallel_page_workers set, the pages announced by the `nhits` of
+    the first page are fetched concurrently and reassembled in order."""
+
+    NHITS = 1316
+
+    @pytest.fixture
+    def harvester(self):
+        harvester = DelwpHarvester()
+        mock_item = mock.MagicMock()
+        mock_item.source.config = json.dumps(
+            {
+                "dataset_type": "datashare-metadata",
+                "api_auth": "token",
+                "parallel_page_workers": 3,
+                "page_retries": 1,
+            }
+        )
+        with mock.patch.object(
+            harvester, "_get_source_owner_org_id", return_value=None
+        ):
+            harvester._set_config(mock_item)
+
+        return harvester
+
+    def _portal(
+        self,
+        nhits: int,
+        failures: dict[int, int] | None = None,
+        responses: dict[int, list[str | None]] | None = None,
+    ):
+        """Fake portal API. failures maps a start offset to the number of
+        failed responses before it succeeds, responses to the responses
+        returned before the right one."""
+        failures = dict(failures or {})
+        responses = {start: list(items) for start, items in (responses or {}).items()}
+
+        def make_request(url, headers=None):
+            query = parse_qs(urlparse(url).query)
+            start, rows = int(query["start"][0]), int(query["rows"][0])
+
+            if failures.get(start):
+                failures[start] -= 1
+                return None
+
+            if responses.get(start):
+                return responses[start].pop(0)
+
+            return json.dumps(
+                {
+                    "nhits": nhits,
+                    "records": [
+                        {"fields": {"uuid": f"uuid-{i}"}}
+                        for i in range(start, min(start + rows, nhits))
+                    ],
+                }
+            )
+
+        return make_request
+
+    def test_records_are_reassembled_in_order(self, harvester: DelwpHarvester):
+        with mock.patch.object(
+            harvester, "_make_request", side_effect=self._portal(self.NHITS)
+        ) as mock_request:
+            records = list(harvester._fetch_records_from_remote_portal("url"))
+
+        assert [r["fields"]["uuid"] for r in records] == [
+            f"uuid-{i}" for i in range(self.NHITS)
+        ]
+        # 3 pages announced by nhits and the probe for records added meanwhile
+        assert mock_request.call_count == 4
+
+    def test_failed_page_is_retried(self, harvester: DelwpHarvester):
+        with (
+            mock.patch.object(
+                harvester,
+                "_make_request",
+                side_effect=self._portal(self.NHITS, failures={500: 1}),
+            ),
+            mock.patch("ckanext.datavic_harvester.harvesters.delwp.time.sleep"),
+        ):
+            records = list(harvester._fetch_records_from_remote_portal("url"))
+
+        assert len(records) == self.NHITS
+
+    def test_page_failing_after_retries_raises(self, harvester: DelwpHarvester):
+        with (
+            mock.patch.object(
+                harvester,
+                "_make_request",
+                side_effect=self._portal(self.NHITS, failures={1000: 2}),
+            ),
+            mock.patch("ckanext.datavic_harvester.harvesters.delwp.time.sleep"),
+            pytest.raises(PageFetchError, match="page 3"),
+        ):
+            list(harvester._fetch_records_from_remote_portal("url"))
+
+    @pytest.mark.parametrize(
+        "response",
+        [
+            # fewer records than announced by nhits
+            json.dumps({"nhits": NHITS, "records": [{"fields": {"uuid": "x"}}]}),
+            json.dumps({"nhits": NHITS}),
+            "not json",
+        ],
+    )
+    def test_invalid_page_is_retried(self, harvester: DelwpHarvester, response):
+        with (
+            mock.patch.object(
+                harvester,
+                "_make_request",
+                side_effect=self._portal(self.NHITS, responses={500: [response]}),
+            ),
+            mock.patch("ckanext.datavic_harvester.harvesters.delwp.time.sleep"),
+        ):
+            records = list(harvester._fetch_records_from_remote_portal("url"))
+
+        assert [r["fields"]["uuid"] for r in records] == [
+            f"uuid-{i}" for i in range(self.NHITS)
+        ]
+
+    def test_short_page_after_retries_raises(self, harvester: DelwpHarvester):
+        short_page = json.dumps({"nhits": self.NHITS, "records": []})
+
+        with (
+            mock.patch.object(
+                harvester,
+                "_make_request",
+                side_effect=self._portal(
+                    self.NHITS, responses={500: [short_page, short_page]}
+                ),
+            ),
+            mock.patch("ckanext.datavic_harvester.harvesters.delwp.time.sleep"),
+            pytest.raises(PageFetchError, match="page 2"),
+        ):
+            list(harvester._fetch_records_from_remote_portal("url"))
+
+    @pytest.mark.parametrize("response", [None, "", "not json", "[]"])
+    def test_failed_probe_past_nhits_ends_records(
+        self, harvester: DelwpHarvester, response
+    ):
+        with mock.patch.object(
+            harvester,
+            "_make_request",
+            side_effect=self._portal(self.NHITS, responses={1500: [response]}),
+        ) as mock_request:
+            records = list(harvester._fetch_records_from_remote_portal("url"))
+
+        assert len(records) == self.NHITS
+        assert mock_request.call_count == 4
+
+    def test_records_added_while_fetching_are_kept(
+        self, harvester: DelwpHarvester
+    ):
+        # the portal grows to 1600 records after the first page announced 1316
+        first_page = json.dumps(
+            {
+                "nhits": self.NHITS,
+                "records": [{"fields": {"uuid": f"uuid-{i}"}} for i in range(500)],
+            }
+        )
+
+        with mock.patch.object(
+            harvester,
+            "_make_request",
+            side_effect=self._portal(1600, responses={0: [first_page]}),
+        ):
+            records = list(harvester._fetch_records_from_remote_portal("url"))
+
+        assert [r["fields"]["uuid"] for r in records] == [
+            f"uuid-{i}" for i in range(1600)
+        ]
+
+    def test_validate_gather_config(self, harvester: DelwpHarvester):
+        harvester._validate_optional_gather_config(
+            {"parallel_page_workers": "4", "page_retries": 0}
+        )
 
+        with pytest.raises(ValueError, match="parallel_page_workers must be >= 0"):
+            harvester._validate_optional_gather_config(
+                {"parallel_page_workers": -1}
+            )
 
-class TestSendDeletionSafeguardNotify:
-    """Unit tests for _send_deletion_safeguard_notify — no DB or plugins required."""
+        with pytest.raises(ValueError, match="page_retries must be an integer"):
+            harvester._validate_optional_gather_config({"page_retries": "x"})
 
-    def _make_harvester(self, ok_url=None, anomaly_url=None) -> DelwpHarvester:
-        h = DelwpHarvester()
-        h.deletion_safeguard_notify_ok_url = ok_url
-        h.deletion_safeguard_notify_anomaly_url = anomaly_url
-        return h
+        with pytest.raises(ValueError, match="gather_batch_size must be >= 1"):
+            harvester._validate_optional_gather_config({"gather_batch_size": 0})
 
-    def test_no_urls_configured_makes_no_request(self):
-        h = self._make_harvester()
-        with mock.patch(
-            "ckanext.datavic_harvester.harvesters.delwp.requests.get"
-        ) as mock_get:
-            h._send_deletion_safeguard_notify(anomaly=False)
-            h._send_deletion_safeguard_notify(anomaly=True)
-        mock_get.assert_not_called()
+        with pytest.raises(ValueError, match="replay_guids must be a list"):
+            harvester._validate_optional_gather_config(
+                {"replay_archive": "job-1", "replay_guids": "guid-a"}
+            )
 
-    def test_ok_url_called_when_no_anomaly(self):
-        h = self._make_harvester(ok_url="https://notify.example/ok")
-        with mock.patch(
-            "ckanext.datavic_harvester.harvesters.delwp.requests.get"
-        ) as mock_get:
-            h._send_deletion_safeguard_notify(anomaly=False)
-        mock_get.assert_called_once_with("https://notify.example/ok", timeout=10)
+        with pytest.raises(ValueError, match="fetch_prefetch_workers must be >= 0"):
+            harvester._validate_optional_gather_config(
+                {"fetch_prefetch_workers": -1}
+            )
 
-    def test_anomaly_url_called_when_anomaly(self):
-        h = self._make_harvester(anomaly_url="https://notify.example/anomaly")
-        with mock.patch(
-            "ckanext.datavic_harvester.harvesters.delwp.requests.get"
-        ) as mock_get:
-            h._send_deletion_safeguard_notify(anomaly=True)
-        mock_get.assert_called_once_with(
-            "https://notify.example/anomaly", timeout=10
-        )
+        with pytest.raises(ValueError, match="import_prefetch_workers must be >= 0"):
+            harvester._validate_optional_gather_config(
+                {"import_prefetch_workers": -1}
+            )
 
-    def test_request_failure_does_not_raise(self):
-        """Notify is fail-open: a network error should be logged but not
-        propagate as an exception."""
-        import requests as req_lib
+        with pytest.raises(ValueError, match="requires replay_archive"):
+            harvester._validate_optional_gather_config({"replay_guids": ["guid-a"]})
+
+        with pytest.raises(ValueError, match="hash_algorithm must be one of"):
+            harvester._validate_optional_gather_config({"hash_algorithm": "md5"})
 
-        h = self._make_harvester(ok_url="https://notify.example/ok")
-        with mock.patch(
-            "ckanext.datavic_harvester.harvesters.delwp.requests.get",
-            side_effect=req_lib.RequestException("timeout"),
-        ):
-            h._send_deletion_safeguard_notify(anomaly=False)  # must not raise
+
+@pytest.mark.parametrize(
+    "option", ["fetch_prefetch_workers", "import_prefetch_workers"]
+)
+def test_fetch_prefetch_workers_option(option: str):
+    harvester = DelwpHarvester()
+    mock_item = mock.MagicMock()
+    mock_item.source.config = json.dumps({"dataset_type": "x", option: 3})
+
+    with mock.patch.object(harvester, "_get_source_owner_org_id", return_value=None):
+        harvester._set_config(mock_item)
+
+    assert harvester.fetch_prefetch_workers == 3
 
 
 class TestIsPkgPrivate:
@@ -915,19 +1897,70 @@ class TestHarvestFilestore:
     def _h(self) -> DelwpHarvester:
         return DelwpHarvester()
 
-    def test_save_writes_json_file_with_records_key(self):
+    def test_writer_streams_records(self):
+        h = self._h()
+        records = [{"fields": {"uuid": str(i)}} for i in range(3)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with (
+                mock.patch.dict(os.environ, {"DELWP_HARVEST_JSON_RETENTION_DAYS": "7"}),
+                mock.patch.object(h, "_get_harvest_filestore_dir", return_value=tmpdir),
+            ):
+                with h._open_harvest_json_writer("job-123") as writer:
+                    for record in records:
+                        writer.write(record)
+
+                    # nothing under the final name until the block is done
+                    assert all(f.endswith(".part") for f in os.listdir(tmpdir))
+
+            assert sorted(f.split("_", 2)[-1] for f in os.listdir(tmpdir)) == [
+                "job-123.idx.json",
+                "job-123.jsonl.gz",
+            ]
+            archive = [f for f in os.listdir(tmpdir) if f.endswith(".jsonl.gz")][0]
+            assert list(read_archive(os.path.join(tmpdir, archive))) == records
+
+    def test_writer_removes_partial_file_on_error(self):
+        h = self._h()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with (
+                mock.patch.dict(os.environ, {"DELWP_HARVEST_JSON_RETENTION_DAYS": "7"}),
+                mock.patch.object(h, "_get_harvest_filestore_dir", return_value=tmpdir),
+                pytest.raises(PageFetchError),
+            ):
+                with h._open_harvest_json_writer("job-123") as writer:
+                    writer.write({"fields": {"uuid": "x"}})
+                    raise PageFetchError("page 2")
+
+            assert os.listdir(tmpdir) == []
+
+    def test_read_archive_by_job_id_and_guids(self):
         h = self._h()
-        records = [{"fields": {"uuid": "abc", "title": "Test"}}]
+        records = [{"fields": {"uuid": f"guid-{i}"}} for i in range(250)]
         with tempfile.TemporaryDirectory() as tmpdir:
             with (
                 mock.patch.dict(os.environ, {"DELWP_HARVEST_JSON_RETENTION_DAYS": "7"}),
                 mock.patch.object(h, "_get_harvest_filestore_dir", return_value=tmpdir),
             ):
-                h._save_harvest_json_to_filestore(records, "job-123")
-            files = [f for f in os.listdir(tmpdir) if f.endswith(".json")]
-            assert len(files) == 1
-            with open(os.path.join(tmpdir, files[0])) as f:
-                assert json.load(f)["records"] == records
+                with h._open_harvest_json_writer("job-123") as writer:
+                    for record in records:
+                        writer.write(record)
+
+                assert list(h._read_harvest_archive("job-123")) == records
+                assert list(
+                    h._read_harvest_archive("job-123", ["guid-249", "guid-3"])
+                ) == [records[3], records[249]]
+
+                archive = [f for f in os.listdir(tmpdir) if f.endswith(".jsonl.gz")][0]
+                assert len(list(h._read_harvest_archive(archive))) == 250
+
+    def test_read_missing_archive_raises(self):
+        h = self._h()
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            mock.patch.object(h, "_get_harvest_filestore_dir", return_value=tmpdir),
+            pytest.raises(ReplayError),
+        ):
+            list(h._read_harvest_archive("job-404"))
 
     def test_save_skipped_when_retention_zero(self):
         h = self._h()
@@ -935,7 +1968,8 @@ class TestHarvestFilestore:
             mock.patch.dict(os.environ, {"DELWP_HARVEST_JSON_RETENTION_DAYS": "0"}),
             mock.patch.object(h, "_get_harvest_filestore_dir") as mock_dir,
         ):
-            h._save_harvest_json_to_filestore([{"fields": {"uuid": "x"}}], "job-1")
+            with h._open_harvest_json_writer("job-1") as writer:
+                writer.write({"fields": {"uuid": "x"}})
         mock_dir.assert_not_called()
 
     def test_save_skipped_when_no_storage_path(self):
@@ -944,7 +1978,8 @@ class TestHarvestFilestore:
             mock.patch.dict(os.environ, {"DELWP_HARVEST_JSON_RETENTION_DAYS": "7"}),
             mock.patch.object(h, "_get_harvest_filestore_dir", return_value=None),
         ):
-            h._save_harvest_json_to_filestore([{"fields": {"uuid": "x"}}], "job-1")
+            with h._open_harvest_json_writer("job-1") as writer:
+                writer.write({"fields": {"uuid": "x"}})
 
 
 class TestPurgedDatasetRecreation:
@@ -1266,6 +2301,32 @@ class TestCalculateHashForDataDict:
             pkg_a
         ) == harvester._calculate_hash_for_data_dict(pkg_b)
 
+    def test_hash_matches_stored_sha256_hashes(self):
+        """Hashes stored before the algorithm could be configured must still
+        match, otherwise every dataset is updated on the next run."""
+        harvester = DelwpHarvester()
+        pkg = self._base_pkg_dict()
+        payload = {key: pkg[key] for key in HASH_PKG_FIELDS if key in pkg}
+        payload["resources"] = [
+            {key: pkg["resources"][0][key] for key in HASH_RESOURCE_FIELDS}
+        ]
+
+        assert harvester._calculate_hash_for_data_dict(pkg) == sha256(
+            json.dumps(payload, sort_keys=True).encode()
+        ).hexdigest()
+
+    def test_hash_algorithm(self):
+        harvester = DelwpHarvester()
+        pkg = self._base_pkg_dict()
+        sha256_hash = harvester._calculate_hash_for_data_dict(pkg)
+
+        harvester.hash_algorithm = "blake2b"
+        blake2b_hash = harvester._calculate_hash_for_data_dict(pkg)
+
+        assert blake2b_hash.startswith("blake2b:")
+        assert blake2b_hash != sha256_hash
+        assert blake2b_hash == harvester._calculate_hash_for_data_dict(pkg)
+
 
 class TestPreserveResourceIds:
     """Unit tests for _preserve_resource_ids (resource UUID carry-forward).
@@ -1542,6 +2603,97 @@ class TestPreserveResourceIds:
         assert "id" not in result[0]
 
 
+class TestPartialUpdates:
+    """Unit tests for _get_partial_update (no DB)."""
+
+    def _pkg_dict(self) -> dict[str, Any]:
+        return {
+            "title": "Coastal hazard assessment",
+            "notes": "An abstract from the source.",
+            "tags": [{"name": "coast"}],
+            "owner_org": "some-org-id",
+            "resources": [
+                {"name": "Coastal WMS", "format": "WMS", "url": "https://a.example/wms"},
+                {"name": "Coastal WFS", "format": "WFS", "url": "https://a.example/wfs"},
+            ],
+        }
+
+    def _existing(self, harvester: DelwpHarvester, pkg_dict: dict[str, Any]):
+        data_hash = harvester._calculate_hash_for_data_dict(pkg_dict)
+        resources = []
+        for i, res in enumerate(pkg_dict["resources"]):
+            resource = mock.MagicMock(id=f"res-{i}", format=res["format"])
+            resource.name = res["name"]
+            resources.append(resource)
+
+        return ExistingPackage(
+            id="pkg-id",
+            name="coastal-hazard-assessment",
+            title=pkg_dict["title"],
+            state="active",
+            data_hash=data_hash,
+            resources=resources,
+            data_hash_sections=json.dumps(
+                harvester._calculate_hash_sections(pkg_dict, data_hash)
+            ),
+        )
+
+    def _plan(self, harvester: DelwpHarvester, pkg, pkg_dict: dict[str, Any]):
+        data_hash = harvester._calculate_hash_for_data_dict(pkg_dict)
+        return harvester._get_partial_update(
+            pkg_dict, pkg, harvester._calculate_hash_sections(pkg_dict, data_hash)
+        )
+
+    def test_changed_metadata(self):
+        harvester = DelwpHarvester()
+        pkg_dict = self._pkg_dict()
+        pkg = self._existing(harvester, pkg_dict)
+        pkg_dict["notes"] = "A new abstract."
+
+        assert self._plan(harvester, pkg, pkg_dict) == PartialUpdate(
+            metadata=True, resources=[]
+        )
+
+    def test_changed_resource(self):
+        harvester = DelwpHarvester()
+        pkg_dict = self._pkg_dict()
+        pkg = self._existing(harvester, pkg_dict)
+        pkg_dict["resources"][1]["url"] = "https://b.example/wfs"
+
+        assert self._plan(harvester, pkg, pkg_dict) == PartialUpdate(
+            metadata=False, resources=[("res-1", pkg_dict["resources"][1])]
+        )
+
+    @pytest.mark.parametrize(
+        "change",
+        [
+            # metadata and a resource
+            lambda d: d.update(notes="New") or d["resources"][0].update(url="x"),
+            # several resources
+            lambda d: [r.update(url="x") for r in d["resources"]],
+            # added resource
+            lambda d: d["resources"].append({"name": "Extra", "format": "CSV"}),
+            # renamed resource
+            lambda d: d["resources"][0].update(name="Renamed"),
+        ],
+    )
+    def test_full_update(self, change):
+        harvester = DelwpHarvester()
+        pkg_dict = self._pkg_dict()
+        pkg = self._existing(harvester, pkg_dict)
+        change(pkg_dict)
+
+        assert self._plan(harvester, pkg, pkg_dict) is None
+
+    def test_outdated_sections_are_not_used(self):
+        harvester = DelwpHarvester()
+        pkg_dict = self._pkg_dict()
+        pkg = self._existing(harvester, pkg_dict)._replace(data_hash="other")
+        pkg_dict["notes"] = "A new abstract."
+
+        assert self._plan(harvester, pkg, pkg_dict) is None
+
+
 class TestChangeDetectionIntegration:
     """Integration tests for the change-detection / idempotency behaviour.
 
@@ -1611,6 +2763,96 @@ class TestChangeDetectionIntegration:
         resource_ids_after_second = [r["id"] for r in pkg_after_second["resources"]]
         assert resource_ids_after_second == resource_ids_after_first
 
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_existing_packages_are_loaded_once_per_job(
+        self,
+        harvester: DelwpHarvester,
+        harvest_source_factory,
+        harvest_job_factory,
+        harvest_object_factory,
+        delwp_dataset: dict,
+        delwp_config,
+    ):
+        """The change path reads the stored hash, state, name and resources of
+        every package of the job from one bulk load instead of loading each
+        package through the ORM."""
+        source = harvest_source_factory(
+            config=json.dumps(delwp_config),
+            source_type=harvester.info()["name"],
+        )
+        first_job = harvest_job_factory(source=source)
+        datasets = [
+            {
+                **delwp_dataset,
+                "uuid": f"{delwp_dataset['uuid']}-{i}",
+                "title": f"{delwp_dataset['title']} {i}",
+            }
+            for i in range(2)
+        ]
+        package_ids = []
+
+        for dataset in datasets:
+            obj = harvest_object_factory(
+                guid=dataset["uuid"], content=json.dumps(dataset), job=first_job
+            )
+            assert harvester.import_stage(obj) is True
+            package_ids.append(obj.package_id)
+
+        second_job = harvest_job_factory(source=source)
+        objects = [
+            harvest_object_factory(
+                guid=dataset["uuid"],
+                content=json.dumps(dataset),
+                job=second_job,
+                package_id=package_id,
+                extras={"status": "change"},
+            )
+            for dataset, package_id in zip(datasets, package_ids)
+        ]
+
+        with (
+            mock.patch.object(
+                harvester,
+                "_load_existing_packages",
+                wraps=harvester._load_existing_packages,
+            ) as load_packages,
+            mock.patch.object(
+                model.Package, "get", wraps=model.Package.get
+            ) as package_get,
+        ):
+            for obj in objects:
+                assert harvester.import_stage(obj) == "unchanged"
+
+        load_packages.assert_called_once()
+        assert sorted(load_packages.call_args[0][0]) == sorted(package_ids)
+        assert not {
+            call.args[0] for call in package_get.call_args_list
+        } & set(package_ids)
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_load_existing_packages(
+        self, harvester: DelwpHarvester, dataset_factory
+    ):
+        dataset = dataset_factory(
+            extras=[{"key": "harvester_data_hash", "value": "abc"}],
+            resources=[
+                {"name": "First", "format": "CSV", "url": "https://a.example/1"},
+                {"name": "Second", "format": "WMS", "url": "https://a.example/2"},
+            ],
+        )
+
+        packages = harvester._load_existing_packages([dataset["id"], "missing"])
+
+        assert list(packages) == [dataset["id"]]
+        package = packages[dataset["id"]]
+        assert package.name == dataset["name"]
+        assert package.state == "active"
+        assert package.data_hash == "abc"
+        assert [(r.name, r.format) for r in package.resources] == [
+            ("First", "CSV"),
+            ("Second", "WMS"),
+        ]
+
     @pytest.mark.usefixtures("with_plugins", "clean_db")
     def test_metadata_change_triggers_update_resource_ids_preserved(
         self,
@@ -1757,3 +2999,222 @@ class TestChangeDetectionIntegration:
 
         pkg_after_update = call_action("package_show", id=package_id)
         assert pkg_after_update.get("syndicated_id") == expected_syndicated_id
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_read_preserved_metadata_matches_package_show(
+        self, harvester: DelwpHarvester, dataset_factory
+    ):
+        dataset = dataset_factory(
+            syndicated_id="remote-portal-uuid-abc123",
+            maintainer_email="maintainer@example.com",
+            skip_syndication=True,
+            extras=[
+                {"key": "harvester_data_hash", "value": "abc"},
+                {"key": "custom", "value": "value"},
+            ],
+        )
+
+        shown = harvester._show_preserved_metadata(dataset["id"])
+        read = harvester._read_preserved_metadata(dataset["id"])
+
+        assert read is not None
+        assert read["extras"] == [
+            {"key": e["key"], "value": e["value"]} for e in shown.get("extras", [])
+        ]
+        assert {key: read.get(key) for key in PRESERVE_PKG_FIELDS} == {
+            key: shown.get(key) for key in PRESERVE_PKG_FIELDS
+        }
+        assert read["syndicated_id"] == "remote-portal-uuid-abc123"
+        assert read["skip_syndication"] == shown["skip_syndication"]
+
+    @pytest.mark.parametrize(
+        "output_validators, stored, shown",
+        [
+            ("", "value", "value"),
+            ("boolean_validator", "True", True),
+            ("boolean_validator", "false", False),
+            ("scheming_multiple_choice_output", '["a", "b"]', ["a", "b"]),
+        ],
+    )
+    @pytest.mark.usefixtures("with_plugins")
+    def test_show_field_value_runs_output_validators(
+        self, output_validators: str, stored: str, shown: Any
+    ):
+        field = {"field_name": "field", "output_validators": output_validators}
+
+        assert _show_field_value(field, stored) == shown
+
+    @pytest.mark.usefixtures("with_plugins")
+    def test_show_field_value_with_unknown_validator(self):
+        field = {"field_name": "field", "output_validators": "no_such_validator"}
+
+        with pytest.raises(ValueError, match="cannot show field field"):
+            _show_field_value(field, "value")
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_preserve_existing_metadata_does_not_show_package(
+        self, harvester: DelwpHarvester, dataset_factory
+    ):
+        dataset = dataset_factory(syndicated_id="remote-portal-uuid-abc123")
+        pkg = harvester._load_existing_packages([dataset["id"]])[dataset["id"]]
+
+        with mock.patch.object(
+            harvester, "_show_preserved_metadata"
+        ) as show_metadata:
+            pkg_dict: dict[str, Any] = {}
+            harvester._preserve_existing_metadata(pkg_dict, pkg)
+
+        show_metadata.assert_not_called()
+        assert pkg_dict["syndicated_id"] == "remote-portal-uuid-abc123"
+
+    @pytest.mark.benchmark
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_preserve_existing_metadata_benchmark(
+        self, harvester: DelwpHarvester, dataset_factory
+    ):
+        """Time the metadata preservation of one update with the direct read
+        and with package_show, for a package with many resources."""
+        dataset = dataset_factory(
+            syndicated_id="remote-portal-uuid-abc123",
+            resources=[
+                {"name": f"Resource {i}", "format": "CSV", "url": f"https://a.example/{i}"}
+                for i in range(50)
+            ],
+        )
+        pkg = harvester._load_existing_packages([dataset["id"]])[dataset["id"]]
+        rounds = 20
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            harvester._show_preserved_metadata(pkg.id)
+        show_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            harvester._preserve_existing_metadata({}, pkg)
+        read_time = time.perf_counter() - start
+
+        print(
+            f"preserve metadata x{rounds}: package_show {show_time:.3f}s, "
+            f"direct read {read_time:.3f}s"
+        )
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_partial_update_of_changed_metadata(
+        self,
+        harvester: DelwpHarvester,
+        harvest_source_factory,
+        harvest_job_factory,
+        harvest_object_factory,
+        delwp_dataset: dict,
+        delwp_config,
+    ):
+        """With partial_updates, a change of the abstract only updates the
+        package fields and leaves the resources alone."""
+        source = harvest_source_factory(
+            config=json.dumps({**delwp_config, "partial_updates": True}),
+            source_type=harvester.info()["name"],
+        )
+        job = harvest_job_factory(source=source)
+
+        obj1 = harvest_object_factory(
+            guid=delwp_dataset["uuid"],
+            content=json.dumps(delwp_dataset),
+            job=job,
+        )
+        assert harvester.import_stage(obj1) is True
+        package_id = obj1.package_id
+        pkg_after_first = call_action("package_show", id=package_id)
+        assert HASH_SECTIONS_FIELD in {e["key"] for e in pkg_after_first["extras"]}
+
+        obj2 = harvest_object_factory(
+            guid=delwp_dataset["uuid"],
+            content=json.dumps(
+                {**delwp_dataset, "abstract": delwp_dataset["abstract"] + " More."}
+            ),
+            job=job,
+            package_id=package_id,
+            extras={"status": "change"},
+        )
+
+        with mock.patch.object(
+            harvester, "_preserve_resource_ids", wraps=harvester._preserve_resource_ids
+        ) as preserve_resource_ids:
+            assert harvester.import_stage(obj2) is True
+
+        preserve_resource_ids.assert_not_called()
+        pkg_after_second = call_action("package_show", id=package_id)
+        assert pkg_after_second["notes"].endswith(" More.")
+        assert [r["id"] for r in pkg_after_second["resources"]] == [
+            r["id"] for r in pkg_after_first["resources"]
+        ]
+
+    @pytest.mark.usefixtures("with_plugins", "clean_db")
+    def test_partial_update_of_changed_resource(
+        self,
+        harvester: DelwpHarvester,
+        harvest_source_factory,
+        harvest_job_factory,
+        harvest_object_factory,
+        delwp_dataset: dict,
+        delwp_config,
+    ):
+        """With partial_updates, a changed resource is written together with
+        the new hashes, the other resources and the extras are kept."""
+        source = harvest_source_factory(
+            config=json.dumps({**delwp_config, "partial_updates": True}),
+            source_type=harvester.info()["name"],
+        )
+        job = harvest_job_factory(source=source)
+
+        obj1 = harvest_object_factory(
+            guid=delwp_dataset["uuid"],
+            content=json.dumps(delwp_dataset),
+            job=job,
+        )
+        assert harvester.import_stage(obj1) is True
+        package_id = obj1.package_id
+        pkg_after_first = call_action("package_show", id=package_id)
+        call_action(
+            "package_patch",
+            id=package_id,
+            extras=pkg_after_first["extras"] + [{"key": "local", "value": "kept"}],
+        )
+
+        resources = harvester._fetch_resources(
+            dict(delwp_dataset, _uuid=delwp_dataset["uuid"])
+        )
+        assert len(resources) > 1
+        resources[-1]["url"] = "https://example.com/changed"
+
+        obj2 = harvest_object_factory(
+            guid=delwp_dataset["uuid"],
+            content=json.dumps({**delwp_dataset, FETCHED_RESOURCES: resources}),
+            job=job,
+            package_id=package_id,
+            extras={"status": "change"},
+        )
+
+        with mock.patch.object(
+            harvester, "_preserve_resource_ids", wraps=harvester._preserve_resource_ids
+        ) as preserve_resource_ids:
+            assert harvester.import_stage(obj2) is True
+
+        preserve_resource_ids.assert_not_called()
+        pkg_after_second = call_action("package_show", id=package_id)
+        assert [r["id"] for r in pkg_after_second["resources"]] == [
+            r["id"] for r in pkg_after_first["resources"]
+        ]
+        assert pkg_after_second["resources"][-1]["url"] == "https://example.com/changed"
+        assert [r["url"] for r in pkg_after_second["resources"][:-1]] == [
+            r["url"] for r in pkg_after_first["resources"][:-1]
+        ]
+
+        extras = {e["key"]: e["value"] for e in pkg_after_second["extras"]}
+        assert extras["local"] == "kept"
+
+        data_hash_sections = json.loads(extras[HASH_SECTIONS_FIELD])
+        assert pkg_after_second["harvester_data_hash"] != pkg_after_first[
+            "harvester_data_hash"
+        ]
+        assert data_hash_sections["hash"] == pkg_after_second["harvester_data_hash"]
@@ -0,0 +1,87 @@
+import gzip
+import json
+from unittest import mock
+
+import pytest
+
+from ckanext.datavic_harvester import archive as archive_module
+from ckanext.datavic_harvester.archive import ArchiveWriter, read_archive
+
+
+def _key(record):
+    return record["id"]
+
+
+@pytest.fixture
+def records():
+    return [{"id": f"record-{i}", "title": f"Title {i} – ü"} for i in range(25)]
+
+
+@pytest.fixture
+def archive(tmp_path, records):
+    archive_path = str(tmp_path / "job.jsonl.gz")
+    index_path = str(tmp_path / "job.idx.json")
+
+    writer = ArchiveWriter(key=_key, block_size=10)
+    writer.open(archive_path, index_path)
+    for record in records:
+        writer.write(record)
+    writer.close()
+
+    assert writer.count == len(records)
+    assert writer.error is None
+
+    return archive_path, index_path
+
+
+class TestArchive:
+    def test_archive_is_plain_jsonl_gzip(self, archive, records):
+        archive_path, _ = archive
+
+        with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+            assert [json.loads(line) for line in f] == records
+
+    def test_read_all(self, archive, records):
+        assert list(read_archive(archive[0])) == records
+
+    def test_read_selected_records_through_index(self, archive, records):
+        archive_path, index_path = archive
+
+        with mock.patch.object(
+            archive_module, "_read_block", wraps=archive_module._read_block
+        ) as read_block:
+            selected = list(
+                read_archive(archive_path, index_path, keys=["record-21", "record-2"])
+            )
+
+        assert selected == [records[2], records[21]]
+        assert read_block.call_count == 2
+
+    def test_read_selected_records_without_index(self, archive, records):
+        archive_path, _ = archive
+
+        selected = list(
+            read_archive(
+                archive_path, archive_path + ".missing", keys=["record-5"], key=_key
+            )
+        )
+
+        assert selected == [records[5]]
+
+    def test_unknown_key_is_skipped(self, archive):
+        assert list(read_archive(*archive, keys=["missing"])) == []
+
+    def test_write_error_is_kept(self, tmp_path):
+        writer = ArchiveWriter(key=_key, block_size=1)
+        writer.open(str(tmp_path / "job.jsonl.gz"), str(tmp_path / "job.idx.json"))
+
+        with mock.patch.object(
+            writer._file, "write", side_effect=OSError("disk full")
+        ):
+            writer.write({"id": "a"})
+
+        writer.write({"id": "b"})
+        writer.close()
+
+        assert isinstance(writer.error, OSError)
+        assert writer.count == 2
@@ -0,0 +1,81 @@
+import time
+from unittest import mock
+
+import pytest
+
+from ckanext.datavic_harvester import cache as cache_module
+from ckanext.datavic_harvester.cache import ValidatorCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ValidatorCache(str(tmp_path / "cache.sqlite3"), "filesize", 3600, 100)
+
+
+class TestValidatorCache:
+    def test_set_and_get(self, cache: ValidatorCache):
+        assert cache.get("https://a.example/1") is None
+
+        cache.set("https://a.example/1", 10, etag='"abc"', content_length="10")
+
+        entry = cache.get("https://a.example/1")
+        assert entry.value == 10
+        assert entry.etag == '"abc"'
+        assert entry.last_modified is None
+        assert entry.content_length == "10"
+
+    def test_namespaces_are_separate(self, tmp_path, cache: ValidatorCache):
+        other = ValidatorCache(str(tmp_path / "cache.sqlite3"), "other", 3600, 100)
+
+        cache.set("https://a.example/1", 10)
+
+        assert other.get("https://a.example/1") is None
+
+    def test_expired_entry_is_dropped(self, cache: ValidatorCache):
+        cache.set("https://a.example/1", 10)
+
+        with mock.patch.object(time, "time", return_value=time.time() + 7200):
+            assert cache.get("https://a.example/1") is None
+
+        assert cache.stats()["entries"] == 0
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path):
+        cache = ValidatorCache(str(tmp_path / "cache.sqlite3"), "filesize", 0, 2)
+
+        cache.set("https://a.example/1", 1)
+        cache.set("https://a.example/2", 2)
+        cache.set("https://a.example/3", 3)
+        cache.get("https://a.example/1")
+
+        cache._evict(time.time() + 1)
+
+        assert cache.get("https://a.example/1")
+        assert cache.get("https://a.example/2") is None
+        assert cache.get("https://a.example/3")
+        assert cache.stats()["evictions"] == 1
+
+    def test_stats(self, cache: ValidatorCache):
+        cache.set("https://a.example/1", 10)
+        cache.record_hit()
+        cache.record_miss()
+        cache.record_miss()
+
+        assert cache.stats() == {
+            "hits": 1,
+            "misses": 2,
+            "evictions": 0,
+            "entries": 1,
+        }
+
+
+class TestGetCache:
+    def test_cache_is_shared_per_namespace(self, tmp_path, ckan_config, monkeypatch):
+        monkeypatch.setitem(
+            ckan_config, cache_module.CONFIG_CACHE_PATH, str(tmp_path / "c.sqlite3")
+        )
+        monkeypatch.setattr(cache_module, "_caches", {})
+
+        cache = cache_module.get_cache("filesize", 3600, 100)
+
+        assert cache is cache_module.get_cache("filesize", 3600, 100)
+        assert cache is not cache_module.get_cache("other", 3600, 100)
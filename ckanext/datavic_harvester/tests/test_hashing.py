@@ -0,0 +1,42 @@
+import hashlib
+import json
+
+import pytest
+
+from ckanext.datavic_harvester.hashing import canonical_hash
+
+
+@pytest.fixture
+def payload():
+    return {
+        "title": "Title – ü",
+        "private": False,
+        "tags": [{"name": "b"}, {"name": "a"}],
+        "resources": [{"url": "https://a.example/1", "format": "CSV", "size": 1.5}],
+        "notes": None,
+    }
+
+
+class TestCanonicalHash:
+    def test_sha256_is_compatible(self, payload):
+        assert canonical_hash(payload) == hashlib.sha256(
+            json.dumps(payload, sort_keys=True).encode()
+        ).hexdigest()
+
+    def test_key_order_does_not_matter(self, payload):
+        reordered = dict(reversed(list(payload.items())))
+
+        assert canonical_hash(reordered, "blake2b") == canonical_hash(
+            payload, "blake2b"
+        )
+
+    def test_other_algorithms_are_prefixed(self, payload):
+        digest = canonical_hash(payload, "blake2b")
+
+        assert digest == "blake2b:" + hashlib.blake2b(
+            json.dumps(payload, sort_keys=True).encode(), digest_size=32
+        ).hexdigest()
+
+    def test_unknown_algorithm(self, payload):
+        with pytest.raises(ValueError, match="hash_algorithm must be one of"):
+            canonical_hash(payload, "md5")
@@ -1,3 +1,8 @@
+import json
+import time
+from os import path
+from unittest import mock
+
 import pytest
 from bs4 import BeautifulSoup
 
@@ -55,3 +60,150 @@ class TestHelpers:
 
         assert "span" not in result
         assert "<a" in result
+
+
+class TestFieldChoiceLookup:
+    CHOICES = [
+        {"label": "Daily", "value": "daily"},
+        {"label": "Weekly", "value": "weekly"},
+        {"label": "DAILY", "value": "daily-duplicate"},
+    ]
+
+    @pytest.fixture(autouse=True)
+    def clear_lookups(self):
+        h.clear_field_choice_lookups()
+        yield
+        h.clear_field_choice_lookups()
+
+    def test_lookup_is_lowercased_and_keeps_first_label(self):
+        with (
+            mock.patch.object(h, "field_choices", return_value=self.CHOICES),
+            mock.patch.object(h, "_get_dataset_schemas", return_value=None),
+        ):
+            assert h.get_field_choice_lookup("update_frequency") == {
+                "daily": "daily",
+                "weekly": "weekly",
+            }
+            assert h.map_update_frequency("WEEKLY") == "weekly"
+            assert h.map_update_frequency("random") == "unknown"
+
+    def test_lookup_is_built_once_per_schema_load(self):
+        schemas = {"dataset": {}}
+
+        with (
+            mock.patch.object(
+                h, "field_choices", return_value=self.CHOICES
+            ) as field_choices,
+            mock.patch.object(h, "_get_dataset_schemas", return_value=schemas),
+        ):
+            for _ in range(3):
+                h.map_update_frequency("daily")
+
+            assert field_choices.call_count == 1
+
+        with (
+            mock.patch.object(
+                h, "field_choices", return_value=self.CHOICES[1:2]
+            ) as field_choices,
+            mock.patch.object(
+                h, "_get_dataset_schemas", return_value={"dataset": {}}
+            ),
+        ):
+            assert h.map_update_frequency("daily") == "unknown"
+            assert field_choices.call_count == 1
+
+
+class TestIterScriptTexts:
+    PAGE = (
+        "<html><head><script>var a = 1;</script>"
+        '<script id="freq">var f = "Weekly";</script></head>'
+        '<body><script id="freq">var f = "<b>Daily</b>";</script></body></html>'
+    )
+
+    def test_matches_soup(self):
+        soup = BeautifulSoup(self.PAGE, "html.parser")
+        expected = [tag.string for tag in soup("script", attrs={"id": "freq"})]
+
+        assert list(h.iter_script_texts([self.PAGE], "freq")) == expected
+
+    def test_split_chunks(self):
+        chunks = [self.PAGE[i : i + 7] for i in range(0, len(self.PAGE), 7)]
+
+        assert list(h.iter_script_texts(chunks, "freq")) == list(
+            h.iter_script_texts([self.PAGE], "freq")
+        )
+
+    def test_missing(self):
+        assert not list(h.iter_script_texts([self.PAGE], "missing"))
+        assert not list(h.iter_script_texts([], "freq"))
+
+
+class TestSanitiseHtml:
+    @pytest.fixture
+    def descriptions(self) -> list[str]:
+        here: str = path.abspath(path.dirname(__file__))
+        with open(path.join(here, "../data/dcat_json_datasets.txt")) as f:
+            return [dataset["description"] for dataset in json.load(f)["dataset"]]
+
+    def _soup_result(self, html: str) -> h.SanitisedHtml:
+        soup = BeautifulSoup(html, "html.parser")
+        links = [tag["href"] for tag in soup.find_all("a") if "href" in tag.attrs]
+        notes = h.unwrap_all_except(h.remove_all_attrs_except_for(soup))
+
+        return h.SanitisedHtml(notes, soup.get_text(), links)
+
+    def test_matches_soup_on_corpus(self, descriptions: list[str]):
+        for description in descriptions:
+            assert h.sanitise_html(description) == self._soup_result(description)
+
+    @pytest.mark.parametrize(
+        "html",
+        [
+            "<a href='x' rel='y' target=_blank class='c'>hi</a>",
+            "&amp; &lt; &copy &foo; &#8217; &#150; &#129;",
+            "<p>unclosed <a href=a>link <b>bold</a> after</b> tail",
+            "<br>text</br><br/><br href='q' style=s>",
+            "<a href=\"a'b\">q</a><a href='a\"b'>r</a><a href='a\"b&apos;c'>s</a>",
+            "<pre>   </pre>  \n  <div> \t </div>",
+            "<a href>empty</a><a href=1 href=2>duplicate</a><a><a>nested</a></a>",
+            "</a></p>x<a>",
+            "a < b > c & d",
+            "",
+            "<!-- comment -->text",
+            "<script>a<b</script>text",
+            "<!DOCTYPE html>text",
+            "<![CDATA[text]]>",
+            "<br><br/>text",
+        ],
+    )
+    def test_matches_soup(self, html: str):
+        assert h.sanitise_html(html) == self._soup_result(html)
+
+    def test_find_metadata_url(self):
+        links = ["https://localhost/data", "https://localhost/metadata/1"]
+
+        assert h.find_metadata_url(links, "/metadata") == links[1]
+        assert not h.find_metadata_url(links, "https://127.0.0.1/metadata")
+
+    @pytest.mark.benchmark
+    def test_benchmark(self, descriptions: list[str]):
+        """Time a pass of the sanitiser and of cleaning a soup with the
+        separate helpers"""
+        rounds = 5
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for description in descriptions:
+                self._soup_result(description)
+        soup_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for description in descriptions:
+                h.sanitise_html(description)
+        sanitise_time = time.perf_counter() - start
+
+        print(
+            f"sanitise descriptions x{rounds}: soup {soup_time:.3f}s, "
+            f"sanitiser {sanitise_time:.3f}s"
+        )
@@ -0,0 +1,99 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+import requests
+
+from ckanext.datavic_harvester import http_session
+from ckanext.datavic_harvester.http_session import SessionSettings
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_port}"
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def sessions():
+    with mock.patch.object(http_session, "_sessions", {}):
+        yield
+
+
+class TestGetSession:
+    def test_session_is_shared_per_settings(self):
+        session = http_session.get_session()
+
+        assert session is http_session.get_session(SessionSettings())
+        assert session is not http_session.get_session(SessionSettings(timeout=5))
+
+    def test_settings_from_source_config(self):
+        settings = http_session.get_session_settings(
+            {"http_pool_size": 20, "http_retries": 0, "http_timeout": "15"}
+        )
+
+        assert settings == SessionSettings(
+            pool_size=20,
+            retries=0,
+            backoff_factor=SessionSettings().backoff_factor,
+            timeout=15,
+        )
+
+    def test_default_timeout(self):
+        session = http_session.get_session(SessionSettings(timeout=7))
+
+        with mock.patch.object(requests.Session, "request") as mock_request:
+            session.get("https://a.example")
+            session.get("https://a.example", timeout=1)
+
+        assert mock_request.call_args_list[0].kwargs["timeout"] == 7
+        assert mock_request.call_args_list[1].kwargs["timeout"] == 1
+
+    def test_connections_are_reused(self, server):
+        session = http_session.get_session()
+
+        for _ in range(5):
+            assert session.get(server).text == "ok"
+
+        stats = http_session.connection_stats()[server]
+        assert stats == {"connections": 1, "requests": 5, "reused": 4}
+
+
+class TestValidateSessionConfig:
+    def test_valid_config(self):
+        http_session.validate_session_config(
+            {"http_pool_size": 4, "http_retries": 0, "http_backoff_factor": 1.5}
+        )
+
+    @pytest.mark.parametrize(
+        "config",
+        [
+            {"http_pool_size": 0},
+            {"http_retries": -1},
+            {"http_timeout": "soon"},
+            {"http_backoff_factor": -1},
+        ],
+    )
+    def test_invalid_config(self, config):
+        with pytest.raises(ValueError):
+            http_session.validate_session_config(config)
@@ -0,0 +1,266 @@
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import ckan.plugins.toolkit as tk
+
+from ckanext.datavic_harvester import indexing
+from ckanext.datavic_harvester.indexing import (
+    DeferredIndexer,
+    deferred_indexing,
+    validate_indexing_config,
+)
+
+
+@pytest.fixture
+def rebuild():
+    with mock.patch.object(indexing.search, "rebuild") as rebuild:
+        yield rebuild
+
+
+@pytest.fixture
+def indexer():
+    indexer = DeferredIndexer(batch_size=2, interval=3600)
+    indexer.job_id = "job-1"
+
+    with mock.patch.object(indexing, "_indexer", indexer):
+        yield indexer
+
+
+@pytest.fixture
+def revisions():
+    """Revisions of the package before and after the import"""
+    with mock.patch.object(
+        indexing, "_get_package_revision", side_effect=[None, ("now", "active")]
+    ) as get_package_revision:
+        yield get_package_revision
+
+
+@pytest.fixture
+def notify():
+    """The notify method of the CKAN search plugin, which indexes the
+    written packages"""
+    with mock.patch.object(
+        indexing.search.SynchronousSearchPlugin, "notify", mock.Mock(spec=[])
+    ) as notify:
+        yield notify
+
+
+@pytest.fixture
+def objects_left():
+    """Objects of the job left to import: more than the tests import"""
+    with mock.patch.object(
+        indexing, "_count_objects_to_import", return_value=10
+    ) as count_objects_to_import:
+        yield count_objects_to_import
+
+
+def _harvest_object(package_id="pkg-1"):
+    return SimpleNamespace(id="obj-1", harvest_job_id="job-1", package_id=package_id)
+
+
+class TestDeferredIndexer:
+    def test_full_batch_is_indexed(self, rebuild):
+        indexer = DeferredIndexer(batch_size=2, interval=3600)
+
+        indexer.add("a")
+        rebuild.assert_not_called()
+
+        indexer.add("b")
+        rebuild.assert_called_once_with(package_ids=["a", "b"])
+        assert indexer.pending == []
+
+    def test_package_is_queued_once(self, rebuild):
+        indexer = DeferredIndexer(batch_size=2, interval=3600)
+
+        indexer.add("a")
+        indexer.add("a")
+
+        rebuild.assert_not_called()
+        assert indexer.pending == ["a"]
+
+    def test_old_queue_is_indexed(self, rebuild):
+        indexer = DeferredIndexer(batch_size=100, interval=60)
+
+        with mock.patch.object(indexing.time, "monotonic", side_effect=[0, 0, 61]):
+            indexer.add("a")
+            indexer.add("b")
+
+        rebuild.assert_called_once_with(package_ids=["a", "b"])
+
+    def test_flush_in_batches(self, rebuild):
+        indexer = DeferredIndexer(batch_size=100, interval=3600)
+        for package_id in "abc":
+            indexer.add(package_id)
+
+        indexer.flush(2)
+
+        assert rebuild.call_args_list == [
+            mock.call(package_ids=["a", "b"]),
+            mock.call(package_ids=["c"]),
+        ]
+        assert indexer.batch_size == 100
+
+    def test_idle_queue_is_indexed_by_timer(self, rebuild):
+        indexer = DeferredIndexer(batch_size=100, interval=60)
+
+        with mock.patch.object(indexing.threading, "Timer") as timer:
+            indexer.add("a")
+            indexer.add("b")
+
+        timer.assert_called_once_with(60, indexer._flush_on_timer, (None,))
+        rebuild.assert_not_called()
+
+        with mock.patch.object(indexing.model.Session, "remove"):
+            indexer._flush_on_timer(None)
+
+        rebuild.assert_called_once_with(package_ids=["a", "b"])
+        timer.return_value.cancel.assert_called_once()
+
+    def test_failed_batch_is_indexed_one_at_a_time(self, rebuild):
+        rebuild.side_effect = [Exception("solr"), None, tk.ObjectNotFound()]
+        indexer = DeferredIndexer(batch_size=2, interval=3600)
+
+        with mock.patch.object(indexing.search, "clear") as clear:
+            indexer.add("a")
+            indexer.add("b")
+
+        assert rebuild.call_args_list[1:] == [mock.call("a"), mock.call("b")]
+        clear.assert_called_once_with("b")
+
+
+class TestDeferredIndexing:
+    def test_disabled(self, indexer, rebuild, objects_left):
+        with deferred_indexing(_harvest_object(), {}):
+            assert not getattr(indexing._local, "deferred", False)
+
+        assert indexer.pending == []
+        objects_left.assert_not_called()
+
+    def test_package_is_queued(self, indexer, rebuild, revisions, objects_left):
+        with deferred_indexing(
+            _harvest_object(), {"deferred_indexing": True}
+        ) as deferred_import:
+            assert indexing._local.deferred is True
+            deferred_import.result = True
+
+        assert indexing._local.deferred is False
+        assert indexer.pending == ["pkg-1"]
+        rebuild.assert_not_called()
+
+    def test_only_the_importing_thread_skips_indexing(
+        self, indexer, rebuild, revisions, objects_left, notify
+    ):
+        plugin = indexing.search.SynchronousSearchPlugin()
+
+        with deferred_indexing(
+            _harvest_object(), {"deferred_indexing": True}
+        ) as deferred_import:
+            plugin.notify("pkg-1", "changed")
+
+            other_thread = threading.Thread(
+                target=plugin.notify, args=("pkg-2", "changed")
+            )
+            other_thread.start()
+            other_thread.join()
+
+            deferred_import.result = True
+
+        plugin.notify("pkg-3", "changed")
+
+        assert notify.call_args_list == [
+            mock.call(plugin, "pkg-2", "changed"),
+            mock.call(plugin, "pkg-3", "changed"),
+        ]
+
+    @pytest.mark.parametrize(
+        "result, revisions",
+        [
+            ("unchanged", [("then", "active"), ("then", "active")]),
+            (False, [None, ("now", "active")]),
+            (True, [("then", "active"), ("then", "active")]),
+        ],
+    )
+    def test_package_is_not_queued_without_write(
+        self, indexer, rebuild, objects_left, result, revisions
+    ):
+        with mock.patch.object(
+            indexing, "_get_package_revision", side_effect=revisions
+        ):
+            with deferred_indexing(
+                _harvest_object(), {"deferred_indexing": True}
+            ) as deferred_import:
+                deferred_import.result = result
+
+        assert indexer.pending == []
+
+    def test_queue_is_indexed_after_last_object(self, indexer, rebuild):
+        config = {"deferred_indexing": True, "index_batch_size": 10}
+
+        with (
+            mock.patch.object(
+                indexing,
+                "_get_package_revision",
+                side_effect=[None, ("now", "active")] * 2,
+            ),
+            mock.patch.object(
+                indexing, "_count_objects_to_import", return_value=2
+            ) as count_objects_to_import,
+        ):
+            with deferred_indexing(_harvest_object(), config) as deferred_import:
+                deferred_import.result = True
+
+            rebuild.assert_not_called()
+
+            with deferred_indexing(
+                _harvest_object("pkg-2"), config
+            ) as deferred_import:
+                deferred_import.result = True
+
+        # the objects left are counted once per job, not for every object
+        count_objects_to_import.assert_called_once_with("job-1")
+        rebuild.assert_called_once_with(package_ids=["pkg-1", "pkg-2"])
+
+    def test_queue_is_indexed_on_job_change(self, indexer, rebuild):
+        indexer.add("pkg-0")
+
+        with deferred_indexing(
+            SimpleNamespace(id="obj-2", harvest_job_id="job-2", package_id=None), {}
+        ):
+            pass
+
+        rebuild.assert_called_once_with(package_ids=["pkg-0"])
+        assert indexer.job_id == "job-2"
+        assert indexer.objects_left is None
+
+    def test_source_batch_size(self, indexer, rebuild, revisions, objects_left):
+        with deferred_indexing(
+            _harvest_object(),
+            {"deferred_indexing": True, "index_batch_size": 1},
+        ) as deferred_import:
+            deferred_import.result = True
+
+        rebuild.assert_called_once_with(package_ids=["pkg-1"])
+        assert indexer.batch_size == 2
+
+
+class TestValidateIndexingConfig:
+    def test_valid(self):
+        config = {"deferred_indexing": "true", "index_batch_size": 50}
+        validate_indexing_config(config)
+
+        assert config["deferred_indexing"] is True
+
+    @pytest.mark.parametrize(
+        "config, error",
+        [
+            ({"deferred_indexing": "maybe"}, "deferred_indexing must be a boolean"),
+            ({"index_batch_size": "x"}, "index_batch_size must be an integer"),
+            ({"index_batch_size": 0}, "index_batch_size must be >= 1"),
+        ],
+    )
+    def test_invalid(self, config, error):
+        with pytest.raises(ValueError, match=error):
+            validate_indexing_config(config)